@@ -0,0 +1,560 @@
+"""
+Sharded JSONL artifacts with a random-access index.
+
+The generators can write their outputs as a directory instead of one
+pretty-printed JSON file:
+
+    generated_formats_new_sequences_<timestamp>/
+        manifest.json          metadata, other top-level keys, shard list
+        index.json             byte offset of every record + key lookups
+        shard-00000.jsonl[.gz|.zst]
+        shard-00001.jsonl[.gz|.zst]
+        ...
+
+Each shard holds one record of the main array (generated_sequences,
+generated_formats, ...) per line. The index maps substandard_id,
+format_number and (skill, problem_type) to record ordinals, so a consumer
+can fetch one record by seeking into one shard instead of loading the whole
+artifact. ArtifactReader reads both this layout and the legacy single-file
+JSON layout, so consumers accept either.
+
+Legacy files are streamed as well: iter_json_items walks one top-level array
+(or object) element by element and skips the rest of the file without
+parsing it, so memory stays bounded by the largest single record.
+
+JsonlCheckpoint records finished items of a long LLM run one line at a time,
+so an interrupted run can resume without repeating them.
+
+get_di_formats_path and iter_di_skills locate and stream the DI formats data
+that several scripts read.
+"""
+
+import os
+import io
+import json
+import gzip
+import threading
+from typing import Dict, Iterator, List, Optional, Tuple
+
+try:
+    import zstandard
+except ImportError:  # zstd compression is optional; gzip is always available
+    zstandard = None
+
+MANIFEST_NAME = "manifest.json"
+INDEX_NAME = "index.json"
+COMPRESSION_SUFFIXES = {None: "", "gzip": ".gz", "zstd": ".zst"}
+ARRAY_KEYS = ("generated_sequences", "generated_formats", "mappings", "results")
+
+
+# ============================================================================
+# Index keys
+# ============================================================================
+
+def record_keys(record: dict) -> Dict[str, str]:
+    """Index keys present in a record: substandard_id, format_number and skill_problem_type."""
+    keys = {}
+    if record.get('substandard_id'):
+        keys['substandard_id'] = record['substandard_id']
+    format_number = (record.get('generated_format') or {}).get('format_number') or record.get('format_number')
+    if format_number:
+        keys['format_number'] = format_number
+    if record.get('skill') and record.get('problem_type'):
+        keys['skill_problem_type'] = skill_problem_type_key(record['skill'], record['problem_type'])
+    return keys
+
+
+def skill_problem_type_key(skill: str, problem_type: str) -> str:
+    return f"{skill}\t{problem_type}"
+
+
+def detect_array_key(data: dict) -> str:
+    for key in ARRAY_KEYS:
+        if isinstance(data.get(key), list):
+            return key
+    raise ValueError(f"No record array found (expected one of {', '.join(ARRAY_KEYS)})")
+
+
+# ============================================================================
+# Streaming JSON
+# ============================================================================
+
+_DECODER = json.JSONDecoder()
+_NUMBER_CHARS = set("0123456789+-.eE")
+
+
+class _JsonStream:
+    """
+    Minimal pull parser over a text file for walking top-level JSON members.
+
+    Values are decoded in place with raw_decode (in C), reading more text
+    until the value is complete. Skipped containers are decoded one element
+    at a time, so memory is bounded by the largest element, not the member.
+    """
+
+    def __init__(self, f, chunk_size: int = 1 << 16):
+        self.f = f
+        self.chunk_size = chunk_size
+        self.buf = ""
+        self.pos = 0
+        self.eof = False
+
+    def _fill(self) -> bool:
+        """Read another chunk, dropping text before the current position."""
+        if self.eof:
+            return False
+        self.buf = self.buf[self.pos:]
+        self.pos = 0
+        data = self.f.read(self.chunk_size)
+        if not data:
+            self.eof = True
+            return False
+        self.buf += data
+        return True
+
+    def peek(self) -> str:
+        """Next non-whitespace character ("" at end of file)."""
+        while True:
+            while self.pos < len(self.buf) and self.buf[self.pos] in " \t\r\n":
+                self.pos += 1
+            if self.pos < len(self.buf):
+                return self.buf[self.pos]
+            if not self._fill():
+                return ""
+
+    def expect(self, char: str) -> None:
+        if self.peek() != char:
+            raise ValueError(f"Expected {char!r} at offset {self.pos}, found {self.peek()!r}")
+        self.pos += 1
+
+    def skip_comma(self) -> None:
+        if self.peek() == ",":
+            self.pos += 1
+
+    def read_value(self):
+        self.peek()
+        while True:
+            try:
+                value, end = _DECODER.raw_decode(self.buf, self.pos)
+            except json.JSONDecodeError:
+                if self.eof:
+                    raise
+                end = None
+            # A number cut off by the end of the buffer ("12" of "125", "1" of "1.5") decodes
+            # early; valid JSON never has a number character right after a value
+            if end is not None and (self.eof or (end < len(self.buf) and self.buf[end] not in _NUMBER_CHARS)):
+                self.pos = end
+                return value
+            self.buf = self.buf[self.pos:]
+            self.pos = 0
+            # Grow reads with the value so a huge value is not re-decoded once per chunk
+            data = self.f.read(max(self.chunk_size, len(self.buf)))
+            if not data:
+                self.eof = True
+            self.buf += data
+
+    def skip_value(self) -> None:
+        """Skip a value; a container is decoded one element at a time and discarded."""
+        opening = self.peek()
+        if opening not in ("[", "{"):
+            self.read_value()
+            return
+        self.pos += 1
+        closing = "]" if opening == "[" else "}"
+        while self.peek() not in (closing, ""):
+            if opening == "{":
+                self.read_value()
+                self.expect(":")
+            self.read_value()
+            self.skip_comma()
+        self.expect(closing)
+
+
+def _walk_top_level(stream: _JsonStream) -> Iterator[str]:
+    """Yield each top-level member name; the caller must read or skip its value before resuming."""
+    stream.expect("{")
+    while stream.peek() not in ("}", ""):
+        name = stream.read_value()
+        stream.expect(":")
+        yield name
+        stream.skip_comma()
+
+
+def iter_json_items(path: str, key: str, chunk_size: int = 1 << 16) -> Iterator:
+    """
+    Stream one top-level member of a JSON file without loading the file.
+
+    Yields the elements of an array member, or (name, value) pairs of an
+    object member; other members are skipped unparsed.
+    """
+    with open(path, "r", encoding="utf-8") as f:
+        stream = _JsonStream(f, chunk_size)
+        for name in _walk_top_level(stream):
+            if name != key:
+                stream.skip_value()
+                continue
+            opening = stream.peek()
+            if opening not in "[{" or not opening:
+                stream.skip_value()
+                return
+            stream.expect(opening)
+            closing = "]" if opening == "[" else "}"
+            while stream.peek() not in (closing, ""):
+                if opening == "[":
+                    yield stream.read_value()
+                else:
+                    item_name = stream.read_value()
+                    stream.expect(":")
+                    yield item_name, stream.read_value()
+                stream.skip_comma()
+            return
+
+
+def read_json_members(path: str, skip: Tuple[str, ...]) -> Tuple[dict, List[str]]:
+    """
+    Read every top-level member of a JSON file except the skipped ones.
+
+    Returns:
+        (members read, names of skipped members present in file order)
+    """
+    members = {}
+    skipped = []
+    with open(path, "r", encoding="utf-8") as f:
+        stream = _JsonStream(f)
+        for name in _walk_top_level(stream):
+            if name in skip:
+                skipped.append(name)
+                stream.skip_value()
+            else:
+                members[name] = stream.read_value()
+    return members, skipped
+
+
+# ============================================================================
+# Writing
+# ============================================================================
+
+def _open_shard_for_write(path: str, compression: Optional[str]):
+    if compression == "gzip":
+        return gzip.open(path, "wb")
+    if compression == "zstd":
+        if zstandard is None:
+            raise RuntimeError("zstd compression requires the zstandard package (pip install zstandard)")
+        return zstandard.ZstdCompressor().stream_writer(open(path, "wb"), closefd=True)
+    return open(path, "wb")
+
+
+def write_sharded(
+    out_dir: str,
+    records: List[dict],
+    array_key: str,
+    metadata: Optional[dict] = None,
+    extra: Optional[dict] = None,
+    shard_size: int = 500,
+    compression: Optional[str] = None
+) -> str:
+    """
+    Write records as JSONL shards plus a manifest and index.
+
+    Args:
+        out_dir: Artifact directory (created)
+        records: Records of the main array, in order
+        array_key: Name of the main array in the legacy layout
+        metadata: The artifact's metadata block
+        extra: Other top-level keys of the legacy layout (kept in the manifest)
+        shard_size: Records per shard
+        compression: None, "gzip" or "zstd"
+
+    Returns:
+        out_dir
+    """
+    if compression not in COMPRESSION_SUFFIXES:
+        raise ValueError(f"Unknown compression: {compression}")
+    os.makedirs(out_dir, exist_ok=True)
+
+    shards = []
+    offsets = []
+    keys: Dict[str, Dict[str, List[int]]] = {}
+    for start in range(0, len(records), shard_size) or [0]:
+        shard_name = f"shard-{len(shards):05d}.jsonl{COMPRESSION_SUFFIXES[compression]}"
+        position = 0
+        with _open_shard_for_write(os.path.join(out_dir, shard_name), compression) as f:
+            for ordinal in range(start, min(start + shard_size, len(records))):
+                line = (json.dumps(records[ordinal], ensure_ascii=False) + "\n").encode("utf-8")
+                f.write(line)
+                offsets.append([len(shards), position])
+                position += len(line)
+                for field, value in record_keys(records[ordinal]).items():
+                    keys.setdefault(field, {}).setdefault(value, []).append(ordinal)
+        shards.append(shard_name)
+
+    with open(os.path.join(out_dir, INDEX_NAME), "w", encoding="utf-8") as f:
+        json.dump({"records": offsets, "keys": keys}, f, ensure_ascii=False)
+    with open(os.path.join(out_dir, MANIFEST_NAME), "w", encoding="utf-8") as f:
+        json.dump({
+            "format": "sharded-jsonl",
+            "array_key": array_key,
+            "record_count": len(records),
+            "compression": compression,
+            "shards": shards,
+            "metadata": metadata or {},
+            "extra": extra or {}
+        }, f, indent=2, ensure_ascii=False)
+    return out_dir
+
+
+def save_artifact(output_data: dict, output_path: str, output_format: str = "json",
+                  compression: Optional[str] = None) -> str:
+    """
+    Save a generator's output dict as pretty-printed JSON or as a sharded artifact.
+
+    Args:
+        output_data: Legacy layout ({"metadata": ..., <array>: [...], ...})
+        output_path: Path of the .json file; a sharded artifact uses the same
+            path without the extension as its directory
+        output_format: "json" or "jsonl"
+        compression: Shard compression for "jsonl"
+
+    Returns:
+        The path written
+    """
+    if output_format == "json":
+        with open(output_path, 'w', encoding='utf-8') as f:
+            json.dump(output_data, f, indent=2, ensure_ascii=False)
+        return output_path
+
+    array_key = detect_array_key(output_data)
+    extra = {k: v for k, v in output_data.items() if k not in ("metadata", array_key)}
+    return write_sharded(
+        os.path.splitext(output_path)[0],
+        output_data[array_key],
+        array_key,
+        metadata=output_data.get("metadata"),
+        extra=extra,
+        compression=compression
+    )
+
+
+# ============================================================================
+# Checkpoints
+# ============================================================================
+
+class JsonlCheckpoint:
+    """
+    Append-only per-item checkpoint for resumable runs.
+
+    Every finished item is written as one {"key": ..., "record": ...} line and
+    flushed, so an interrupted run loses only the items in flight. Appends are
+    thread-safe. When a key repeats, the last line wins.
+
+    Args:
+        path: Checkpoint file (.jsonl)
+    """
+
+    def __init__(self, path: str):
+        self.path = path
+        self._lock = threading.Lock()
+
+    def load(self) -> Dict[str, dict]:
+        """Records by key; a line cut off by an interrupted write is ignored."""
+        records = {}
+        if not os.path.exists(self.path):
+            return records
+        with open(self.path, "r", encoding="utf-8") as f:
+            for line in f:
+                try:
+                    entry = json.loads(line)
+                except json.JSONDecodeError:
+                    continue
+                records[str(entry["key"])] = entry["record"]
+        return records
+
+    def append(self, key, record: dict) -> None:
+        line = json.dumps({"key": str(key), "record": record}, ensure_ascii=False) + "\n"
+        with self._lock:
+            with open(self.path, "a", encoding="utf-8") as f:
+                f.write(line)
+                f.flush()
+
+    def remove(self) -> None:
+        if os.path.exists(self.path):
+            os.remove(self.path)
+
+
+# ============================================================================
+# Reading
+# ============================================================================
+
+def is_sharded(path: str) -> bool:
+    return os.path.isdir(path) and os.path.exists(os.path.join(path, MANIFEST_NAME))
+
+
+def latest_artifact(directory: str, prefix: str) -> Optional[str]:
+    """Latest <prefix><timestamp>.json file or sharded directory in a directory, by name."""
+    if not os.path.isdir(directory):
+        return None
+    candidates = []
+    for name in os.listdir(directory):
+        path = os.path.join(directory, name)
+        if not name.startswith(prefix):
+            continue
+        if (name.endswith('.json') and os.path.isfile(path)) or is_sharded(path):
+            candidates.append((os.path.splitext(name)[0] if name.endswith('.json') else name, path))
+    if not candidates:
+        return None
+    return max(candidates)[1]
+
+
+class ArtifactReader:
+    """
+    Read records from a sharded artifact or a legacy JSON file.
+
+    Sharded artifacts are streamed shard by shard and single records are
+    fetched by seeking. Legacy files are never loaded whole: the small
+    top-level members are read on open and the record array is streamed on
+    every pass, so memory stays bounded by the largest record.
+
+    Args:
+        path: Sharded artifact directory or legacy .json file
+        array_key: Main array of a legacy file (detected when omitted)
+    """
+
+    def __init__(self, path: str, array_key: Optional[str] = None):
+        self.path = path
+        self.sharded = is_sharded(path)
+        self._index = None
+        self._count = None
+        self._cached_shard = (None, None)
+        if self.sharded:
+            with open(os.path.join(path, MANIFEST_NAME), encoding="utf-8") as f:
+                self.manifest = json.load(f)
+            self.array_key = self.manifest["array_key"]
+            self.metadata = self.manifest.get("metadata", {})
+            self.extra = self.manifest.get("extra", {})
+        else:
+            members, skipped = read_json_members(path, (array_key,) if array_key else ARRAY_KEYS)
+            if not skipped:
+                raise ValueError(f"No record array found in {path} (expected one of {', '.join(ARRAY_KEYS)})")
+            self.array_key = array_key or skipped[0]
+            self.metadata = members.pop("metadata", {})
+            self.extra = members
+
+    def __len__(self) -> int:
+        if self.sharded:
+            return self.manifest["record_count"]
+        if self._count is None:
+            self._count = sum(1 for _ in self)
+        return self._count
+
+    def _shard_path(self, shard: int) -> str:
+        return os.path.join(self.path, self.manifest["shards"][shard])
+
+    def _open_shard(self, shard: int):
+        path = self._shard_path(shard)
+        compression = self.manifest.get("compression")
+        if compression == "gzip":
+            return gzip.open(path, "rb")
+        if compression == "zstd":
+            if zstandard is None:
+                raise RuntimeError("Reading zstd shards requires the zstandard package (pip install zstandard)")
+            return io.BufferedReader(zstandard.ZstdDecompressor().stream_reader(open(path, "rb"), closefd=True))
+        return open(path, "rb")
+
+    def __iter__(self) -> Iterator[dict]:
+        if not self.sharded:
+            yield from iter_json_items(self.path, self.array_key)
+            return
+        for shard in range(len(self.manifest["shards"])):
+            with self._open_shard(shard) as f:
+                for line in f:
+                    if line.strip():
+                        yield json.loads(line)
+
+    def record(self, ordinal: int) -> dict:
+        """
+        Fetch one record by position without reading other shards.
+
+        Legacy files need a streaming pass per call; fetch several records
+        with records() to share one pass.
+        """
+        if not self.sharded:
+            return self.records([ordinal])[0]
+        shard, offset = self.index["records"][ordinal]
+        if self.manifest.get("compression") is None:
+            with open(self._shard_path(shard), "rb") as f:
+                f.seek(offset)
+                return json.loads(f.readline())
+        # Compressed shards cannot seek cheaply; keep the last decompressed shard
+        if self._cached_shard[0] != shard:
+            with self._open_shard(shard) as f:
+                self._cached_shard = (shard, f.read())
+        data = self._cached_shard[1]
+        return json.loads(data[offset:data.index(b"\n", offset)])
+
+    def records(self, ordinals: List[int]) -> List[dict]:
+        """Fetch several records by position, in the order given."""
+        if self.sharded:
+            return [self.record(ordinal) for ordinal in ordinals]
+        wanted = set(ordinals)
+        found = {}
+        for ordinal, record in enumerate(self):
+            if ordinal in wanted:
+                found[ordinal] = record
+                if len(found) == len(wanted):
+                    break
+        return [found[ordinal] for ordinal in ordinals]
+
+    @property
+    def index(self) -> dict:
+        """The key index (built with one streaming pass for legacy files)."""
+        if self._index is None:
+            if self.sharded:
+                with open(os.path.join(self.path, INDEX_NAME), encoding="utf-8") as f:
+                    self._index = json.load(f)
+            else:
+                keys: Dict[str, Dict[str, List[int]]] = {}
+                for ordinal, record in enumerate(self):
+                    for field, value in record_keys(record).items():
+                        keys.setdefault(field, {}).setdefault(value, []).append(ordinal)
+                self._index = {"keys": keys}
+        return self._index
+
+    def lookup(self, field: str, value: str) -> List[dict]:
+        """
+        Records whose index key matches.
+
+        Args:
+            field: "substandard_id", "format_number" or "skill_problem_type"
+                (use skill_problem_type_key to build the value)
+        """
+        return self.records(self.index["keys"].get(field, {}).get(value, []))
+
+    def load(self) -> dict:
+        """The whole artifact in the legacy single-file layout."""
+        # iter() keeps list() from calling __len__, a counting pass over legacy files
+        return {"metadata": self.metadata, self.array_key: list(iter(self)), **self.extra}
+
+
+def open_artifact(path: str, array_key: Optional[str] = None) -> ArtifactReader:
+    return ArtifactReader(path, array_key)
+
+
+# ============================================================================
+# DI data
+# ============================================================================
+
+def get_di_formats_path() -> str:
+    """Path of the DI formats data."""
+    project_root = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+    return os.path.join(
+        project_root,
+        "..",
+        "Experiment - Find existing mappings",
+        "inputs",
+        "di_formats_with_mappings.json"
+    )
+
+
+def iter_di_skills(di_path: Optional[str] = None) -> Iterator:
+    """Stream (skill_name, skill_data) pairs from the DI data one skill at a time."""
+    return iter_json_items(di_path or get_di_formats_path(), "skills")
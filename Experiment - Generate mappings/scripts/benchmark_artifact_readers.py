@@ -0,0 +1,156 @@
+#!/usr/bin/env python3
+"""
+Benchmark artifact readers on a synthetically scaled corpus.
+
+Replicates the existing mappings and the latest generated sequences/formats
+--scale times into a temporary directory, written as a legacy JSON file and
+as plain, gzip and (if zstandard is installed) zstd sharded artifacts. Each
+copy is then filtered the way the pipeline does it, with json.load followed
+by the filter, with the streaming legacy reader, and with the sharded reader.
+Reports wall time and peak Python heap (tracemalloc) per reader.
+"""
+
+import os
+import json
+import time
+import shutil
+import argparse
+import tempfile
+import tracemalloc
+from datetime import datetime
+from typing import Callable, Dict, Iterable, List
+
+from artifacts import latest_artifact, open_artifact, save_artifact, write_sharded
+from generate_sequences import get_mappings_path, get_substandards_needing_sequences
+
+try:
+    import zstandard  # noqa: F401
+    COMPRESSIONS = [None, "gzip", "zstd"]
+except ImportError:
+    COMPRESSIONS = [None, "gzip"]
+
+
+def scale_artifact(data: dict, array_key: str, scale: int) -> dict:
+    """Replicate an artifact's records scale times, tagging copies so keys stay distinct."""
+    records = []
+    for copy in range(scale):
+        for record in data[array_key]:
+            record = dict(record)
+            for field in ("substandard_id", "problem_type"):
+                if copy and isinstance(record.get(field), str):
+                    record[field] = f"{record[field]} #{copy}"
+            records.append(record)
+    return {**data, array_key: records}
+
+
+def count_records(records: Iterable[dict]) -> int:
+    return sum(1 for _ in records)
+
+
+def filter_for(array_key: str) -> Callable[[Iterable[dict]], int]:
+    """The filter the pipeline applies to an artifact (a plain scan for artifacts without one)."""
+    if array_key == "mappings":
+        return lambda records: len(get_substandards_needing_sequences(records, threshold=1))
+    return count_records
+
+
+def measure(label: str, fn: Callable[[], int]) -> Dict:
+    """Run fn once, returning its result with wall time and peak traced memory."""
+    tracemalloc.start()
+    start = time.perf_counter()
+    result = fn()
+    elapsed = time.perf_counter() - start
+    _, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    return {"reader": label, "result": result, "seconds": round(elapsed, 3), "peak_mb": round(peak / 2**20, 2)}
+
+
+def benchmark_artifact(name: str, data: dict, array_key: str, scale: int, work_dir: str, shard_size: int) -> List[Dict]:
+    """Write one scaled artifact in every layout and time each reader over it."""
+    scaled = scale_artifact(data, array_key, scale)
+    record_count = len(scaled[array_key])
+    legacy_path = os.path.join(work_dir, f"{name}.json")
+    save_artifact(scaled, legacy_path)
+    sharded_paths = {}
+    for compression in COMPRESSIONS:
+        sharded_paths[compression or "plain"] = write_sharded(
+            os.path.join(work_dir, f"{name}_{compression or 'plain'}"),
+            scaled[array_key],
+            array_key,
+            metadata=scaled.get("metadata"),
+            extra={k: v for k, v in scaled.items() if k not in ("metadata", array_key)},
+            shard_size=shard_size,
+            compression=compression
+        )
+    del scaled
+
+    apply_filter = filter_for(array_key)
+
+    def json_load():
+        with open(legacy_path, "r", encoding="utf-8") as f:
+            loaded = json.load(f)
+        return apply_filter(loaded if array_key == "mappings" else loaded[array_key])
+
+    runs = [
+        measure("json.load", json_load),
+        measure("stream legacy", lambda: apply_filter(open_artifact(legacy_path, array_key))),
+    ]
+    for label, path in sharded_paths.items():
+        runs.append(measure(f"sharded {label}", lambda path=path: apply_filter(open_artifact(path, array_key))))
+
+    size_mb = os.path.getsize(legacy_path) / 2**20
+    for run in runs:
+        run.update({"artifact": name, "records": record_count, "legacy_size_mb": round(size_mb, 2)})
+    return runs
+
+
+def main():
+    project_root = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+    outputs_dir = os.path.join(project_root, "outputs")
+    parser = argparse.ArgumentParser(description="Benchmark json.load vs streaming artifact readers on a scaled corpus")
+    parser.add_argument("--scale", type=int, default=50, help="Copies of each source artifact's records (default 50)")
+    parser.add_argument("--shard-size", type=int, default=500, help="Records per shard for the sharded copies")
+    parser.add_argument("--out", required=False, help="Output JSON path")
+    args = parser.parse_args()
+
+    sources = [("mappings", get_mappings_path(), "mappings")]
+    for prefix, array_key in (("generated_sequences_", "generated_sequences"), ("generated_formats_", "generated_formats")):
+        path = latest_artifact(outputs_dir, prefix)
+        if path:
+            sources.append((prefix.rstrip("_"), path, array_key))
+        else:
+            print(f"  - no {prefix}* artifact in {outputs_dir}, skipped")
+
+    work_dir = tempfile.mkdtemp(prefix="artifact_benchmark_")
+    summary = []
+    try:
+        for name, path, array_key in sources:
+            print(f"Benchmarking {name} x{args.scale} ({path})")
+            summary.extend(benchmark_artifact(name, open_artifact(path, array_key).load(), array_key,
+                                              args.scale, work_dir, args.shard_size))
+    finally:
+        shutil.rmtree(work_dir, ignore_errors=True)
+
+    print(f"\n{'Artifact':<20} {'Reader':<16} {'records':>8} {'seconds':>8} {'peak MB':>8} {'result':>7}")
+    for row in summary:
+        print(f"{row['artifact']:<20} {row['reader']:<16} {row['records']:>8} {row['seconds']:>8} "
+              f"{row['peak_mb']:>8} {row['result']:>7}")
+
+    out_path = args.out or os.path.join(
+        outputs_dir, f"artifact_reader_benchmark_{datetime.now().strftime('%Y%m%d_%H%M%S')}.json"
+    )
+    os.makedirs(os.path.dirname(out_path), exist_ok=True)
+    with open(out_path, "w", encoding="utf-8") as f:
+        json.dump({
+            "metadata": {
+                "scale": args.scale,
+                "shard_size": args.shard_size,
+                "benchmarked_at": datetime.now().isoformat(),
+            },
+            "results": summary,
+        }, f, indent=2, ensure_ascii=False)
+    print(f"\nBenchmark complete. Output: {out_path}")
+
+
+if __name__ == "__main__":
+    main()
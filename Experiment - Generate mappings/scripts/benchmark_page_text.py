@@ -0,0 +1,130 @@
+#!/usr/bin/env python3
+"""
+Benchmark page-text backends on the DI book.
+
+Compares throughput (pages/second) and text fidelity of pypdfium2, PyPDF2,
+pdfplumber and the escalating PageTextEngine ("auto"). Fidelity is measured
+against pdfplumber's output, which is what the extractor used before.
+"""
+
+import os
+import re
+import json
+import time
+import argparse
+import difflib
+from datetime import datetime
+from typing import Dict, List
+
+from page_text import PageTextEngine, FAST_BACKENDS
+
+
+def _words(text: str) -> List[str]:
+    return re.findall(r"\S+", (text or "").lower())
+
+
+def fidelity(reference: str, candidate: str) -> Dict:
+    """Word-sequence similarity and vocabulary overlap of candidate vs reference."""
+    ref_words, cand_words = _words(reference), _words(candidate)
+    matcher = difflib.SequenceMatcher(None, ref_words, cand_words, autojunk=False)
+    ref_set, cand_set = set(ref_words), set(cand_words)
+    union = ref_set | cand_set
+    return {
+        "sequence_ratio": matcher.ratio(),
+        "word_jaccard": len(ref_set & cand_set) / len(union) if union else 1.0,
+    }
+
+
+def run_backend(pdf_path: str, backend: str, pages: List[int]) -> Dict:
+    """Extract the pages with one backend, returning texts, timing and engine stats."""
+    texts: Dict[int, str] = {}
+    errors = 0
+    fast_backend = None if backend == "pdfplumber" else ("pypdfium2" if backend == "auto" else backend)
+    with PageTextEngine(pdf_path, fast_backend=fast_backend) as engine:
+        if backend in FAST_BACKENDS and engine.fast_backend != backend:
+            return {"backend": backend, "available": False}
+        start = time.perf_counter()
+        for page_number in pages:
+            try:
+                if backend in FAST_BACKENDS:
+                    texts[page_number] = engine.extract_fast(page_number)
+                elif backend == "pdfplumber":
+                    texts[page_number] = engine.extract_layout(page_number)
+                else:
+                    texts[page_number], _ = engine.extract(page_number)
+            except Exception:
+                texts[page_number] = ""
+                errors += 1
+        elapsed = time.perf_counter() - start
+        stats = dict(engine.stats)
+    return {
+        "backend": backend,
+        "available": True,
+        "texts": texts,
+        "seconds": elapsed,
+        "pages_per_second": len(pages) / elapsed if elapsed else 0.0,
+        "errors": errors,
+        "engine_stats": stats,
+    }
+
+
+def main():
+    project_root = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+    parser = argparse.ArgumentParser(description="Benchmark PDF page-text backends on the DI book")
+    parser.add_argument("--pdf", default=os.path.join(project_root, "data", "Direct_Instruction_Mathematics.pdf"), help="Path to the PDF")
+    parser.add_argument("--start", type=int, default=1, help="First page (1-based)")
+    parser.add_argument("--end", type=int, default=None, help="Last page (1-based, inclusive; default: last page)")
+    parser.add_argument("--out", required=False, help="Output JSON path")
+    args = parser.parse_args()
+
+    with PageTextEngine(args.pdf) as engine:
+        total_pages = engine.page_count()
+    end = min(args.end or total_pages, total_pages)
+    pages = list(range(max(1, args.start), end + 1))
+    print(f"Benchmarking {len(pages)} pages of {args.pdf}")
+
+    runs = [run_backend(args.pdf, backend, pages) for backend in ("pdfplumber", "pypdfium2", "pypdf2", "auto")]
+    reference = runs[0]["texts"]
+
+    summary = []
+    for run in runs:
+        if not run["available"]:
+            print(f"  - {run['backend']}: not installed, skipped")
+            continue
+        scores = [fidelity(reference[p], run["texts"][p]) for p in pages]
+        row = {
+            "backend": run["backend"],
+            "seconds": round(run["seconds"], 3),
+            "pages_per_second": round(run["pages_per_second"], 2),
+            "speedup_vs_pdfplumber": round(run["pages_per_second"] / runs[0]["pages_per_second"], 2) if runs[0]["pages_per_second"] else None,
+            "errors": run["errors"],
+            "mean_sequence_ratio": round(sum(s["sequence_ratio"] for s in scores) / len(scores), 4) if scores else None,
+            "mean_word_jaccard": round(sum(s["word_jaccard"] for s in scores) / len(scores), 4) if scores else None,
+            "min_sequence_ratio": round(min(s["sequence_ratio"] for s in scores), 4) if scores else None,
+            "engine_stats": run["engine_stats"],
+        }
+        summary.append(row)
+
+    print(f"\n{'Backend':<12} {'pages/s':>9} {'speedup':>8} {'seq ratio':>10} {'jaccard':>8} {'errors':>7}")
+    for row in summary:
+        print(f"{row['backend']:<12} {row['pages_per_second']:>9} {row['speedup_vs_pdfplumber']:>8} "
+              f"{row['mean_sequence_ratio']:>10} {row['mean_word_jaccard']:>8} {row['errors']:>7}")
+
+    out_path = args.out or os.path.join(
+        project_root, "outputs", f"page_text_benchmark_{datetime.now().strftime('%Y%m%d_%H%M%S')}.json"
+    )
+    os.makedirs(os.path.dirname(out_path), exist_ok=True)
+    with open(out_path, "w", encoding="utf-8") as f:
+        json.dump({
+            "metadata": {
+                "pdf_path": args.pdf,
+                "pages": f"{pages[0]}-{pages[-1]}" if pages else "",
+                "benchmarked_at": datetime.now().isoformat(),
+            },
+            "results": summary,
+        }, f, indent=2, ensure_ascii=False)
+    print(f"\nBenchmark complete. Output: {out_path}")
+
+
+if __name__ == "__main__":
+    main()
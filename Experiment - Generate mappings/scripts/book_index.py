@@ -0,0 +1,396 @@
+"""
+Table-of-contents parsing and chapter-boundary detection for DI-style books.
+
+The extractor used to rely on a hand-entered skills_chapter_pages dict. This
+module derives the same information from the book itself:
+
+1. Find the ToC pages (front-matter pages dominated by "Title ..... 123" lines)
+   and group their entries into chapters.
+2. Calibrate the book-to-PDF page offset by locating chapter title pages
+   (looked up in a PageTextIndex over all pages) and taking the offset most
+   chapters agree on.
+3. Turn each chapter into a PDF page range and find its Instructional Sequence
+   and Assessment Chart pages (the Grade Level / Problem Type / Performance
+   Indicator table).
+
+build_book_index collects all of this into one dict, which build_book_index.py
+stores per PDF so later runs do not scan the book again.
+"""
+
+import re
+from collections import Counter
+from typing import Dict, List, Optional, Tuple
+
+from page_index import PageTextIndex, normalize
+
+# A ToC line: a title followed by a 1-4 digit page number
+TOC_LINE_RE = re.compile(r"^(?P<title>.*?\S)\s+\.?\s*(?P<page>\d{1,4})\s*$")
+
+# Headings that mark an instructional sequence chart page
+SEQUENCE_CHART_RE = re.compile(
+    r"\bInstructional\s+Sequence\s+and\s+Assessment\s+Chart\b|\bPerformance\s+Indicators?\b",
+    re.IGNORECASE,
+)
+
+# Fraction of non-empty lines that must look like ToC entries for a page to count as ToC
+TOC_PAGE_MIN_LINE_RATIO = 0.4
+# How far into the PDF to look for the ToC
+TOC_SCAN_PAGES = 30
+# Largest book-to-PDF offset considered when calibrating
+MAX_PAGE_OFFSET = 80
+# Only the top of a page is searched for a chapter title, so running text and
+# cross references to other chapters do not count as a title page
+TITLE_SEARCH_CHARS = 400
+
+
+def chapter_name(chapter_title: str) -> str:
+    """Strip a leading "Chapter N" / "Appendix X" label from a ToC chapter title."""
+    name = re.sub(r"^(chapter|appendix)\s+\w+\s*[:.\-—]?\s*", "", (chapter_title or "").strip(), flags=re.IGNORECASE)
+    return name or (chapter_title or "").strip()
+
+
+def is_toc_page(text: str) -> bool:
+    """Return True if most non-empty lines of a page look like ToC entries."""
+    lines = [line.strip() for line in (text or "").splitlines() if line.strip()]
+    if len(lines) < 5:
+        return False
+    matches = sum(1 for line in lines if TOC_LINE_RE.match(line))
+    return matches / len(lines) >= TOC_PAGE_MIN_LINE_RATIO
+
+
+def find_toc_pages(page_texts: Dict[int, str]) -> Optional[Tuple[int, int]]:
+    """
+    Find the first contiguous run of ToC-looking pages.
+
+    Args:
+        page_texts: 1-based page number -> text for the front matter
+
+    Returns:
+        (start_page, end_page) of the ToC, or None if no ToC page was found
+    """
+    toc_start = None
+    toc_end = None
+    for page_number in sorted(page_texts):
+        if is_toc_page(page_texts[page_number]):
+            if toc_start is None:
+                toc_start = page_number
+            toc_end = page_number
+        elif toc_start is not None:
+            break
+    if toc_start is None:
+        return None
+    return toc_start, toc_end
+
+
+def parse_toc_entries(toc_text: str) -> List[Dict]:
+    entries: List[Dict] = []
+    # Heuristic: lines that end with a page number (1-4 digits)
+    raw_entries: List[Dict] = []
+    for raw_line in toc_text.splitlines():
+        line = raw_line.strip()
+        if not line:
+            continue
+        m = TOC_LINE_RE.match(line)
+        if not m:
+            continue
+        title = m.group("title")
+        try:
+            page = int(m.group("page"))
+        except ValueError:
+            continue
+        if len(title) < 3:
+            continue
+        raw_entries.append({"title": title, "start_page": page})
+
+    # Sort and dedupe
+    seen = set()
+    raw_entries.sort(key=lambda x: x["start_page"])
+    filtered: List[Dict] = []
+    for e in raw_entries:
+        key = (e["title"], e["start_page"])
+        if key in seen:
+            continue
+        seen.add(key)
+        filtered.append(e)
+
+    # Group subtopics under nearest preceding Chapter/Appendix
+    def is_chapter_title(t: str) -> bool:
+        t_norm = t.lower()
+        return (
+            t_norm.startswith("chapter ") or
+            t_norm.startswith("appendix ") or
+            t_norm in {"glossary", "references", "index"}
+        )
+
+    grouped: List[Dict] = []
+    current: Optional[Dict] = None
+    for e in filtered:
+        title = e["title"]
+        if is_chapter_title(title):
+            # Start a new chapter bucket
+            if current is not None:
+                grouped.append(current)
+            current = {
+                "chapter_title": title,
+                "start_page": e["start_page"],
+                "subtopics": []
+            }
+        else:
+            # Subtopic: attach to current if exists
+            if current is None:
+                # If ToC starts mid-section, create a generic bucket
+                current = {
+                    "chapter_title": "(Unlabeled Section)",
+                    "start_page": e["start_page"],
+                    "subtopics": []
+                }
+            current["subtopics"].append({
+                "title": title,
+                "start_page": e["start_page"]
+            })
+
+    if current is not None:
+        grouped.append(current)
+
+    return grouped
+
+
+def is_title_page(text: str, chapter_title: str) -> bool:
+    """Return True if the chapter title (with or without its "Chapter N" label) heads the page."""
+    head = normalize((text or "")[:TITLE_SEARCH_CHARS])
+    if not head:
+        return False
+    full = normalize(chapter_title)
+    name = normalize(chapter_name(chapter_title))
+    return bool(full and full in head) or bool(name and len(name) >= 4 and name in head)
+
+
+def calibrate_page_offset(get_text, toc_entries: List[Dict], total_pages: int, min_pdf_page: int = 1,
+                          page_index: Optional[PageTextIndex] = None) -> Tuple[Optional[int], Dict]:
+    """
+    Estimate the book-to-PDF page offset from every chapter that has a title page.
+
+    Args:
+        get_text: Callable returning the text of a 1-based PDF page
+        toc_entries: Grouped entries from parse_toc_entries
+        total_pages: Number of pages in the PDF
+        min_pdf_page: Pages before this (e.g. the ToC itself) are never title pages
+        page_index: Index of the same page texts; only pages it finds the title on
+            are checked instead of every page of each chapter's window
+
+    Returns:
+        Tuple of (offset, details) where PDF page = book page + offset and details
+        lists the per-chapter votes. The offset is None when no chapter title
+        page was found, rather than a guessed 0 that would misplace every chapter.
+    """
+    votes: Counter = Counter()
+    per_chapter: List[Dict] = []
+    for e in toc_entries:
+        title = e.get("chapter_title") or ""
+        toc_start = e.get("start_page")
+        if not title.lower().startswith("chapter ") or not isinstance(toc_start, int):
+            continue
+        first = max(min_pdf_page, toc_start)
+        last = min(total_pages, toc_start + MAX_PAGE_OFFSET)
+        if page_index is None:
+            candidates = range(first, last + 1)
+        else:
+            name = chapter_name(title)
+            candidates = sorted(set(page_index.pages_with(title, first, last))
+                                | set(page_index.pages_with(name, first, last) if len(normalize(name)) >= 4 else ()))
+        for pdf_page in candidates:
+            if is_title_page(get_text(pdf_page), title):
+                votes[pdf_page - toc_start] += 1
+                per_chapter.append({"chapter_title": title, "toc_start": toc_start, "pdf_page": pdf_page})
+                break
+
+    if not votes:
+        return None, {"votes": {}, "chapters": per_chapter}
+    # The most common offset wins; ties go to the smaller offset
+    offset = sorted(votes.items(), key=lambda kv: (-kv[1], kv[0]))[0][0]
+    return offset, {"votes": dict(votes), "chapters": per_chapter}
+
+
+def chapter_page_ranges(toc_entries: List[Dict], offset: int, total_pages: int) -> List[Dict]:
+    """
+    Convert grouped ToC entries into PDF page ranges.
+
+    A chapter ends the page before the next entry (chapter, appendix, glossary...)
+    starts; the last entry runs to the end of the PDF.
+    """
+    ranges: List[Dict] = []
+    for idx, e in enumerate(toc_entries):
+        start = e["start_page"] + offset
+        if idx + 1 < len(toc_entries):
+            end = max(start, toc_entries[idx + 1]["start_page"] + offset - 1)
+        else:
+            end = total_pages
+        if start < 1 or start > total_pages:
+            continue
+        ranges.append({
+            "chapter_title": e["chapter_title"],
+            "name": chapter_name(e["chapter_title"]),
+            "chapter_start_page": start,
+            "chapter_end_page": min(end, total_pages),
+            "subtopics": e.get("subtopics", []),
+        })
+    return ranges
+
+
+def find_sequence_pages(get_text, start_page: int, end_page: int) -> Optional[Tuple[int, int]]:
+    """
+    Find the instructional sequence chart inside a chapter.
+
+    The chart is the first page carrying the chart heading or the Performance
+    Indicator column, plus the directly following pages that still do.
+    """
+    seq_start = None
+    seq_end = None
+    for page_number in range(start_page, end_page + 1):
+        if SEQUENCE_CHART_RE.search(get_text(page_number) or ""):
+            if seq_start is None:
+                seq_start = page_number
+            seq_end = page_number
+        elif seq_start is not None:
+            break
+    if seq_start is None:
+        return None
+    return seq_start, seq_end
+
+
+def match_skill_name(chapter_title: str, skill_names: List[str]) -> Optional[str]:
+    """Match a ToC chapter title to a known skill name by word overlap."""
+    chapter_words = set(re.findall(r"[a-z]+", normalize(chapter_name(chapter_title))))
+    best, best_score = None, 0.0
+    for skill in skill_names:
+        skill_words = set(re.findall(r"[a-z]+", normalize(skill)))
+        if not skill_words or not chapter_words:
+            continue
+        score = len(skill_words & chapter_words) / len(skill_words | chapter_words)
+        if score > best_score:
+            best, best_score = skill, score
+    return best if best_score >= 0.5 else None
+
+
+def build_book_index(get_text, total_pages: int) -> Dict:
+    """
+    Derive a book's layout from its ToC: everything later steps need to locate chapters.
+
+    Args:
+        get_text: Callable returning the text of a 1-based PDF page
+        total_pages: Number of pages in the PDF
+
+    Returns:
+        Dict with toc_pages, toc_text, toc_entries, page_offset (PDF page =
+        book page + offset), offset_votes, title_pages (where each chapter's
+        title page was found) and chapters (chapter_page_ranges entries with
+        their instructional_sequence_pages, or None). Only total_pages and
+        error are set when no ToC is found. When no chapter title page is
+        found, page_offset is None and chapters is empty; the ToC is kept.
+    """
+    front_matter = {p: get_text(p) for p in range(1, min(total_pages, TOC_SCAN_PAGES) + 1)}
+    toc_pages = find_toc_pages(front_matter)
+    if toc_pages is None:
+        return {"total_pages": total_pages, "error": "No table of contents found"}
+
+    toc_text = "\n".join(front_matter[p] or "" for p in range(toc_pages[0], toc_pages[1] + 1))
+    toc_entries = parse_toc_entries(toc_text)
+    page_index = PageTextIndex({p: get_text(p) for p in range(1, total_pages + 1)})
+    offset, calibration = calibrate_page_offset(get_text, toc_entries, total_pages, min_pdf_page=toc_pages[1] + 1,
+                                                page_index=page_index)
+
+    chapters = []
+    for chapter in chapter_page_ranges(toc_entries, offset, total_pages) if offset is not None else []:
+        chapter["instructional_sequence_pages"] = find_sequence_pages(
+            get_text, chapter["chapter_start_page"], chapter["chapter_end_page"]
+        )
+        chapters.append(chapter)
+
+    return {
+        "total_pages": total_pages,
+        "toc_pages": list(toc_pages),
+        "toc_text": toc_text,
+        "toc_entries": toc_entries,
+        "page_offset": offset,
+        "offset_votes": calibration["votes"],
+        "title_pages": calibration["chapters"],
+        "chapters": chapters,
+    }
+
+
+def detect_skill_pages(get_text, total_pages: int, known_skills: Optional[List[str]] = None,
+                       book: Optional[Dict] = None) -> Tuple[Dict[str, Dict], Dict]:
+    """
+    Derive skills_chapter_pages-style entries from the book's ToC.
+
+    Args:
+        get_text: Callable returning the text of a 1-based PDF page
+        total_pages: Number of pages in the PDF
+        known_skills: Skill names to reuse when a chapter title matches one
+        book: A stored build_book_index result; built from get_text when omitted
+
+    Returns:
+        Tuple of (skill name -> {chapter_start_page, chapter_end_page,
+        instructional_sequence_pages}, detection report). Chapters without an
+        instructional sequence chart are not skills and are left out.
+    """
+    if book is None:
+        book = build_book_index(get_text, total_pages)
+    if book.get("error"):
+        return {}, {"error": book["error"]}
+    if book["page_offset"] is None:
+        return {}, {"error": "No chapter title pages found to calibrate the book-to-PDF page offset"}
+
+    detected: Dict[str, Dict] = {}
+    skipped: List[str] = []
+    for chapter in book["chapters"]:
+        sequence_pages = chapter["instructional_sequence_pages"]
+        if sequence_pages is None:
+            skipped.append(chapter["chapter_title"])
+            continue
+        name = match_skill_name(chapter["chapter_title"], known_skills or []) or chapter["name"]
+        detected[name] = {
+            "chapter_start_page": chapter["chapter_start_page"],
+            "chapter_end_page": chapter["chapter_end_page"],
+            "instructional_sequence_pages": tuple(sequence_pages),
+            "chapter_title": chapter["chapter_title"],
+        }
+
+    report = {
+        "toc_pages": f"{book['toc_pages'][0]}-{book['toc_pages'][1]}",
+        "toc_chapters": len(book["toc_entries"]),
+        "page_offset": book["page_offset"],
+        "offset_votes": book["offset_votes"],
+        "skills_detected": len(detected),
+        "chapters_without_sequence": skipped,
+    }
+    return detected, report
+
+
+def valid_skill_pages(pages: Dict, total_pages: int) -> bool:
+    """Return True if a skill's chapter and sequence ranges are ordered and inside the PDF."""
+    seq_start, seq_end = pages["instructional_sequence_pages"]
+    if not (1 <= seq_start <= seq_end <= total_pages):
+        return False
+    chapter_start, chapter_end = pages.get("chapter_start_page"), pages.get("chapter_end_page")
+    if chapter_start is None or chapter_end is None:
+        return True
+    return 1 <= chapter_start <= chapter_end <= total_pages
+
+
+def merge_skill_pages(detected: Dict[str, Dict], overrides: Dict[str, Dict], total_pages: int) -> Dict[str, Dict]:
+    """
+    Combine detected ranges with hand-entered overrides.
+
+    An override wins field by field, except that an override whose ranges are
+    inverted or out of bounds is dropped in favour of the detected entry.
+    """
+    merged = {skill: dict(pages) for skill, pages in detected.items()}
+    for skill, pages in overrides.items():
+        candidate = {**merged.get(skill, {}), **pages}
+        if skill in merged and not valid_skill_pages(candidate, total_pages):
+            print(f"⚠️  Ignoring invalid page override for {skill}; using detected pages "
+                  f"{merged[skill]['chapter_start_page']}-{merged[skill]['chapter_end_page']}")
+            continue
+        merged[skill] = candidate
+    return merged
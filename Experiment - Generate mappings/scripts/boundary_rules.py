@@ -0,0 +1,249 @@
+"""
+Local checks of generated example questions against assessment boundaries.
+
+Many Grade 3 assessment boundaries are mechanical: number ranges ("whole
+numbers up to 1000", "products must not exceed 100"), allowed denominators
+("denominators of 2, 3, 4, 6, or 8"), times-table factor limits, excluded
+number kinds (fractions, decimals, negatives, variables) and excluded
+operations ("no division"). parse_assessment_boundary turns the lines it
+recognises into BoundaryRules; check_question reports which rules a
+question's numbers and operations break. Lines that are not recognised are
+ignored, so the checks only ever reject on constraints stated outright.
+"""
+
+import re
+from typing import Dict, List, Optional, Set
+
+from pydantic import BaseModel
+
+OPERATIONS = ("addition", "subtraction", "multiplication", "division")
+
+# How each operation shows up in a question
+OPERATION_PATTERNS = {
+    "addition": re.compile(r"\+|\bplus\b", re.IGNORECASE),
+    "subtraction": re.compile(r"\d\s*−\s*\d|\d\s+[-–]\s+\d|\bminus\b|\bsubtract", re.IGNORECASE),
+    "multiplication": re.compile(r"×|\d\s*[x*]\s*\d|\btimes\b|\bmultipl", re.IGNORECASE),
+    "division": re.compile(r"÷|\bdivid|\bdivision\b", re.IGNORECASE),
+}
+
+# "no fractions, decimals, or negative numbers", "no use of variables", "no reference to division"
+_NEGATED_LIST = (
+    r"\b(?:no|not|exclude[sd]?|exclusion of|excluding|without|never)\s+"
+    r"(?:use of\s+|reference to\s+|abstract\s+)?"
+    r"(?:(?:negative numbers|mixed numbers|[\w-]+),\s*)*(?:(?:or|and)\s+)?"
+)
+_NUMBER_LIMIT_RE = re.compile(
+    r"\b(?:within|up to|less than or equal to|not exceed|no greater than|no more than|at most)\s+(\d[\d,]*)",
+    re.IGNORECASE
+)
+_NUMBER_LIMIT_SUBJECT_RE = re.compile(
+    r"\b(?:numbers?|sums?|addends?|products?|dividends?|differences?|operations|values)\b", re.IGNORECASE
+)
+_TIMES_TABLE_RE = re.compile(r"\b(\d+)\s*(?:×|x|by)\s*\1\b", re.IGNORECASE)
+_FACTOR_SUBJECT_RE = re.compile(r"\b(?:factors?|multipliers?|multiplicands?|divisors?)\b", re.IGNORECASE)
+_RANGE_RE = re.compile(r"\b\d+\s*[–-]\s*(\d+)\b")
+_DENOMINATORS_RE = re.compile(r"\bdenominators?\b[^.\d]*?((?:\d+\s*,?\s*(?:or\s+|and\s+)?)+)", re.IGNORECASE)
+
+_FRACTION_RE = re.compile(r"(?<![\d/.])(\d+)\s*/\s*(\d+)(?![\d/])")
+_FRACTION_WORDS = {
+    "half": 2, "halves": 2, "third": 3, "thirds": 3, "fourths": 4, "quarters": 4, "fifths": 5,
+    "sixths": 6, "sevenths": 7, "eighths": 8, "ninths": 9, "tenths": 10, "twelfths": 12,
+}
+_FRACTION_WORD_RE = re.compile(
+    r"\b(?:one|two|three|four|five|six|seven)[- ](third|fourth|fifth|sixth|seventh|eighth|ninth|tenth|twelfth)s?\b"
+    r"|\b(" + "|".join(_FRACTION_WORDS) + r")\b",
+    re.IGNORECASE
+)
+_ORDINAL_DENOMINATORS = {
+    "third": 3, "fourth": 4, "fifth": 5, "sixth": 6, "seventh": 7, "eighth": 8, "ninth": 9, "tenth": 10, "twelfth": 12,
+}
+_TIME_RE = re.compile(r"\b\d{1,2}:\d{2}\b")
+_DECIMAL_RE = re.compile(r"(?<![\d.])\d+\.\d+(?![\d.])")
+_NEGATIVE_RE = re.compile(r"(?:^|[\s(=,])[−-]\d")
+_WHOLE_NUMBER_RE = re.compile(r"(?<![\d.,])\d{1,3}(?:,\d{3})+(?![\d,])|(?<![\d.,])\d+(?![\d.])")
+_MULTIPLICATION_RE = re.compile(r"(\d+)\s*(?:×|\*|x(?=\s*\d))\s*(\d+)")
+_DIVISION_RE = re.compile(r"(\d+)\s*÷\s*(\d+)")
+_VARIABLE_NEIGHBOURS = set("=+×÷*−")
+
+
+class BoundaryRules(BaseModel):
+    """Mechanical constraints parsed from an assessment boundary."""
+    max_number: Optional[int] = None
+    max_factor: Optional[int] = None
+    allow_multiples_of_ten: bool = False
+    allowed_denominators: Optional[List[int]] = None
+    unit_fractions_only: bool = False
+    fractions_less_than_one: bool = False
+    no_zero_in_fractions: bool = False
+    no_fractions: bool = False
+    no_decimals: bool = False
+    no_negatives: bool = False
+    no_variables: bool = False
+    forbidden_operations: List[str] = []
+
+    def is_empty(self) -> bool:
+        return self == BoundaryRules()
+
+
+def _excludes(line: str, term: str) -> bool:
+    return re.search(_NEGATED_LIST + term, line, re.IGNORECASE) is not None
+
+
+def parse_assessment_boundary(boundary: Optional[str]) -> BoundaryRules:
+    """
+    Parse the mechanical constraints of an assessment boundary.
+
+    When several lines limit the same quantity the loosest limit is kept
+    (e.g. "decomposition ... within 10" next to "products must not exceed 100"),
+    so a question is only rejected for breaking every stated limit.
+    """
+    rules = BoundaryRules()
+    number_limits, factor_limits = [], []
+    denominators: Set[int] = set()
+    forbidden: Set[str] = set()
+
+    for raw_line in (boundary or "").splitlines():
+        line = raw_line.strip(" -•*\t")
+        lower = line.lower()
+        if not line:
+            continue
+
+        if _NUMBER_LIMIT_SUBJECT_RE.search(line):
+            number_limits += [int(n.replace(",", "")) for n in _NUMBER_LIMIT_RE.findall(line)]
+
+        # "up to 10 × 10" limits each factor, not the numbers in a multi-step problem
+        factor_limits += [int(size) for size in _TIMES_TABLE_RE.findall(line)]
+        if _FACTOR_SUBJECT_RE.search(line):
+            if "single-digit" in lower or "single digit" in lower:
+                factor_limits.append(9)
+            factor_limits += [int(n) for n in _RANGE_RE.findall(line)]
+            greater = re.search(r"\b(?:none|no|not)\b.*\bgreater than (\d+)", lower)
+            if greater:
+                factor_limits.append(int(greater.group(1)))
+        if re.search(r"\bmultiples of (?:10|ten)\b", lower):
+            rules.allow_multiples_of_ten = True
+
+        if "denominator" in lower:
+            match = _DENOMINATORS_RE.search(line)
+            if match:
+                denominators.update(int(n) for n in re.findall(r"\d+", match.group(1)))
+            if re.search(r"\b(?:don't|do not|no)\b.*\b0\b", lower):
+                rules.no_zero_in_fractions = True
+        if re.search(r"\bonly unit fractions\b|\bmust be unit fractions\b|\bunit fractions only\b", lower):
+            rules.unit_fractions_only = True
+        if "fraction" in lower and (
+            re.search(r"\bless than (?:1|one)\b", lower)
+            or (re.search(r"\b(?:no|not|can't|cannot|never)\b", lower) and re.search(r"\bgreater than (?:1|one)\b", lower))
+        ):
+            rules.fractions_less_than_one = True
+
+        rules.no_fractions |= _excludes(line, r"fractions\b")
+        rules.no_decimals |= _excludes(line, r"decimals\b")
+        rules.no_negatives |= _excludes(line, r"negative\b")
+        rules.no_variables |= _excludes(line, r"variables\b")
+
+        for operation in OPERATIONS:
+            if _excludes(line, operation + r"\b") or re.search(rf"\b{operation} is not (?:assessed|allowed|included)", lower):
+                forbidden.add(operation)
+        # "division only", but not "multiplication/division only"
+        only = re.search(r"(?<![\w/])(" + "|".join(OPERATIONS) + r") only\b", lower)
+        if only:
+            forbidden.update(op for op in OPERATIONS if op != only.group(1))
+
+    rules.max_number = max(number_limits) if number_limits else None
+    rules.max_factor = max(factor_limits) if factor_limits else None
+    rules.allowed_denominators = sorted(denominators) or None
+    rules.forbidden_operations = [op for op in OPERATIONS if op in forbidden]
+    return rules
+
+
+def _fractions(question: str) -> List[tuple]:
+    """(numerator, denominator) of every numeric or worded fraction; worded ones have numerator None."""
+    found = [(int(n), int(d)) for n, d in _FRACTION_RE.findall(question)]
+    for ordinal, word in _FRACTION_WORD_RE.findall(question):
+        found.append((None, _ORDINAL_DENOMINATORS[ordinal.lower()] if ordinal else _FRACTION_WORDS[word.lower()]))
+    return found
+
+
+def _has_variable(question: str) -> bool:
+    """A single letter standing next to "=" or an operator, other than x between two numbers."""
+    for match in re.finditer(r"(?<![\w'’])[A-Za-z](?![\w'’])", question):
+        before = question[:match.start()].rstrip()[-1:]
+        after = question[match.end():].lstrip()[:1]
+        if match.group() in "xX" and before.isdigit() and after.isdigit():
+            continue
+        if before in _VARIABLE_NEIGHBOURS or after in _VARIABLE_NEIGHBOURS:
+            return True
+    return False
+
+
+def check_question(question: str, rules: BoundaryRules) -> List[str]:
+    """Return a description of every rule the question breaks (empty if it complies)."""
+    violations = []
+    fractions = _fractions(question)
+    numeric_fractions = [(n, d) for n, d in fractions if n is not None]
+
+    if rules.no_fractions and fractions:
+        violations.append("uses a fraction")
+    if rules.allowed_denominators:
+        bad = sorted({d for _, d in fractions if d not in rules.allowed_denominators})
+        if bad:
+            allowed = ", ".join(str(d) for d in rules.allowed_denominators)
+            violations.append(f"denominator {', '.join(map(str, bad))} not in allowed denominators ({allowed})")
+    if rules.unit_fractions_only and any(n != 1 for n, _ in numeric_fractions):
+        violations.append("uses a non-unit fraction")
+    if rules.fractions_less_than_one and any(n >= d for n, d in numeric_fractions):
+        violations.append("uses a fraction not less than 1")
+    if rules.no_zero_in_fractions and any(0 in (n, d) for n, d in numeric_fractions):
+        violations.append("uses 0 as a numerator or denominator")
+
+    text = _FRACTION_RE.sub(" ", _TIME_RE.sub(" ", question))
+    if rules.no_decimals and _DECIMAL_RE.search(text):
+        violations.append("uses a decimal")
+    if rules.no_negatives and _NEGATIVE_RE.search(text):
+        violations.append("uses a negative number")
+    if rules.max_number is not None:
+        too_large = [n for n in (int(m.replace(",", "")) for m in _WHOLE_NUMBER_RE.findall(_DECIMAL_RE.sub(" ", text)))
+                     if n > rules.max_number]
+        if too_large:
+            violations.append(f"number {max(too_large)} exceeds the limit of {rules.max_number}")
+    if rules.max_factor is not None:
+        factors = [int(n) for pair in _MULTIPLICATION_RE.findall(text) for n in pair]
+        factors += [int(divisor) for _, divisor in _DIVISION_RE.findall(text)]
+        too_large = [n for n in factors
+                     if n > rules.max_factor and not (rules.allow_multiples_of_ten and n % 10 == 0)]
+        if too_large:
+            violations.append(f"factor {max(too_large)} exceeds the limit of {rules.max_factor}")
+    if rules.no_variables and _has_variable(question):
+        violations.append("uses a letter variable")
+    for operation in rules.forbidden_operations:
+        if OPERATION_PATTERNS[operation].search(question):
+            violations.append(f"uses {operation}")
+    return violations
+
+
+def check_sequences(sequences: List[dict], rules: BoundaryRules) -> Dict[int, List[str]]:
+    """
+    Check every example question of a substandard's generated sequences.
+
+    Returns:
+        sequence_number -> violations (as '"question": reason') for sequences
+        with at least one violating question
+    """
+    violations = {}
+    for seq in sequences:
+        found = []
+        for question in seq.get('example_questions') or []:
+            found += [f'"{question}": {reason}' for reason in check_question(question, rules)]
+        if found:
+            violations[seq.get('sequence_number')] = found
+    return violations
+
+
+def format_violation_feedback(violations: Dict[int, List[str]]) -> str:
+    """Describe violations for a regeneration prompt."""
+    lines = []
+    for sequence_number, found in violations.items():
+        lines.append(f"Sequence {sequence_number}:")
+        lines += [f"  - {violation}" for violation in found]
+    return "\n".join(lines)
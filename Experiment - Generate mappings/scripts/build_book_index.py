@@ -0,0 +1,126 @@
+#!/usr/bin/env python3
+"""
+Build the book index artifact for a PDF.
+
+The ToC, the calibrated book-to-PDF page offset and the chapter page ranges
+depend only on the PDF, so they are computed once (book_index.build_book_index)
+and stored as outputs/book_index/<sha256 prefix of the PDF>.json. Stage 1,
+stage 2 and the extractor call load_book_index, which reads that file and
+only scans the book when no index exists for this exact PDF yet.
+"""
+
+import os
+import json
+import hashlib
+import argparse
+from datetime import datetime
+from typing import Dict, Optional
+
+from book_index import build_book_index
+from page_text import PageTextEngine
+
+# Bump when build_book_index output changes so stored indexes are rebuilt
+BOOK_INDEX_VERSION = 2
+
+
+def pdf_sha256(pdf_path: str) -> str:
+    """SHA-256 of the PDF's bytes, read in chunks."""
+    digest = hashlib.sha256()
+    with open(pdf_path, "rb") as f:
+        for chunk in iter(lambda: f.read(1 << 20), b""):
+            digest.update(chunk)
+    return digest.hexdigest()
+
+
+def default_index_dir() -> str:
+    project_root = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+    return os.path.join(project_root, "outputs", "book_index")
+
+
+def book_index_path(pdf_hash: str, index_dir: Optional[str] = None) -> str:
+    return os.path.join(index_dir or default_index_dir(), f"{pdf_hash[:16]}.json")
+
+
+def scan_book(pdf_path: str, engine: Optional[PageTextEngine] = None) -> Dict:
+    """Run build_book_index over a PDF, reusing an open engine if given."""
+    if engine is None:
+        with PageTextEngine(pdf_path) as engine:
+            return scan_book(pdf_path, engine)
+
+    page_cache: Dict[int, str] = {}
+
+    def get_text(page_number: int) -> str:
+        if page_number not in page_cache:
+            try:
+                page_cache[page_number] = engine.extract_fast(page_number) if engine.fast_backend else engine.extract_layout(page_number)
+            except Exception:
+                page_cache[page_number] = ""
+        return page_cache[page_number]
+
+    return build_book_index(get_text, engine.page_count())
+
+
+def load_book_index(pdf_path: str, index_dir: Optional[str] = None, rebuild: bool = False,
+                    engine: Optional[PageTextEngine] = None) -> Dict:
+    """
+    Load the stored index for a PDF, building and saving it first if needed.
+
+    Args:
+        pdf_path: Path to the book PDF
+        index_dir: Directory of stored indexes (default outputs/book_index)
+        rebuild: Scan the book even if an index is stored
+        engine: Open page-text engine for the PDF, used when building
+
+    Returns:
+        build_book_index output plus pdf_path, pdf_sha256, version and built_at
+    """
+    pdf_hash = pdf_sha256(pdf_path)
+    path = book_index_path(pdf_hash, index_dir)
+    if not rebuild and os.path.exists(path):
+        with open(path, "r", encoding="utf-8") as f:
+            book = json.load(f)
+        if book.get("version") == BOOK_INDEX_VERSION and book.get("pdf_sha256") == pdf_hash:
+            print(f"📑 Loaded book index: {path}")
+            return book
+
+    print(f"🔎 Building book index for {pdf_path}...")
+    book = {
+        "pdf_path": pdf_path,
+        "pdf_sha256": pdf_hash,
+        "version": BOOK_INDEX_VERSION,
+        "built_at": datetime.now().isoformat(),
+        **scan_book(pdf_path, engine),
+    }
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    with open(path, "w", encoding="utf-8") as f:
+        json.dump(book, f, indent=2, ensure_ascii=False)
+    print(f"💾 Saved book index: {path}")
+    return book
+
+
+def main():
+    project_root = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+    parser = argparse.ArgumentParser(description="Build the ToC / page offset / chapter range index for a book PDF")
+    parser.add_argument("--pdf", default=os.path.join(project_root, "data", "Direct_Instruction_Mathematics.pdf"),
+                        help="Path to the book PDF")
+    parser.add_argument("--index-dir", required=False, help="Directory of stored indexes (default outputs/book_index)")
+    parser.add_argument("--force", action="store_true", help="Rebuild even if an index for this PDF exists")
+    args = parser.parse_args()
+
+    book = load_book_index(args.pdf, args.index_dir, rebuild=args.force)
+    if book.get("error"):
+        print(f"⚠️  {book['error']}")
+        return
+    print(f"ToC pages {book['toc_pages'][0]}-{book['toc_pages'][1]}, {len(book['toc_entries'])} entries")
+    if book["page_offset"] is None:
+        print("⚠️  No chapter title pages found; the page offset and chapter ranges are unknown")
+        return
+    print(f"Page offset {book['page_offset']:+d}")
+    for chapter in book["chapters"]:
+        sequence = chapter["instructional_sequence_pages"]
+        print(f"  - {chapter['chapter_title']}: pages {chapter['chapter_start_page']}-{chapter['chapter_end_page']}"
+              + (f", sequence {sequence[0]}-{sequence[1]}" if sequence else ""))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,129 @@
+"""
+Local lexical chapter matching for stage 1.
+
+Most generated formats name their topic almost verbatim: a DI format's skill
+is a chapter name ("Symbol Identification and Place Value"), and titles such
+as "FINDING ELAPSED TIME ACROSS NOON" share their key words with a chapter or
+one of its ToC subtopics. ChapterMatcher scores a format against every
+content chapter of parse_toc_entries output with TF-IDF over the chapter name
+and subtopic titles; when the DI skill list is given, a format whose skill
+is the one a chapter teaches matches that chapter outright. Only matches with a clear margin over the runner-up are
+accepted; the rest are left for the LLM.
+"""
+
+import re
+from typing import Dict, List, Optional
+
+from book_index import chapter_name, match_skill_name, normalize
+from similarity import TfidfIndex
+
+# Chapter names are repeated so they outweigh any single subtopic title
+CHAPTER_NAME_WEIGHT = 3
+
+
+def is_content_chapter(entry: Dict) -> bool:
+    """Skip back matter (appendices, glossary, references, index) that never teaches a format."""
+    title = normalize(entry.get("chapter_title"))
+    return not (title.startswith("appendix") or title in {"glossary", "references", "index"})
+
+
+def skill_for_chapter(chapter_title: str, skill_names: List[str]) -> Optional[str]:
+    """The DI skill a chapter teaches ("Measurement" for "Measurement, Time, and Money")."""
+    skill = match_skill_name(chapter_title, skill_names)
+    if skill:
+        return skill
+    chapter_words = set(re.findall(r"[a-z]+", normalize(chapter_name(chapter_title))))
+    return next((name for name in skill_names
+                 if set(re.findall(r"[a-z]+", normalize(name))) <= chapter_words), None)
+
+
+def format_query(format_item: Dict) -> str:
+    """Text a format is matched on: skill, title, problem type and substandard description."""
+    fmt = format_item.get("generated_format") or {}
+    return " ".join(filter(None, [
+        format_item.get("skill"),
+        format_item.get("skill"),
+        fmt.get("title"),
+        format_item.get("problem_type"),
+        format_item.get("substandard_description"),
+    ]))
+
+
+class ChapterMatcher:
+    """
+    Score formats against the chapters of a parsed ToC.
+
+    Args:
+        toc_entries: parse_toc_entries output
+        skill_names: DI skill names (optional; a format's skill then picks its chapter directly)
+        min_score: Lowest best score accepted without the LLM
+        min_margin: Lowest lead of the best chapter over the runner-up accepted without the LLM
+    """
+
+    def __init__(self, toc_entries: List[Dict], skill_names: Optional[List[str]] = None,
+                 min_score: float = 0.2, min_margin: float = 0.1):
+        self.chapters = [entry for entry in toc_entries if is_content_chapter(entry)]
+        self.min_score = min_score
+        self.min_margin = min_margin
+        # DI skill name -> chapter it names
+        self.skill_chapters: Dict[str, Dict] = {}
+        for entry in self.chapters:
+            skill = skill_for_chapter(entry["chapter_title"], list(skill_names or []))
+            if skill and skill not in self.skill_chapters:
+                self.skill_chapters[skill] = entry
+        self._index = TfidfIndex(
+            self.chapters,
+            lambda entry: " ".join(
+                [chapter_name(entry["chapter_title"])] * CHAPTER_NAME_WEIGHT
+                + [sub["title"] for sub in entry.get("subtopics", [])]
+            )
+        )
+
+    def rank(self, format_item: Dict) -> List[tuple]:
+        """(score, chapter entry) for every chapter, best first; the chapter a format's skill names scores 1."""
+        named = self.skill_chapters.get(format_item.get("skill"))
+        ranked = [(1.0 if entry is named else score, entry) for score, entry in self._index.rank(format_query(format_item))]
+        ranked.sort(key=lambda pair: -pair[0])
+        return ranked
+
+    def match(self, format_item: Dict) -> Dict:
+        """
+        Best chapter for a format and whether it is confident enough to skip the LLM.
+
+        Returns:
+            Dict with chapter (entry or None), score, margin over the runner-up,
+            and accepted
+        """
+        ranked = self.rank(format_item)
+        if not ranked:
+            return {"chapter": None, "score": 0.0, "margin": 0.0, "accepted": False}
+        best_score, best = ranked[0]
+        margin = best_score - (ranked[1][0] if len(ranked) > 1 else 0.0)
+        return {
+            "chapter": best,
+            "score": round(best_score, 4),
+            "margin": round(margin, 4),
+            "accepted": best_score >= self.min_score and margin >= self.min_margin,
+        }
+
+
+def same_chapter(title_a: Optional[str], title_b: Optional[str]) -> bool:
+    """Compare chapter titles with or without their "Chapter N" label."""
+    if not title_a or not title_b:
+        return False
+    return normalize(chapter_name(title_a)) == normalize(chapter_name(title_b))
+
+
+def agreement_report(lexical_titles: List[Optional[str]], llm_titles: List[Optional[str]], labels: List[str]) -> Dict:
+    """Agreement between lexical and LLM chapter picks for the same items."""
+    pairs = [(label, lex, llm) for label, lex, llm in zip(labels, lexical_titles, llm_titles) if llm]
+    agreed = sum(1 for _, lex, llm in pairs if same_chapter(lex, llm))
+    return {
+        "compared": len(pairs),
+        "agreed": agreed,
+        "agreement_rate": round(agreed / len(pairs), 4) if pairs else None,
+        "disagreements": [
+            {"format": label, "lexical": lex, "llm": llm}
+            for label, lex, llm in pairs if not same_chapter(lex, llm)
+        ],
+    }
@@ -1,14 +1,14 @@
 
 import os
+import re
 import sys
 import json
-import PyPDF2
-import pdfplumber
+import hashlib
 import tiktoken
 import threading
 from concurrent.futures import ThreadPoolExecutor, as_completed
 from datetime import datetime
-from typing import List, Dict, Optional
+from typing import List, Dict, Optional, Type, Any
 from pydantic import BaseModel
 # from src.llms import produce_structured_response_gemini
 from google import genai
@@ -19,6 +19,11 @@ import copy
 
 from dotenv import load_dotenv
 
+from page_text import PageTextEngine
+from book_index import detect_skill_pages, merge_skill_pages, normalize
+from artifacts import get_di_formats_path, iter_di_skills
+from build_book_index import load_book_index
+
 load_dotenv()
 
 llm= ChatGoogleGenerativeAI(
@@ -27,7 +32,8 @@ llm= ChatGoogleGenerativeAI(
 )
     
 
-# Global mapping of skills to their chapter pages
+# Hand-entered chapter pages for the DI book. Chapter and sequence ranges are
+# detected from the ToC at run time; entries here override the detected values.
 skills_chapter_pages = {
         "Counting": {
             "chapter_start_page": 42,
@@ -67,7 +73,7 @@ skills_chapter_pages = {
         "Problem Solving": {
             "chapter_start_page": 218,
             "instructional_sequence_pages": (219,220),
-            "chapter_end_page": 217
+            "chapter_end_page": 261
         },
         "Measurement": {
             "chapter_start_page": 262,
@@ -127,14 +133,211 @@ def produce_structured_response_gemini(
         json_text = response.candidates[0].content.parts[0].text
         return structure_model.model_validate_json(json_text)
     except Exception as e:
-        logger.error(f"Gemini structured response generation failed: {e}")
+        print(f"❌ Gemini structured response generation failed: {e}")
         raise
 
-def read_math_di_book():
-    """Main function to process the Direct Instruction Mathematics book."""
-    # Correct the path to go up one directory from scripts to project root, then into data
-    project_root = os.path.dirname(os.path.dirname(__file__))
-    pdf_path = os.path.join(project_root, "data", "Direct_Instruction_Mathematics.pdf")
+
+# Run-level accounting of the chapter-text tokens saved by the format table parser
+# and the fused formats+pitfalls call
+_token_encoding = None
+token_savings_lock = threading.Lock()
+# Serializes read-modify-write updates of the output JSON from worker threads
+json_file_lock = threading.Lock()
+token_savings = {
+    "fused_calls": 0,
+    "fallback_calls": 0,
+    "parser_only_chapters": 0,
+    "format_pages_parsed": 0,
+    "format_pages_sent_to_llm": 0,
+    "chapter_input_tokens": 0,
+    "input_tokens_saved": 0,
+}
+
+
+def count_tokens(text: str) -> int:
+    """Approximate the number of input tokens in text (cl100k_base, or ~4 chars/token offline)."""
+    global _token_encoding
+    try:
+        if _token_encoding is None:
+            _token_encoding = tiktoken.get_encoding("cl100k_base")
+        return len(_token_encoding.encode(text))
+    except Exception:
+        return len(text) // 4
+
+
+def record_token_savings(chapter_text: str, sent_texts: List[str], call_kind: str) -> int:
+    """Record one chapter's extraction in the run totals and return the tokens it saved.
+
+    The baseline is the separate path, which sends the full chapter text once for
+    formats and once more for pitfalls; sent_texts are the texts actually sent.
+    call_kind is "fused", "fallback" or "parser_only".
+    """
+    chapter_tokens = count_tokens(chapter_text)
+    saved = max(0, chapter_tokens * 2 - sum(count_tokens(text) for text in sent_texts))
+    with token_savings_lock:
+        token_savings["chapter_input_tokens"] += chapter_tokens
+        token_savings["input_tokens_saved"] += saved
+        if call_kind == "parser_only":
+            token_savings["parser_only_chapters"] += 1
+        else:
+            token_savings[f"{call_kind}_calls"] += 1
+    return saved
+
+
+def report_token_savings() -> Dict:
+    """Print and return the token savings of the current run."""
+    with token_savings_lock:
+        report = dict(token_savings)
+    separate_tokens = report["chapter_input_tokens"] * 2
+    report["savings_rate"] = f"{(report['input_tokens_saved'] / separate_tokens * 100):.1f}%" if separate_tokens else "0%"
+    print(f"\n💰 Token savings (format table parser + fused formats+pitfalls extraction):")
+    print(f"  - Fused calls: {report['fused_calls']}")
+    print(f"  - Fallback (separate) calls: {report['fallback_calls']}")
+    print(f"  - Chapters with formats fully parsed locally: {report['parser_only_chapters']}")
+    print(f"  - Format pages parsed locally: {report['format_pages_parsed']} (sent to LLM: {report['format_pages_sent_to_llm']})")
+    print(f"  - Chapter input tokens saved: {report['input_tokens_saved']} of {separate_tokens} ({report['savings_rate']})")
+    return report
+
+
+def resolve_skill_pages(engine: PageTextEngine, total_pages: int, page_source: str = "merged",
+                        overrides: Optional[Dict] = None):
+    """
+    Decide which page ranges to process for each skill.
+
+    Args:
+        engine: Open page-text engine for the book
+        total_pages: Number of pages in the PDF
+        page_source: "auto" (ToC detection only), "manual" (skills_chapter_pages only)
+            or "merged" (detection, with skills_chapter_pages as an override).
+            When detection fails (no ToC, or no chapter title page to calibrate
+            the page offset), "auto" raises and "merged" uses the overrides alone.
+        overrides: Hand-entered page map to use instead of skills_chapter_pages
+
+    Returns:
+        Tuple of (skill name -> page information, detection report or None)
+    """
+    if overrides is None:
+        overrides = skills_chapter_pages
+    if page_source == "manual":
+        return overrides, None
+
+    # The ToC scan is stored per PDF by build_book_index.py; only a new PDF is scanned
+    book = load_book_index(engine.pdf_path, engine=engine)
+    detected, report = detect_skill_pages(None, total_pages, known_skills=list(overrides), book=book)
+    if report.get("error"):
+        if page_source == "auto":
+            raise RuntimeError(f"Chapter detection failed for {engine.pdf_path}: {report['error']}; "
+                               f"use page source merged or manual with chapter page overrides")
+        print(f"⚠️  Chapter detection failed: {report['error']}; using the page overrides only")
+    else:
+        print(f"📑 ToC pages {report['toc_pages']}, page offset {report['page_offset']:+d}, "
+              f"{report['skills_detected']} skill chapters detected")
+
+    if page_source == "auto":
+        return detected, report
+    return merge_skill_pages(detected, overrides, total_pages), report
+
+
+def route_book(pdf_path: str, json_output_path: str, llm_executor: ThreadPoolExecutor,
+               page_source: str = "merged", overrides: Optional[Dict] = None, book_label: str = "",
+               previous_hashes: Optional[Dict[str, str]] = None) -> Dict:
+    """
+    Scan one book in a single pass and queue its skill tasks on the LLM executor.
+
+    Args:
+        pdf_path: Path to the book PDF
+        json_output_path: Skills JSON the book's results are written to
+        llm_executor: Shared pool that runs the per-skill LLM processing
+        page_source: See resolve_skill_pages
+        overrides: Chapter page overrides (defaults to skills_chapter_pages)
+        book_label: Prefix for progress messages
+        previous_hashes: Page hashes from the last extraction. When given (re-ingest),
+            only tasks with a changed page are re-prompted and their results are
+            diffed against the previous ones to mark stale sequences and formats.
+
+    Returns:
+        Dict with the queued futures (future -> task), the chapter detection report,
+        the page hashes of this scan and the tasks skipped as unchanged
+    """
+    book_run = {"futures": {}, "detection_report": None, "page_hashes": {}, "unchanged_tasks": []}
+    with PageTextEngine(pdf_path) as engine:
+        total_pages = engine.page_count()
+        print(f"{book_label}Total pages in PDF: {total_pages}")
+
+        chapter_pages, detection_report = resolve_skill_pages(engine, total_pages, page_source, overrides)
+        book_run["detection_report"] = detection_report
+        if not chapter_pages:
+            print(f"{book_label}❌ No skill page ranges available.")
+            return book_run
+        tasks = build_page_tasks(chapter_pages, total_pages, json_output_path)
+
+        def submit_task(task):
+            if previous_hashes is not None:
+                task["changed_pages"] = [
+                    p for p in range(task["start"], task["end"] + 1)
+                    if previous_hashes.get(str(p)) != task["page_hashes"].get(p)
+                ]
+                if not task["changed_pages"]:
+                    print(f"{book_label}[{task['skill']}] ⏭️  Pages {task['start']}-{task['end']} unchanged, keeping {task['kind']} results")
+                    task["page_texts"], task["page_layouts"], task["page_errors"] = None, None, None
+                    book_run["unchanged_tasks"].append(task)
+                    return
+                task["previous_items"] = snapshot_skill_items(json_output_path, task["skill"], task["kind"])
+                print(f"{book_label}[{task['skill']}] 🔁 {len(task['changed_pages'])} changed pages, re-extracting {task['kind']}")
+            print(f"{book_label}[{task['skill']}] 📬 All pages {task['start']}-{task['end']} routed, queuing {task['kind']} processing")
+            book_run["futures"][llm_executor.submit(run_page_task, task, json_output_path)] = task
+
+        book_run["page_hashes"] = route_pages(engine, tasks, submit_task)
+        print(f"\n{book_label}📄 Single pass complete: {engine.stats['fast']} fast pages, {engine.stats['escalated']} pdfplumber pages")
+    return book_run
+
+
+def wait_for_tasks(futures: Dict, book_label: str = "") -> None:
+    """Wait for queued skill tasks, printing the outcome of each."""
+    for future in as_completed(futures):
+        task = futures[future]
+        try:
+            future.result()  # This will raise an exception if the task failed
+            print(f"{book_label}[{task['skill']}] ✅ {task['kind'].capitalize()} processing completed successfully")
+        except Exception as e:
+            task["error"] = str(e)
+            print(f"{book_label}[{task['skill']}] ❌ {task['kind'].capitalize()} processing failed: {e}")
+
+
+def failed_task_pages(book_run: Dict, json_output_path: str) -> List[int]:
+    """
+    Pages of this run's tasks that raised or recorded a sequence_error/formats_error.
+
+    Their hashes must not be stored, or the next re-ingest would see them as
+    unchanged and never retry them.
+    """
+    try:
+        with open(json_output_path, 'r', encoding='utf-8') as f:
+            skills = json.load(f).get("skills", {})
+    except Exception:
+        skills = {}
+    pages = set()
+    for task in book_run["futures"].values():
+        error_key = "sequence_error" if task["kind"] == "sequence" else "formats_error"
+        if task.get("error") or skills.get(task["skill"], {}).get(error_key):
+            pages.update(range(task["start"], task["end"] + 1))
+    return sorted(pages)
+
+
+def read_math_di_book(max_workers: int = 4, pdf_path: Optional[str] = None, page_source: str = "merged",
+                      reingest: bool = False):
+    """Main function to process the Direct Instruction Mathematics book.
+
+    The book is scanned once, in page order. Each page's text is routed to every
+    skill task (instructional sequence or chapter formats) whose range covers it,
+    and a task is handed to the worker pool for its LLM calls as soon as its last
+    page has been routed. With reingest=True only chapters whose page hashes
+    changed since the last extraction are re-prompted.
+    """
+    if pdf_path is None:
+        # Correct the path to go up one directory from scripts to project root, then into data
+        project_root = os.path.dirname(os.path.dirname(__file__))
+        pdf_path = os.path.join(project_root, "data", "Direct_Instruction_Mathematics.pdf")
     
     print(f"Processing PDF: {pdf_path}")
     
@@ -143,52 +346,468 @@ def read_math_di_book():
         return
 
     # Initialize JSON file
-    json_output_path = initialize_json_file()
+    json_output_path = initialize_json_file(source_document=os.path.basename(pdf_path))
     if not json_output_path:
         print("Failed to initialize JSON file. Exiting.")
         return None
     
-    # Read pages using pdfplumber
     try:
-        with pdfplumber.open(pdf_path) as pdf:
-            print(f"Total pages in PDF: {len(pdf.pages)}")
-            
-            for skill, pages in skills_chapter_pages.items():
-                print(f"\n{'='*60}")
-                print(f"Processing skill: {skill}")
-                print(f"{'='*60}")
-                
-                # Run both sequence and format processing in parallel using ThreadPoolExecutor
-                with ThreadPoolExecutor(max_workers=2) as executor:
-                    # Submit both tasks to run in parallel - each opens its own PDF instance
-                    sequence_future = executor.submit(process_skill_sequence, pdf_path, skill, pages, json_output_path)
-                    format_future = executor.submit(process_formats, pdf_path, skill, pages, json_output_path)
-                    
-                    # Wait for both to complete and handle results
-                    futures = [sequence_future, format_future]
-                    task_names = ["Sequence", "Format"]
-                    
-                    for future, task_name in zip(futures, task_names):
-                        try:
-                            future.result()  # This will raise an exception if the task failed
-                            print(f"[{skill}] ✅ {task_name} processing completed successfully")
-                        except Exception as e:
-                            print(f"[{skill}] ❌ {task_name} processing failed: {e}")
-                
-                print(f"[{skill}] 🏁 Parallel processing completed")
+        previous_hashes = load_page_hashes(json_output_path) if reingest else None
+        with ThreadPoolExecutor(max_workers=max_workers) as executor:
+            book_run = route_book(pdf_path, json_output_path, executor, page_source, previous_hashes=previous_hashes)
+            if not book_run["futures"] and not book_run["unchanged_tasks"]:
+                return None
+            wait_for_tasks(book_run["futures"])
 
-            
-            
-            # Finalize the JSON file
-            finalize_json_file(json_output_path)
-            print(f"\n✅ All skills processed and saved to: {json_output_path}")
-            return json_output_path
+        # Report the input tokens saved by fused formats+pitfalls extraction
+        savings_report = report_token_savings()
+
+        # Finalize the JSON file
+        finalize_json_file(json_output_path, token_savings_report=savings_report,
+                           chapter_detection_report=book_run["detection_report"],
+                           page_hashes=book_run["page_hashes"],
+                           failed_pages=failed_task_pages(book_run, json_output_path),
+                           reingest_report=summarize_reingest(book_run) if reingest else None)
+        print(f"\n✅ All skills processed and saved to: {json_output_path}")
+        return json_output_path
             
     except Exception as e:
         print(f"Error reading PDF: {e}")
         return None
 
 
+def load_book_manifest(manifest_path: str) -> List[Dict]:
+    """
+    Load a multi-book manifest.
+
+    The manifest is a JSON object with a "books" list. Each book has an "id"
+    (used as the skill namespace), a "pdf" path (relative to the manifest), and
+    optionally "page_source" ("auto", "merged" or "manual") and "chapter_pages"
+    (a skills_chapter_pages-style override map for that book, or "builtin" for
+    skills_chapter_pages itself).
+    """
+    with open(manifest_path, 'r', encoding='utf-8') as f:
+        manifest = json.load(f)
+    manifest_dir = os.path.dirname(os.path.abspath(manifest_path))
+
+    books = []
+    seen_ids = set()
+    for entry in manifest.get("books", []):
+        book_id = entry.get("id")
+        if not book_id or not entry.get("pdf"):
+            raise ValueError(f"Manifest entry needs an id and a pdf: {entry}")
+        if book_id in seen_ids:
+            raise ValueError(f"Duplicate book id in manifest: {book_id}")
+        seen_ids.add(book_id)
+        chapter_pages = entry.get("chapter_pages") or {}
+        if chapter_pages == "builtin":
+            chapter_pages = skills_chapter_pages
+        books.append({
+            "id": book_id,
+            "pdf": os.path.normpath(os.path.join(manifest_dir, entry["pdf"])),
+            "page_source": entry.get("page_source", "merged" if chapter_pages else "auto"),
+            "chapter_pages": chapter_pages,
+        })
+    return books
+
+
+def extract_books_from_manifest(manifest_path: str, max_workers: int = 4, cpu_workers: int = 2,
+                                reingest: bool = False) -> Optional[str]:
+    """
+    Extract every book in a manifest and combine them into one namespaced catalog.
+
+    Books are scanned concurrently (at most cpu_workers PDFs open and being
+    routed at once) and all of their skill tasks share one pool of max_workers
+    LLM workers, so the LLM budget is global rather than per book. Each book
+    keeps its own skills JSON and page store; the catalog namespaces skills as
+    "<book id>::<skill>". With reingest=True each book only re-prompts the
+    chapters whose pages changed (see route_book).
+
+    Returns:
+        Path to the combined catalog, or None if nothing was extracted
+    """
+    books = load_book_manifest(manifest_path)
+    print(f"📚 Manifest lists {len(books)} books")
+
+    book_runs = []
+    for book in books:
+        if not os.path.exists(book["pdf"]):
+            print(f"[{book['id']}] ❌ PDF not found at {book['pdf']}, skipping")
+            continue
+        json_output_path = initialize_json_file(f"{book['id']}_instructional_sequences.json",
+                                                source_document=os.path.basename(book["pdf"]))
+        if json_output_path:
+            book_runs.append({**book, "json_output_path": json_output_path})
+
+    if not book_runs:
+        print("❌ No books to process.")
+        return None
+
+    with ThreadPoolExecutor(max_workers=max_workers) as llm_executor, \
+            ThreadPoolExecutor(max_workers=cpu_workers) as book_executor:
+        routing = {
+            book_executor.submit(
+                route_book, run["pdf"], run["json_output_path"], llm_executor,
+                run["page_source"], run["chapter_pages"],
+                f"[{run['id']}] ",
+                load_page_hashes(run["json_output_path"]) if reingest else None,
+            ): run
+            for run in book_runs
+        }
+        for future in as_completed(routing):
+            run = routing[future]
+            try:
+                run["book_run"] = future.result()
+            except Exception as e:
+                print(f"[{run['id']}] ❌ Failed to read PDF: {e}")
+                run["book_run"] = {"futures": {}, "detection_report": None, "page_hashes": {}, "unchanged_tasks": []}
+                run["error"] = str(e)
+
+        for run in book_runs:
+            wait_for_tasks(run["book_run"]["futures"], f"[{run['id']}] ")
+
+    savings_report = report_token_savings()
+    for run in book_runs:
+        book_run = run["book_run"]
+        finalize_json_file(run["json_output_path"], token_savings_report=savings_report,
+                           chapter_detection_report=book_run["detection_report"],
+                           page_hashes=book_run["page_hashes"],
+                           failed_pages=failed_task_pages(book_run, run["json_output_path"]),
+                           reingest_report=summarize_reingest(book_run) if reingest and "error" not in run else None)
+
+    return build_book_catalog(book_runs, token_savings_report=savings_report)
+
+
+def build_book_catalog(book_runs: List[Dict], output_filename: str = "di_books_catalog.json",
+                       token_savings_report: Optional[Dict] = None) -> Optional[str]:
+    """
+    Combine per-book skills JSON files into one catalog with book-namespaced skills.
+
+    The catalog keeps the single-book layout ({"metadata", "skills"}) so anything
+    that reads data["skills"] works unchanged; keys become "<book id>::<skill>"
+    and each skill records its book_id and original skill name. Raw-text
+    references keep pointing at each book's page store, which lives next to
+    the catalog.
+    """
+    project_root = os.path.dirname(os.path.dirname(__file__))
+    catalog_path = os.path.join(project_root, "data", output_filename)
+
+    catalog = {
+        "metadata": {
+            "catalog_timestamp": datetime.now().isoformat(),
+            "books": [],
+            "total_skills": 0,
+        },
+        "skills": {},
+    }
+    for run in book_runs:
+        try:
+            with open(run["json_output_path"], 'r', encoding='utf-8') as f:
+                book_data = json.load(f)
+        except Exception as e:
+            print(f"[{run['id']}] ❌ Could not read {run['json_output_path']}: {e}")
+            continue
+        for skill_name, skill_data in book_data.get("skills", {}).items():
+            catalog["skills"][f"{run['id']}::{skill_name}"] = {
+                **skill_data,
+                "book_id": run["id"],
+                "skill_name": skill_name,
+            }
+        catalog["metadata"]["books"].append({
+            "id": run["id"],
+            "source_document": os.path.basename(run["pdf"]),
+            "skills_file": os.path.basename(run["json_output_path"]),
+            "total_skills": len(book_data.get("skills", {})),
+            "status": book_data.get("metadata", {}).get("status"),
+            "error": run.get("error"),
+        })
+    catalog["metadata"]["total_skills"] = len(catalog["skills"])
+    if token_savings_report is not None:
+        catalog["metadata"]["token_savings"] = token_savings_report
+
+    with open(catalog_path, 'w', encoding='utf-8') as f:
+        json.dump(catalog, f, indent=2, ensure_ascii=False)
+    print(f"\n📚 Combined catalog: {catalog['metadata']['total_skills']} skills from "
+          f"{len(catalog['metadata']['books'])} books -> {catalog_path}")
+    return catalog_path
+
+
+def build_page_tasks(chapter_pages: Dict, total_pages: int, json_output_path: str) -> List[Dict]:
+    """
+    Build the sequence and formats tasks for every skill, writing errors for invalid ranges.
+
+    Args:
+        chapter_pages: Skill name -> page information (see skills_chapter_pages)
+        total_pages: Number of pages in the PDF
+        json_output_path: Path to the JSON output file
+
+    Returns:
+        List of task dicts with skill, kind, pages, start/end and empty page buffers
+    """
+    tasks = []
+    for skill, pages in chapter_pages.items():
+        start_page, end_page = pages["instructional_sequence_pages"]
+        if start_page < 1 or end_page > total_pages or start_page > end_page:
+            print(f"Error: Page range {start_page}-{end_page} is invalid (1-{total_pages}) for skill {skill}")
+            update_json_with_skill(json_output_path, skill, {
+                "name": skill,
+                "instruction_sequence_pages": f"{start_page}-{end_page}",
+                "raw_text": "",
+                "progression": None,
+                "error": f"Page range {start_page}-{end_page} is invalid",
+                "processed_at": datetime.now().isoformat()
+            })
+        else:
+            tasks.append({"skill": skill, "kind": "sequence", "pages": pages, "start": start_page, "end": end_page})
+
+        chapter_start_page = pages.get("chapter_start_page")
+        chapter_end_page = pages.get("chapter_end_page")
+        if not chapter_start_page or not chapter_end_page:
+            print(f"[{skill}] ⚠️  No chapter page range defined, skipping format processing")
+        elif chapter_start_page < 1 or chapter_end_page > total_pages or chapter_start_page > chapter_end_page:
+            print(f"Error: Chapter page range {chapter_start_page}-{chapter_end_page} is invalid (1-{total_pages}) for skill {skill}")
+            update_json_with_formats(json_output_path, skill, {
+                "skill_name": skill,
+                "chapter_pages": f"{chapter_start_page}-{chapter_end_page}",
+                "formats": [],
+                "pitfalls": [],
+                "error": f"Chapter page range {chapter_start_page}-{chapter_end_page} is invalid",
+                "processed_at": datetime.now().isoformat()
+            })
+        else:
+            tasks.append({"skill": skill, "kind": "formats", "pages": pages, "start": chapter_start_page, "end": chapter_end_page})
+
+    for task in tasks:
+        task["page_texts"] = {}
+        task["page_layouts"] = {}
+        task["page_errors"] = {}
+        task["page_hashes"] = {}
+    return tasks
+
+
+def route_pages(engine: PageTextEngine, tasks: List[Dict], on_task_complete) -> Dict[int, str]:
+    """
+    Extract every needed page exactly once, in page order, and route it to its tasks.
+
+    Sequence pages are tables, so any page covered by a sequence task is read with
+    layout analysis. Layout pages covered by a formats task also get their words
+    read for the table parser. on_task_complete(task) is called as soon as a task's
+    last page has been routed, and the pdfplumber page cache is released per page.
+
+    Returns:
+        Content hash of every routed page (see page_content_hash)
+    """
+    page_hashes: Dict[int, str] = {}
+    page_to_tasks: Dict[int, List[Dict]] = {}
+    for task in tasks:
+        for page_number in range(task["start"], task["end"] + 1):
+            page_to_tasks.setdefault(page_number, []).append(task)
+
+    for page_number in sorted(page_to_tasks):
+        covering = page_to_tasks.pop(page_number)
+        needs_layout = any(task["kind"] == "sequence" for task in covering)
+        layout = None
+        try:
+            text, backend = engine.extract(page_number, needs_layout=needs_layout)
+            if backend == "pdfplumber" and any(task["kind"] == "formats" for task in covering):
+                layout = read_page_layout(engine.plumber_pdf.pages[page_number - 1])
+            error = None
+        except Exception as e:
+            print(f"❌ All text backends failed for page {page_number}: {e}")
+            text, error = None, str(e)
+        engine.release_page(page_number)
+        page_hashes[page_number] = page_content_hash(text)
+
+        for task in covering:
+            task["page_hashes"][page_number] = page_hashes[page_number]
+            if text:
+                task["page_texts"][page_number] = text
+            if error:
+                task["page_errors"][page_number] = error
+            if layout is not None and task["kind"] == "formats":
+                task["page_layouts"][page_number] = layout
+            if task["end"] == page_number:
+                on_task_complete(task)
+    return page_hashes
+
+
+def run_page_task(task: Dict, json_output_path: str) -> None:
+    """Run the LLM processing for a fully routed task, then release its page buffers.
+
+    On a re-ingest the new results are diffed against the previous ones and the
+    changed sequences or formats are marked stale.
+    """
+    try:
+        if task["kind"] == "sequence":
+            process_skill_sequence(task["skill"], task["pages"], task["page_texts"], task["page_errors"], json_output_path)
+        else:
+            process_formats(task["skill"], task["pages"], task["page_texts"], task["page_layouts"], task["page_errors"], json_output_path)
+        if "previous_items" in task:
+            task["stale_items"] = mark_stale_items(json_output_path, task["skill"], task["kind"],
+                                                   task["previous_items"], task["changed_pages"])
+    finally:
+        task["page_texts"], task["page_layouts"], task["page_errors"] = None, None, None
+
+
+def page_content_hash(text: Optional[str]) -> str:
+    """Hash a page's extracted text, ignoring whitespace-only differences."""
+    normalized = re.sub(r"\s+", " ", text or "").strip()
+    return hashlib.sha256(normalized.encode("utf-8")).hexdigest()[:16]
+
+
+def load_page_hashes(json_output_path: str) -> Dict[str, str]:
+    """Return the page hashes recorded by the last extraction into a skills JSON."""
+    try:
+        with open(json_output_path, 'r', encoding='utf-8') as f:
+            return json.load(f).get("metadata", {}).get("page_hashes", {})
+    except Exception:
+        return {}
+
+
+def _sequence_items(skill_data: Dict) -> Dict[str, Dict]:
+    items = {}
+    for grade_block in skill_data.get("progression") or []:
+        for seq in grade_block.get("sequence") or []:
+            items[f"grade {grade_block.get('grade')}/sequence {seq.get('sequence_number')}"] = seq
+    return items
+
+
+def _format_items(skill_data: Dict) -> Dict[str, Dict]:
+    return {f"format {fmt.get('format_number')}": fmt for fmt in skill_data.get("formats") or []}
+
+
+# Fields added to formats by grade assignment, not by extraction
+GRADE_KEYS = ("assigned_grade", "sequence_numbers", "grade_assignment_reasoning")
+
+
+def _item_content(item: Dict, kind: str) -> Dict:
+    """The fields extraction produces for a sequence item or format (stale and grade fields are left out)."""
+    fields = SequenceItem.model_fields if kind == "sequence" else Format.model_fields
+    return {k: v for k, v in item.items() if k in fields}
+
+
+def snapshot_skill_items(json_output_path: str, skill: str, kind: str) -> Dict[str, Dict]:
+    """Copy a skill's current sequences or formats, keyed for stale comparison."""
+    with json_file_lock:
+        try:
+            with open(json_output_path, 'r', encoding='utf-8') as f:
+                skill_data = json.load(f).get("skills", {}).get(skill, {})
+        except Exception:
+            return {}
+    return _sequence_items(skill_data) if kind == "sequence" else _format_items(skill_data)
+
+
+def mark_stale_items(json_output_path: str, skill: str, kind: str, previous_items: Dict[str, Dict],
+                     changed_pages: List[int]) -> List[str]:
+    """
+    Mark re-extracted sequences or formats that differ from the previous extraction as stale.
+
+    A stale item is new or changed content that downstream mappings and generated
+    formats were not built from. The skill records the stale and removed item keys
+    so downstream steps can re-run only for those.
+
+    Returns:
+        Stale item ids ("<skill>/<item key>"), including removed items
+    """
+    item_label = "sequences" if kind == "sequence" else "formats"
+    regrade: List[str] = []
+    with json_file_lock:
+        try:
+            with open(json_output_path, 'r', encoding='utf-8') as f:
+                data = json.load(f)
+            skill_data = data["skills"][skill]
+            items = _sequence_items(skill_data) if kind == "sequence" else _format_items(skill_data)
+
+            now = datetime.now().isoformat()
+            stale_keys = []
+            for key, item in items.items():
+                previous = previous_items.get(key)
+                if previous is None or _item_content(previous, kind) != _item_content(item, kind):
+                    item["stale"] = True
+                    item["stale_since"] = now
+                    stale_keys.append(key)
+                    if kind == "formats" and any("assigned_grade" in prev for prev in previous_items.values()):
+                        regrade.append(item.get("format_number"))
+                    continue
+                # Unchanged content keeps the grade it was assigned
+                for grade_key in GRADE_KEYS:
+                    if grade_key in previous:
+                        item[grade_key] = previous[grade_key]
+                if previous.get("stale"):
+                    # Unchanged, but downstream has not caught up with an earlier change yet
+                    item["stale"] = True
+                    item["stale_since"] = previous.get("stale_since", now)
+                    stale_keys.append(key)
+            removed_keys = [key for key in previous_items if key not in items]
+
+            skill_data[f"stale_{item_label}"] = stale_keys
+            skill_data[f"removed_{item_label}"] = removed_keys
+            skill_data[f"{item_label}_changed_pages"] = changed_pages
+
+            with open(json_output_path, 'w', encoding='utf-8') as f:
+                json.dump(data, f, indent=2, ensure_ascii=False)
+        except Exception as e:
+            print(f"[{skill}] ⚠️  Could not mark stale {item_label}: {e}")
+            return []
+
+    print(f"[{skill}] 🏷️  {len(stale_keys)} {item_label} marked stale, {len(removed_keys)} removed")
+    if regrade:
+        reassign_grades(json_output_path, skill, regrade)
+    return [f"{skill}/{key}" for key in stale_keys + removed_keys]
+
+
+def reassign_grades(json_output_path: str, skill: str, format_numbers: List[str]) -> None:
+    """
+    Re-run grade assignment for re-extracted formats of a skill that had grades before.
+
+    Formats linked from the progression are resolved locally; the rest go to the
+    LLM in one call made outside the JSON lock.
+    """
+    with json_file_lock:
+        with open(json_output_path, 'r', encoding='utf-8') as f:
+            skill_data = json.load(f)["skills"][skill]
+    progression = skill_data.get("progression") or []
+    wanted = set(format_numbers)
+    formats = [fmt for fmt in skill_data.get("formats") or [] if fmt.get("format_number") in wanted]
+    if not formats or not progression:
+        return
+
+    graded, unresolved = assign_grades_locally(progression, formats)
+    unresolved_numbers = set(unresolved)
+    graded = {fmt.get("format_number"): fmt for fmt in graded if fmt.get("format_number") not in unresolved_numbers}
+    if unresolved:
+        try:
+            for fmt in assign_grades_with_llm(skill, progression, [f for f in formats if f.get("format_number") in unresolved_numbers]):
+                if "assigned_grade" in fmt:
+                    graded[fmt.get("format_number")] = fmt
+        except Exception as e:
+            print(f"[{skill}] ⚠️  Could not re-assign grades for {len(unresolved)} formats: {e}")
+
+    with json_file_lock:
+        with open(json_output_path, 'r', encoding='utf-8') as f:
+            data = json.load(f)
+        for fmt in data["skills"][skill].get("formats") or []:
+            assigned = graded.get(fmt.get("format_number"))
+            if assigned is not None:
+                for grade_key in GRADE_KEYS:
+                    fmt[grade_key] = assigned[grade_key]
+        with open(json_output_path, 'w', encoding='utf-8') as f:
+            json.dump(data, f, indent=2, ensure_ascii=False)
+    print(f"[{skill}] 🎓 Re-assigned grades for {len(graded)}/{len(formats)} re-extracted formats")
+
+
+def summarize_reingest(book_run: Dict) -> Dict:
+    """Summarize what a re-ingest re-extracted and which items it marked stale."""
+    reprocessed = list(book_run["futures"].values())
+    return {
+        "reingested_at": datetime.now().isoformat(),
+        "changed_pages": sorted({p for task in reprocessed for p in task.get("changed_pages", [])}),
+        "reprocessed_tasks": [f"{task['skill']}/{task['kind']}" for task in reprocessed],
+        "unchanged_tasks": [f"{task['skill']}/{task['kind']}" for task in book_run["unchanged_tasks"]],
+        "stale_items": [item for task in reprocessed for item in task.get("stale_items", [])],
+    }
+
+
 class SequenceItem(BaseModel):
     """Individual sequence item within a grade progression."""
     sequence_number: int
@@ -235,13 +854,307 @@ class PitfallsResponse(BaseModel):
     """Response containing pitfalls."""
     pitfalls: List[str]
 
-def process_formats(pdf_path, skill, pages, json_output_path):
-    """Process formats for a single skill from the PDF.
+class ChapterFormatsAndPitfallsResponse(BaseModel):
+    """Response containing all formats and pitfalls for a chapter/skill from a single call."""
+    skill_name: str
+    chapter_pages: str
+    formats: List[Format]
+    pitfalls: List[str]
+
+
+# Layout-aware parser for the two-column Teacher/Students format tables
+FORMAT_HEADER_RE = re.compile(r"^FORMAT\s+(\d+\.\d+)\s*:?\s*(.*)$", re.IGNORECASE)
+PART_HEADER_RE = re.compile(r"^PART\s+([A-Z])\b\s*:?\s*(.*)$")
+STEP_RE = re.compile(r"^(\d{1,2})\.\s*(.*)$")
+FORMAT_PARSER_MIN_CONFIDENCE = 0.8
+# Local versions of the prompts' classroom -> online wording rules, for parser formats the LLM never sees
+ONLINE_WORDING = [
+    (re.compile(r"\bwrite on (?:the )?board\b", re.IGNORECASE), "display"),
+    (re.compile(r"\bpoint to\b", re.IGNORECASE), "highlight"),
+    (re.compile(r"\bpoints to\b", re.IGNORECASE), "highlights"),
+    (re.compile(r"\b(on|from|at) the board\b", re.IGNORECASE), r"\1 the screen"),
+]
+
+
+class FormatPageParse(BaseModel):
+    """Outcome of the table parser for a single PDF page."""
+    page_number: int
+    is_format_page: bool
+    format_numbers: List[str] = []
+    confidence: float = 0.0
+    issues: List[str] = []
+
+
+class ChapterFormatParse(BaseModel):
+    """Formats recovered by the table parser for a chapter, plus the pages it could not handle."""
+    formats: List[Format]
+    pages: List[FormatPageParse]
+    low_confidence_pages: List[int]
+    prose_pages: List[int]
+
+
+def _group_words_into_lines(words: List[Dict], y_tolerance: float = 3) -> List[List[Dict]]:
+    """Group pdfplumber words into visual lines by their top coordinate."""
+    lines: List[List[Dict]] = []
+    line_tops: List[float] = []
+    for word in sorted(words, key=lambda w: (w["top"], w["x0"])):
+        if lines and abs(word["top"] - line_tops[-1]) <= y_tolerance:
+            lines[-1].append(word)
+        else:
+            lines.append([word])
+            line_tops.append(word["top"])
+    return [sorted(line, key=lambda w: w["x0"]) for line in lines]
+
+
+def _find_column_split(page, lines: List[List[Dict]]) -> Optional[float]:
+    """Return the x coordinate separating the Teacher and Students columns, if any."""
+    for line in lines:
+        texts = [w["text"].upper() for w in line]
+        if "TEACHER" in texts and "STUDENTS" in texts:
+            students_word = line[texts.index("STUDENTS")]
+            return students_word["x0"] - 2
+
+    # Fall back to pdfplumber's table detection for ruled tables without header words
+    try:
+        for table in page.find_tables():
+            cells = [cell for cell in table.rows[0].cells if cell] if table.rows else []
+            if len(cells) == 2:
+                return cells[1][0]
+    except Exception:
+        pass
+    return None
+
+
+def _line_text(words: List[Dict]) -> str:
+    return " ".join(w["text"] for w in words).strip()
+
+
+def _append_text(existing: Optional[str], addition: str) -> Optional[str]:
+    if not addition:
+        return existing
+    return f"{existing} {addition}" if existing else addition
+
+
+def read_page_layout(page) -> Dict:
+    """Read the words and Teacher/Students column split of a pdfplumber page for the table parser."""
+    try:
+        words = page.extract_words(x_tolerance=3, y_tolerance=3)
+    except Exception as e:
+        return {"words": [], "split_x": None, "error": str(e)}
+    return {"words": words, "split_x": _find_column_split(page, _group_words_into_lines(words))}
+
+
+def parse_chapter_format_tables(page_layouts: Dict[int, Dict], start_page: int, end_page: int) -> ChapterFormatParse:
+    """Parse DI teaching formats directly from the page layout of a chapter.
+
+    Format pages are recognised by a "FORMAT X.Y" heading or a Teacher/Students
+    column header. Words are split into the two columns by x coordinate, numbered
+    lines in the teacher column start new steps and "PART A" lines start new parts.
+    Text is kept verbatim. Every page gets a confidence score; formats that touch
+    a page below FORMAT_PARSER_MIN_CONFIDENCE are dropped so the LLM can handle them.
+
+    Args:
+        page_layouts: read_page_layout results by page number; pages without a
+            layout (plain prose read by the fast text backend) are prose pages
+        start_page: First page of the chapter (1-based)
+        end_page: Last page of the chapter (1-based, inclusive)
+
+    Returns:
+        ChapterFormatParse with the clean formats and the pages left for the LLM
+    """
+    formats: List[Format] = []
+    format_pages: Dict[str, List[int]] = {}
+    page_results: List[FormatPageParse] = []
+    prose_pages: List[int] = []
+
+    current_format: Optional[Format] = None
+    current_part: Optional[FormatPart] = None
+    current_step: Optional[FormatStep] = None
+    awaiting_title = False
+
+    for page_number in range(start_page, end_page + 1):
+        layout = page_layouts.get(page_number)
+        if layout is None:
+            prose_pages.append(page_number)
+            current_format, current_part, current_step = None, None, None
+            continue
+        if layout.get("error"):
+            page_results.append(FormatPageParse(page_number=page_number, is_format_page=True, issues=[f"word extraction failed: {layout['error']}"]))
+            continue
+
+        lines = _group_words_into_lines(layout["words"])
+        has_format_header = any(FORMAT_HEADER_RE.match(_line_text(line)) for line in lines)
+        split_x = layout["split_x"]
+
+        if not has_format_header and split_x is None:
+            # Prose page: any open format ends here
+            prose_pages.append(page_number)
+            current_format, current_part, current_step = None, None, None
+            continue
+
+        result = FormatPageParse(page_number=page_number, is_format_page=True)
+        if split_x is None:
+            result.issues.append("no Teacher/Students columns found")
+
+        table_words = 0
+        assigned_words = 0
+        for line in lines:
+            text = _line_text(line)
+            upper_words = [w["text"].upper() for w in line]
+            if "TEACHER" in upper_words and "STUDENTS" in upper_words:
+                continue
+
+            header = FORMAT_HEADER_RE.match(text)
+            if header:
+                current_format = Format(format_number=header.group(1), title=header.group(2).strip().upper(), parts=[])
+                formats.append(current_format)
+                current_part, current_step = None, None
+                awaiting_title = not current_format.title
+
+            if current_format is None:
+                continue
+            if current_format.format_number not in result.format_numbers:
+                result.format_numbers.append(current_format.format_number)
+                format_pages.setdefault(current_format.format_number, []).append(page_number)
+            if header:
+                continue
+
+            if awaiting_title:
+                current_format.title = text.upper()
+                awaiting_title = False
+                continue
+
+            part_header = PART_HEADER_RE.match(text)
+            if part_header:
+                current_part = FormatPart(
+                    part_name=f"Part {part_header.group(1)}",
+                    description=part_header.group(2).strip() or None,
+                    steps=[],
+                )
+                current_format.parts.append(current_part)
+                current_step = None
+                continue
+
+            if split_x is None:
+                continue
+
+            left = _line_text([w for w in line if w["x0"] < split_x])
+            right = _line_text([w for w in line if w["x0"] >= split_x])
+            table_words += len(line)
+
+            step_match = STEP_RE.match(left)
+            if step_match:
+                if current_part is None:
+                    # Formats without explicit parts use the format title as the single part name
+                    current_part = FormatPart(part_name=current_format.title, steps=[])
+                    current_format.parts.append(current_part)
+                step_number = int(step_match.group(1))
+                expected = current_part.steps[-1].step_number + 1 if current_part.steps else 1
+                if step_number != expected:
+                    result.issues.append(f"format {current_format.format_number}: step {step_number} follows step {expected - 1}")
+                current_step = FormatStep(
+                    step_number=step_number,
+                    teacher_action=step_match.group(2).strip(),
+                    student_response=right or None,
+                )
+                current_part.steps.append(current_step)
+                assigned_words += len(line)
+            elif current_step is not None:
+                current_step.teacher_action = _append_text(current_step.teacher_action, left) or ""
+                current_step.student_response = _append_text(current_step.student_response, right)
+                assigned_words += len(line)
+            elif current_part is not None and not right:
+                current_part.description = _append_text(current_part.description, left)
+                assigned_words += len(line)
+
+        if table_words and assigned_words / table_words < 0.9:
+            result.issues.append(f"only {assigned_words}/{table_words} table words assigned to steps")
+        if split_x is not None and current_format is None:
+            result.issues.append("table found without a format heading")
+        result.confidence = 0.0 if split_x is None else max(0.0, 1.0 - 0.25 * len(result.issues))
+        page_results.append(result)
+
+    low_confidence_pages = sorted(
+        r.page_number for r in page_results
+        if r.is_format_page and r.confidence < FORMAT_PARSER_MIN_CONFIDENCE
+    )
+    # A format is only trusted if every page it spans parsed cleanly and it has steps
+    clean_formats: List[Format] = []
+    for fmt in formats:
+        pages_for_format = format_pages.get(fmt.format_number, [])
+        has_steps = fmt.parts and all(part.steps for part in fmt.parts)
+        if has_steps and fmt.title and not any(p in low_confidence_pages for p in pages_for_format):
+            clean_formats.append(fmt)
+        else:
+            low_confidence_pages.extend(p for p in pages_for_format if p not in low_confidence_pages)
+
+    return ChapterFormatParse(
+        formats=clean_formats,
+        pages=page_results,
+        low_confidence_pages=sorted(set(low_confidence_pages)),
+        prose_pages=prose_pages,
+    )
+
+
+def reword_for_online(text: Optional[str]) -> Optional[str]:
+    """Apply ONLINE_WORDING to text, keeping the case of the replaced word's first letter."""
+    if not text:
+        return text
+    for pattern, replacement in ONLINE_WORDING:
+        def substitute(match, replacement=replacement):
+            new = match.expand(replacement)
+            return new[0].upper() + new[1:] if match.group(0)[0].isupper() else new
+        text = pattern.sub(substitute, text)
+    return text
+
+
+def reword_format_for_online(fmt: Format) -> Format:
+    """Copy of a parser format with the classroom wording of its steps replaced (see ONLINE_WORDING)."""
+    return fmt.model_copy(update={"parts": [
+        part.model_copy(update={
+            "description": reword_for_online(part.description),
+            "steps": [
+                step.model_copy(update={
+                    "teacher_action": reword_for_online(step.teacher_action),
+                    "notes": reword_for_online(step.notes),
+                })
+                for step in part.steps
+            ],
+        })
+        for part in fmt.parts
+    ]})
+
+
+def format_number_key(format_number: str):
+    """Sort key for format numbers such as "7.10" (numeric, not lexical)."""
+    try:
+        return tuple(int(part) for part in format_number.split("."))
+    except (ValueError, AttributeError):
+        return (float("inf"),)
+
+
+def build_chapter_text(page_texts: Dict[int, str], page_errors: Dict[int, str], start_page: int, end_page: int) -> str:
+    """Concatenate routed page texts with "--- Page N ---" markers, keeping extraction errors visible."""
+    chapter_text = ""
+    for page_number in range(start_page, end_page + 1):
+        if page_texts.get(page_number):
+            chapter_text += f"\n--- Page {page_number} ---\n"
+            chapter_text += page_texts[page_number] + "\n"
+        elif page_number in page_errors:
+            chapter_text += f"\n--- Page {page_number} ---\n"
+            chapter_text += f"[ERROR: Could not extract text from page {page_number}: {page_errors[page_number]}]\n"
+    return chapter_text
+
+
+def process_formats(skill, pages, page_texts, page_layouts, page_errors, json_output_path):
+    """Process formats for a single skill from its routed chapter pages.
     
     Args:
-        pdf_path: Path to the PDF file
         skill: The skill name
         pages: Dictionary containing page information for the skill
+        page_texts: Page number -> extracted text for the chapter
+        page_layouts: Page number -> read_page_layout result for layout pages
+        page_errors: Page number -> extraction error for pages that failed
         json_output_path: Path to the JSON output file
     
     Returns:
@@ -251,105 +1164,69 @@ def process_formats(pdf_path, skill, pages, json_output_path):
     chapter_start_page = pages.get("chapter_start_page")
     chapter_end_page = pages.get("chapter_end_page")
     
-    if not chapter_start_page or not chapter_end_page:
-        print(f"[{skill}] ⚠️  No chapter page range defined, skipping format processing")
-        return
-    
     print(f"\n[{skill}] Extracting formats from chapter pages {chapter_start_page} to {chapter_end_page}")
 
-    # Open PDF for this thread
-    with pdfplumber.open(pdf_path) as pdf:
-        # Validate page numbers (pdfplumber uses 0-based indexing)
-        if chapter_start_page < 1 or chapter_end_page > len(pdf.pages):
-            print(f"Error: Chapter page range {chapter_start_page}-{chapter_end_page} is out of bounds (1-{len(pdf.pages)}) for skill {skill}")
-            
-            # Write error to JSON
-            format_data = {
-                "skill_name": skill,
-                "chapter_pages": f"{chapter_start_page}-{chapter_end_page}",
-                "formats": [],
-                "error": f"Chapter page range {chapter_start_page}-{chapter_end_page} is out of bounds",
-                "processed_at": datetime.now().isoformat()
-            }
-            update_json_with_formats(json_output_path, skill, format_data)
-            return
+    chapter_text = build_chapter_text(page_texts, page_errors, chapter_start_page, chapter_end_page)
+    print(f"[{skill}] Extracted {len(chapter_text)} characters from chapter")
 
-        # Extract text from entire chapter
-        chapter_text = ""
-        for page_num in range(chapter_start_page - 1, chapter_end_page):
-            try:
-                page = pdf.pages[page_num]
-                text = page.extract_text()
-                if text:
-                    chapter_text += f"\n--- Page {page_num + 1} ---\n"
-                    chapter_text += text + "\n"
-            except Exception as e:
-                print(f"[{skill}] ⚠️  Error extracting text from page {page_num + 1}: {e}")
-                # Try alternative extraction method
-                try:
-                    # Use a more robust extraction method
-                    text = page.extract_text(x_tolerance=3, y_tolerance=3)
-                    if text:
-                        chapter_text += f"\n--- Page {page_num + 1} ---\n"
-                        chapter_text += text + "\n"
-                        print(f"[{skill}] ✓ Alternative extraction succeeded for page {page_num + 1}")
-                except Exception as e2:
-                    print(f"[{skill}] ❌ Alternative extraction also failed for page {page_num + 1}: {e2}")
-                    # Last resort: try PyPDF2 for this page
-                    try:
-                        print(f"[{skill}] 🔄 Trying PyPDF2 as last resort for page {page_num + 1}")
-                        # Note: This would require opening the PDF with PyPDF2 separately
-                        # For now, just mark the error
-                        chapter_text += f"\n--- Page {page_num + 1} ---\n"
-                        chapter_text += f"[ERROR: Could not extract text from page {page_num + 1}: {e2}]\n"
-                    except:
-                        chapter_text += f"\n--- Page {page_num + 1} ---\n"
-                        chapter_text += f"[ERROR: Could not extract text from page {page_num + 1}]\n"
-        
-        print(f"[{skill}] Extracted {len(chapter_text)} characters from chapter")
-        
-        # Process with AI to extract formats and pitfalls
-        try:
-            print(f"[{skill}] Processing formats with Gemini...")
-            formats_response = extract_chapter_formats(chapter_text, skill)
-            
-            print(f"[{skill}] Processing pitfalls with Gemini...")
-            pitfalls_response = extract_pitfalls(chapter_text, skill)
-            
-            format_data = {
-                "skill_name": formats_response.skill_name if formats_response else skill,
-                "chapter_pages": f"{chapter_start_page}-{chapter_end_page}",
-                "formats": [format_item.model_dump() for format_item in formats_response.formats] if formats_response else [],
-                "pitfalls": pitfalls_response.pitfalls if pitfalls_response else [],
-                "raw_text": chapter_text,
-                "processed_at": datetime.now().isoformat()
-            }
-            print(f"[{skill}] ✓ Successfully extracted {len(format_data['formats'])} formats and {len(format_data['pitfalls'])} pitfalls")
+    # Parse clean Teacher/Students format tables locally; only the rest goes to the LLM
+    try:
+        table_parse = parse_chapter_format_tables(page_layouts, chapter_start_page, chapter_end_page)
+    except Exception as e:
+        print(f"[{skill}] ⚠️  Format table parser failed, using LLM for the whole chapter: {e}")
+        table_parse = None
 
-        except Exception as e:
-            print(f"[{skill}] ❌ Error extracting formats/pitfalls: {e}")
-            format_data = {
-                "skill_name": skill,
-                "chapter_pages": f"{chapter_start_page}-{chapter_end_page}",
-                "formats": [],
-                "pitfalls": [],
-                "raw_text": chapter_text,
-                "error": str(e),
-                "processed_at": datetime.now().isoformat()
-            }
+    # Formats recovered by the table parser are recorded as extracted_by "parser", the rest as "llm"
+    parsed_numbers = {fmt.format_number for fmt in table_parse.formats} if table_parse else set()
+
+    # Process with AI to extract formats and pitfalls
+    try:
+        if table_parse and table_parse.formats:
+            formats_response, pitfalls_response = extract_formats_with_table_parse(
+                table_parse, page_texts, chapter_text, skill, f"{chapter_start_page}-{chapter_end_page}"
+            )
+        else:
+            formats_response, pitfalls_response = extract_formats_and_pitfalls(chapter_text, skill)
+
+        format_data = {
+            "skill_name": formats_response.skill_name if formats_response else skill,
+            "chapter_pages": f"{chapter_start_page}-{chapter_end_page}",
+            "formats": [
+                {**format_item.model_dump(),
+                 "extracted_by": "parser" if format_item.format_number in parsed_numbers else "llm"}
+                for format_item in formats_response.formats
+            ] if formats_response else [],
+            "pitfalls": pitfalls_response.pitfalls if pitfalls_response else [],
+            "raw_text": chapter_text,
+            "processed_at": datetime.now().isoformat()
+        }
+        print(f"[{skill}] ✓ Successfully extracted {len(format_data['formats'])} formats and {len(format_data['pitfalls'])} pitfalls")
+
+    except Exception as e:
+        print(f"[{skill}] ❌ Error extracting formats/pitfalls: {e}")
+        format_data = {
+            "skill_name": skill,
+            "chapter_pages": f"{chapter_start_page}-{chapter_end_page}",
+            "formats": [],
+            "pitfalls": [],
+            "raw_text": chapter_text,
+            "error": str(e),
+            "processed_at": datetime.now().isoformat()
+        }
 
-        # Write formats to JSON immediately
-        update_json_with_formats(json_output_path, skill, format_data)
-        print(f"[{skill}] 💾 Saved formats to JSON file")
+    # Write formats to JSON immediately
+    update_json_with_formats(json_output_path, skill, format_data)
+    print(f"[{skill}] 💾 Saved formats to JSON file")
 
 
-def process_skill_sequence(pdf_path, skill, pages, json_output_path):
-    """Process a single skill's instructional sequence from the PDF.
+def process_skill_sequence(skill, pages, page_texts, page_errors, json_output_path):
+    """Process a single skill's instructional sequence from its routed pages.
     
     Args:
-        pdf_path: Path to the PDF file
         skill: The skill name
         pages: Dictionary containing page information for the skill
+        page_texts: Page number -> extracted text for the sequence pages
+        page_errors: Page number -> extraction error for pages that failed
         json_output_path: Path to the JSON output file
     
     Returns:
@@ -360,83 +1237,182 @@ def process_skill_sequence(pdf_path, skill, pages, json_output_path):
 
     print(f"\n[{skill}] Extracting text from pages {start_page} to {end_page}")
 
-    # Open PDF for this thread
-    with pdfplumber.open(pdf_path) as pdf:
-        # Validate page numbers (pdfplumber uses 0-based indexing)
-        if start_page < 1 or end_page > len(pdf.pages):
-            print(f"Error: Page range {start_page}-{end_page} is out of bounds (1-{len(pdf.pages)}) for skill {skill}")
-            
-            # Still write the error to JSON
-            skill_data = {
-                "name": skill,
-                "instruction_sequence_pages": f"{start_page}-{end_page}",
-                "raw_text": "",
-                "progression": None,
-                "error": f"Page range {start_page}-{end_page} is out of bounds"
-            }
-            update_json_with_skill(json_output_path, skill, skill_data)
-            return
-
-        # Extract text from pages
-        instructional_sequence_text = ""
-        for page_num in range(start_page - 1, end_page):
-            try:
-                page = pdf.pages[page_num]
-                text = page.extract_text()
-                if text:
-                    instructional_sequence_text += text + "\n"
-            except Exception as e:
-                print(f"[{skill}] ⚠️  PDF PARSING ERROR on page {page_num + 1}: {e}")
-                print(f"[{skill}] 🔍 Error type: {type(e).__name__}")
-                print(f"[{skill}] 📄 This is a PDF reading issue, not an LLM issue")
-                # Try alternative extraction method
-                try:
-                    # Use a more robust extraction method
-                    text = page.extract_text(x_tolerance=3, y_tolerance=3)
-                    if text:
-                        instructional_sequence_text += text + "\n"
-                        print(f"[{skill}] ✓ Alternative extraction succeeded for page {page_num + 1}")
-                except Exception as e2:
-                    print(f"[{skill}] ❌ Alternative extraction also failed for page {page_num + 1}: {e2}")
-                    # Last resort: try PyPDF2 for this page
-                    try:
-                        print(f"[{skill}] 🔄 Trying PyPDF2 as last resort for page {page_num + 1}")
-                        # Note: This would require opening the PDF with PyPDF2 separately
-                        # For now, just mark the error
-                        instructional_sequence_text += f"[ERROR: Could not extract text from page {page_num + 1}: {e2}]\n"
-                    except:
-                        instructional_sequence_text += f"[ERROR: Could not extract text from page {page_num + 1}]\n"
-        
-        print(f"[{skill}] Extracted {len(instructional_sequence_text)} characters of text")
+    instructional_sequence_text = ""
+    for page_number in range(start_page, end_page + 1):
+        if page_texts.get(page_number):
+            instructional_sequence_text += page_texts[page_number] + "\n"
+        elif page_number in page_errors:
+            instructional_sequence_text += f"[ERROR: Could not extract text from page {page_number}: {page_errors[page_number]}]\n"
+    
+    print(f"[{skill}] Extracted {len(instructional_sequence_text)} characters of text")
+    
+    # Process with AI
+    try:
+        print(f"[{skill}] Processing with Gemini...")
+        sequence = extract_instructional_sequence(instructional_sequence_text, skill)
         
-        # Process with AI
-        try:
-            print(f"[{skill}] Processing with Gemini...")
-            sequence = extract_instructional_sequence(instructional_sequence_text, skill)
-            
-            skill_data = {
-                "name": sequence.name if sequence else skill,
-                "instruction_sequence_pages": f"{start_page}-{end_page}",
-                "raw_text": instructional_sequence_text,
-                "progression": [grade_prog.model_dump() for grade_prog in sequence.progression] if sequence else None,
-                "processed_at": datetime.now().isoformat()
-            }
-            print(f"[{skill}] ✓ Successfully processed")
+        skill_data = {
+            "name": sequence.name if sequence else skill,
+            "instruction_sequence_pages": f"{start_page}-{end_page}",
+            "raw_text": instructional_sequence_text,
+            "progression": [grade_prog.model_dump() for grade_prog in sequence.progression] if sequence else None,
+            "processed_at": datetime.now().isoformat()
+        }
+        print(f"[{skill}] ✓ Successfully processed")
 
-        except Exception as e:
-            print(f"[{skill}] ❌ Error extracting instructional sequence: {e}")
-            skill_data = {
-                "name": skill,
-                "instruction_sequence_pages": f"{start_page}-{end_page}",
-                "raw_text": instructional_sequence_text,
-                "progression": None,
-                "error": str(e),
-                "processed_at": datetime.now().isoformat()
-            }
+    except Exception as e:
+        print(f"[{skill}] ❌ Error extracting instructional sequence: {e}")
+        skill_data = {
+            "name": skill,
+            "instruction_sequence_pages": f"{start_page}-{end_page}",
+            "raw_text": instructional_sequence_text,
+            "progression": None,
+            "error": str(e),
+            "processed_at": datetime.now().isoformat()
+        }
+
+    # Write this skill to JSON immediately
+    update_json_with_skill(json_output_path, skill, skill_data)
+    print(f"[{skill}] 💾 Saved to JSON file")
+
+
+def join_page_texts(page_texts: Dict[int, str], page_numbers: List[int]) -> str:
+    """Join the text of the given pages using the same page markers as the chapter text."""
+    return "".join(
+        f"\n--- Page {page_number} ---\n{page_texts[page_number]}\n"
+        for page_number in sorted(page_numbers) if page_texts.get(page_number)
+    )
+
+
+def extract_formats_with_table_parse(table_parse: ChapterFormatParse, page_texts: Dict[int, str], chapter_text: str, skill: str, chapter_pages: str):
+    """Combine table-parser formats with LLM extraction of the remaining pages.
+
+    Low-confidence format pages and prose pages go through the fused call (formats
+    + pitfalls) when there are any; otherwise only the prose pages are sent for pitfalls.
+
+    Returns:
+        Tuple of (formats response, pitfalls response)
+    """
+    parsed_pages = [r.page_number for r in table_parse.pages if r.page_number not in table_parse.low_confidence_pages]
+    print(f"[{skill}] 🧮 Table parser recovered {len(table_parse.formats)} formats from {len(parsed_pages)} pages "
+          f"({len(table_parse.low_confidence_pages)} low-confidence pages left for Gemini)")
+    with token_savings_lock:
+        token_savings["format_pages_parsed"] += len(parsed_pages)
+        token_savings["format_pages_sent_to_llm"] += len(table_parse.low_confidence_pages)
+
+    # The LLM rewrites classroom wording for the online app; parsed text is verbatim, so reword it locally
+    formats = [reword_format_for_online(fmt) for fmt in table_parse.formats]
+    if table_parse.low_confidence_pages:
+        remaining_text = join_page_texts(page_texts, table_parse.low_confidence_pages + table_parse.prose_pages)
+        llm_formats, pitfalls_response = extract_formats_and_pitfalls(remaining_text, skill, full_chapter_text=chapter_text)
+        parsed_numbers = {fmt.format_number for fmt in formats}
+        formats.extend(fmt for fmt in llm_formats.formats if fmt.format_number not in parsed_numbers)
+    else:
+        prose_text = join_page_texts(page_texts, table_parse.prose_pages)
+        print(f"[{skill}] Processing pitfalls with Gemini (prose pages only)...")
+        pitfalls_response = extract_pitfalls(prose_text, skill)
+        record_token_savings(chapter_text, [prose_text], call_kind="parser_only")
+
+    formats.sort(key=lambda fmt: format_number_key(fmt.format_number))
+    formats_response = ChapterFormatsResponse(skill_name=skill, chapter_pages=chapter_pages, formats=formats)
+    return formats_response, pitfalls_response
+
+
+def extract_formats_and_pitfalls(chapter_text, skill, full_chapter_text=None):
+    """Extract formats and pitfalls for a chapter, preferring a single fused call.
+
+    Falls back to the separate formats and pitfalls calls if the fused call fails.
+    full_chapter_text is the whole chapter when chapter_text only holds the pages
+    left over by the format table parser; it is used for token accounting.
+
+    Returns:
+        Tuple of (formats response, pitfalls response)
+    """
+    try:
+        print(f"[{skill}] Processing formats and pitfalls with Gemini (single call)...")
+        fused_response = extract_chapter_formats_and_pitfalls(chapter_text, skill)
+        saved = record_token_savings(full_chapter_text or chapter_text, [chapter_text], call_kind="fused")
+        print(f"[{skill}] 💰 Fused extraction saved ~{saved} input tokens")
+        formats_response = ChapterFormatsResponse(
+            skill_name=fused_response.skill_name,
+            chapter_pages=fused_response.chapter_pages,
+            formats=fused_response.formats,
+        )
+        return formats_response, PitfallsResponse(pitfalls=fused_response.pitfalls)
+    except Exception as e:
+        print(f"[{skill}] ⚠️  Fused extraction failed, falling back to separate calls: {e}")
+
+    print(f"[{skill}] Processing formats with Gemini...")
+    formats_response = extract_chapter_formats(chapter_text, skill)
+
+    print(f"[{skill}] Processing pitfalls with Gemini...")
+    pitfalls_response = extract_pitfalls(chapter_text, skill)
+    record_token_savings(full_chapter_text or chapter_text, [chapter_text, chapter_text], call_kind="fallback")
+    return formats_response, pitfalls_response
+
+
+def extract_chapter_formats_and_pitfalls(text, skill_name):
+    """Extract all formats and pitfalls from a chapter's text in one call."""
+    prompt = f"""
+    Extract all teaching formats AND up to 10 concise pitfalls from the chapter text for the skill "{skill_name}".
+
+    FORMATS
+    Look for sections that start with "Format X.Y" followed by a title (e.g., "Format 7.1 EQUALITY INTRODUCTION").
+
+    Each format typically contains:
+    - A format number and title
+    - Multiple parts (Part A, Part B, etc.)
+    - Each part contains numbered steps with teacher actions and student responses
+    - Teacher actions are in the left column, student responses in the right column
+
+    PITFALLS
+    Look for:
+    - Statements about what NOT to do
+    - Common mistakes students make
+    - Things to avoid when teaching
+    - Incorrect approaches
+    - Warning statements
+    - "Don't", "Avoid" and "Never" statements
+
+    Text: {text}
+
+    Instructions for formats:
+    - Extract all formats found in the text
+    - For each format, capture the format number (e.g., "7.1") and title
+    - Identify all parts within each format (Part A, Part B, etc.)
+    - For each part, extract all numbered steps
+    - For each step, capture:
+      - The step number
+      - Teacher action (left column content)
+      - Student response (right column content, if present)
+      - Any parenthetical notes or instructions
+    - Maintain the sequential order of formats and steps as they appear
 
-        # Write this skill to JSON immediately
-        update_json_with_skill(json_output_path, skill, skill_data)
-        print(f"[{skill}] 💾 Saved to JSON file")
+    Instructions for pitfalls:
+    - Extract only the most important pitfalls/don'ts
+    - Keep each pitfall concise (1-2 short sentences max)
+    - Focus on actionable don'ts that would be useful for teachers
+    - Don't include obvious or trivial warnings
+    - If no clear pitfalls are found, return an empty list
+    - Maximum 10 pitfalls
+    - Focus on educational/instructional pitfalls, not general safety warnings
+
+    Instructions for both:
+    - Convert classroom-specific language to online application equivalents:
+      - "Point to" → "Highlight" or "Display"
+      - "Write on board" → "Display"
+      - "Say" → "Present" or "Show"
+      - Remove references to physical classroom interactions
+    - Only extract what is explicitly present in the text
+
+    Critical:
+    - DON'T make up formats or pitfalls that aren't in the text
+    - Follow the schema exactly
+    - Capture all formats in the chapter, not just the first one
+    """
+
+    response = produce_structured_response_gemini(prompt, ChapterFormatsAndPitfallsResponse)
+    return response
 
 
 def extract_pitfalls(text, skill_name):
@@ -559,7 +1535,7 @@ def extract_instructional_sequence(text, skill_name):
     
     return response
 
-def initialize_json_file(output_filename: str = None) -> str:
+def initialize_json_file(output_filename: str = None, source_document: str = "Direct_Instruction_Mathematics.pdf") -> str:
     """Initialize or verify the JSON file with metadata, preserving existing data."""
     if output_filename is None:
         output_filename = f"di_math_instructional_sequences.json"
@@ -594,7 +1570,7 @@ def initialize_json_file(output_filename: str = None) -> str:
             initial_data = {
                 "metadata": {
                     "extraction_timestamp": datetime.now().isoformat(),
-                    "source_document": "Direct_Instruction_Mathematics.pdf",
+                    "source_document": source_document,
                     "total_skills_processed": 0,
                     "extractor_version": "1.0",
                     "status": "in_progress"
@@ -614,88 +1590,100 @@ def initialize_json_file(output_filename: str = None) -> str:
 
 def update_json_with_formats(output_path: str, skill_name: str, format_data: Dict) -> bool:
     """Update the JSON file by adding format data to an existing skill's data."""
-    try:
-        # Read existing data
-        with open(output_path, 'r', encoding='utf-8') as f:
-            data = json.load(f)
+    with json_file_lock:
+        try:
+            # Read existing data
+            with open(output_path, 'r', encoding='utf-8') as f:
+                data = json.load(f)
         
-        # Check if the skill already exists in the skills section
-        if "skills" not in data:
-            data["skills"] = {}
+            # Check if the skill already exists in the skills section
+            if "skills" not in data:
+                data["skills"] = {}
         
-        if skill_name not in data["skills"]:
-            print(f"Warning: Skill '{skill_name}' not found in existing data. Creating new entry.")
-            data["skills"][skill_name] = {"name": skill_name}
+            if skill_name not in data["skills"]:
+                print(f"Warning: Skill '{skill_name}' not found in existing data. Creating new entry.")
+                data["skills"][skill_name] = {"name": skill_name}
         
-        # Add format data to the existing skill object
-        data["skills"][skill_name]["formats"] = format_data["formats"]
-        data["skills"][skill_name]["pitfalls"] = format_data["pitfalls"]
-        data["skills"][skill_name]["chapter_pages"] = format_data["chapter_pages"]
-        data["skills"][skill_name]["formats_processed_at"] = format_data["processed_at"]
+            # Add format data to the existing skill object
+            data["skills"][skill_name]["formats"] = format_data["formats"]
+            data["skills"][skill_name]["pitfalls"] = format_data["pitfalls"]
+            data["skills"][skill_name]["chapter_pages"] = format_data["chapter_pages"]
+            data["skills"][skill_name]["formats_processed_at"] = format_data["processed_at"]
         
-        # Add error if present
-        if "error" in format_data:
-            data["skills"][skill_name]["formats_error"] = format_data["error"]
-        # Update metadata
-        data["metadata"]["last_updated"] = datetime.now().isoformat()
+            # Add error if present; a successful re-extraction clears an earlier one
+            if "error" in format_data:
+                data["skills"][skill_name]["formats_error"] = format_data["error"]
+            else:
+                data["skills"][skill_name].pop("formats_error", None)
+            # Update metadata
+            data["metadata"]["last_updated"] = datetime.now().isoformat()
         
-        # Write back to file
-        with open(output_path, 'w', encoding='utf-8') as f:
-            json.dump(data, f, indent=2, ensure_ascii=False)
+            # Write back to file
+            with open(output_path, 'w', encoding='utf-8') as f:
+                json.dump(data, f, indent=2, ensure_ascii=False)
         
-        print(f"✓ Added formats to existing skill data: {skill_name}")
-        return True
+            print(f"✓ Added formats to existing skill data: {skill_name}")
+            return True
         
-    except Exception as e:
-        print(f"Error updating JSON file with formats for {skill_name}: {e}")
-        return False
+        except Exception as e:
+            print(f"Error updating JSON file with formats for {skill_name}: {e}")
+            return False
 
 
 def update_json_with_skill(output_path: str, skill_name: str, skill_data: Dict) -> bool:
     """Update the JSON file by adding sequence data to an existing skill's data."""
-    try:
-        # Read existing data
-        with open(output_path, 'r', encoding='utf-8') as f:
-            data = json.load(f)
+    with json_file_lock:
+        try:
+            # Read existing data
+            with open(output_path, 'r', encoding='utf-8') as f:
+                data = json.load(f)
         
-        # Check if the skill already exists in the skills section
-        if "skills" not in data:
-            data["skills"] = {}
+            # Check if the skill already exists in the skills section
+            if "skills" not in data:
+                data["skills"] = {}
         
-        if skill_name not in data["skills"]:
-            # Create new skill entry
-            data["skills"][skill_name] = {"name": skill_name}
+            if skill_name not in data["skills"]:
+                # Create new skill entry
+                data["skills"][skill_name] = {"name": skill_name}
         
-        # Add sequence data to the existing skill object
-        data["skills"][skill_name]["name"] = skill_data["name"]
-        data["skills"][skill_name]["instruction_sequence_pages"] = skill_data["instruction_sequence_pages"]
-        data["skills"][skill_name]["progression"] = skill_data["progression"]
-        data["skills"][skill_name]["processed_at"] = skill_data["processed_at"]
+            # Add sequence data to the existing skill object
+            data["skills"][skill_name]["name"] = skill_data["name"]
+            data["skills"][skill_name]["instruction_sequence_pages"] = skill_data["instruction_sequence_pages"]
+            data["skills"][skill_name]["progression"] = skill_data["progression"]
+            data["skills"][skill_name]["processed_at"] = skill_data["processed_at"]
         
-        # Add error if present
-        if "error" in skill_data:
-            data["skills"][skill_name]["sequence_error"] = skill_data["error"]
+            # Add error if present; a successful re-extraction clears an earlier one
+            if "error" in skill_data:
+                data["skills"][skill_name]["sequence_error"] = skill_data["error"]
+            else:
+                data["skills"][skill_name].pop("sequence_error", None)
         
-        # Optionally store raw sequence text (commented out to save space)
-        # data["skills"][skill_name]["sequence_raw_text"] = skill_data["raw_text"]
+            # Optionally store raw sequence text (commented out to save space)
+            # data["skills"][skill_name]["sequence_raw_text"] = skill_data["raw_text"]
         
-        # Update metadata
-        data["metadata"]["total_skills_processed"] = len(data["skills"])
-        data["metadata"]["last_updated"] = datetime.now().isoformat()
+            # Update metadata
+            data["metadata"]["total_skills_processed"] = len(data["skills"])
+            data["metadata"]["last_updated"] = datetime.now().isoformat()
         
-        # Write back to file
-        with open(output_path, 'w', encoding='utf-8') as f:
-            json.dump(data, f, indent=2, ensure_ascii=False)
+            # Write back to file
+            with open(output_path, 'w', encoding='utf-8') as f:
+                json.dump(data, f, indent=2, ensure_ascii=False)
         
-        print(f"✓ Added sequence to skill data: {skill_name}")
-        return True
+            print(f"✓ Added sequence to skill data: {skill_name}")
+            return True
         
-    except Exception as e:
-        print(f"Error updating JSON file with {skill_name}: {e}")
-        return False
+        except Exception as e:
+            print(f"Error updating JSON file with {skill_name}: {e}")
+            return False
 
-def finalize_json_file(output_path: str) -> bool:
-    """Mark the JSON file as completed."""
+def finalize_json_file(output_path: str, token_savings_report: Optional[Dict] = None,
+                       chapter_detection_report: Optional[Dict] = None,
+                       page_hashes: Optional[Dict[int, str]] = None,
+                       failed_pages: Optional[List[int]] = None,
+                       reingest_report: Optional[Dict] = None) -> bool:
+    """Mark the JSON file as completed, recording the run's token savings, chapter detection,
+    page hashes and re-ingest summary if given. Pages in failed_pages get no stored hash,
+    so the next re-ingest retries their tasks."""
     try:
         # Read existing data
         with open(output_path, 'r', encoding='utf-8') as f:
@@ -715,6 +1703,19 @@ def finalize_json_file(output_path: str) -> bool:
             "failed_extractions": failed_extractions,
             "success_rate": f"{(successful_extractions / len(data['skills']) * 100):.1f}%" if data["skills"] else "0%"
         }
+        if token_savings_report is not None:
+            data["metadata"]["token_savings"] = token_savings_report
+        if chapter_detection_report is not None:
+            data["metadata"]["chapter_detection"] = chapter_detection_report
+        if page_hashes:
+            # Hashes of pages outside this run's ranges are kept for the next diff
+            stored_hashes = data["metadata"].get("page_hashes", {})
+            stored_hashes.update({str(p): h for p, h in page_hashes.items()})
+            for p in failed_pages or []:
+                stored_hashes.pop(str(p), None)
+            data["metadata"]["page_hashes"] = dict(sorted(stored_hashes.items(), key=lambda kv: int(kv[0])))
+        if reingest_report is not None:
+            data["metadata"]["reingest"] = reingest_report
         
         # Write back to file
         with open(output_path, 'w', encoding='utf-8') as f:
@@ -729,10 +1730,99 @@ def finalize_json_file(output_path: str) -> bool:
         print(f"Error finalizing JSON file: {e}")
         return False
 
-def assign_grades_to_formats():
+def assign_grades_locally(progression: List[Dict], formats: List[Dict]):
+    """
+    Assign grades from the progression's related_formats links, without an LLM call.
+
+    A format linked from one or more sequence items gets the earliest linked grade
+    and the sequence numbers of that grade that link to it.
+
+    Args:
+        progression: List of grade progressions for the skill
+        formats: List of formats for the skill
+
+    Returns:
+        Tuple of (updated formats, format numbers that could not be resolved locally)
+    """
+    links: Dict[str, Dict[int, List[int]]] = {}
+    for grade_prog in progression or []:
+        grade = grade_prog.get("grade")
+        for seq in grade_prog.get("sequence", []):
+            for related in seq.get("related_formats") or []:
+                format_number = related.get("format_number") if isinstance(related, dict) else related
+                if format_number is None or grade is None:
+                    continue
+                links.setdefault(str(format_number), {}).setdefault(grade, []).append(seq.get("sequence_number"))
+
+    updated_formats = copy.deepcopy(formats)
+    unresolved: List[str] = []
+    for format_item in updated_formats:
+        format_links = links.get(str(format_item.get("format_number")))
+        if not format_links:
+            unresolved.append(format_item.get("format_number"))
+            continue
+        grade = min(format_links)
+        sequence_numbers = sorted(set(n for n in format_links[grade] if n is not None))
+        format_item["assigned_grade"] = grade
+        format_item["sequence_numbers"] = sequence_numbers
+        format_item["grade_assignment_reasoning"] = (
+            f"Resolved from related_formats links: Grade {grade} sequence(s) {sequence_numbers} reference this format."
+        )
+    return updated_formats, unresolved
+
+
+def load_mapped_related_formats(mappings_path: Optional[str] = None) -> Dict[tuple, list]:
+    """
+    Read the related_formats links from the DI mappings data.
+
+    The extractor's SequenceItem has no related_formats; the links are added
+    afterwards by the "Find existing mappings" augmentation
+    (di_formats_with_mappings.json). The skills are streamed one at a time.
+
+    Returns:
+        (skill, grade, sequence_number, normalized problem_type) -> related_formats
+    """
+    links: Dict[tuple, list] = {}
+    for skill_name, skill_data in iter_di_skills(mappings_path):
+        for grade_prog in skill_data.get("progression") or []:
+            for seq in grade_prog.get("sequence", []):
+                if seq.get("related_formats"):
+                    key = (skill_name, grade_prog.get("grade"), seq.get("sequence_number"), normalize(seq.get("problem_type")))
+                    links[key] = seq["related_formats"]
+    return links
+
+
+def link_progression(skill_name: str, progression: List[Dict], mapped_links: Dict[tuple, list]) -> List[Dict]:
+    """
+    Copy of a progression with related_formats filled in from the mappings data.
+
+    Only sequence items without links of their own are filled, and only when
+    skill, grade, sequence number and problem type all match, so a renumbered
+    or reworded re-extraction falls back to the LLM instead of taking wrong links.
+    """
+    linked = copy.deepcopy(progression)
+    for grade_prog in linked or []:
+        for seq in grade_prog.get("sequence", []):
+            if seq.get("related_formats"):
+                continue
+            key = (skill_name, grade_prog.get("grade"), seq.get("sequence_number"), normalize(seq.get("problem_type")))
+            if key in mapped_links:
+                seq["related_formats"] = mapped_links[key]
+    return linked
+
+
+def assign_grades_to_formats(max_workers: int = 4, batch_size: int = 8):
     """
     Assign grades and sequence numbers to each format based on the skill's progression.
     Updates the existing JSON file with grade and sequence_number fields for each format.
+
+    Formats linked from the progression's related_formats are resolved locally first;
+    only the remaining formats are sent to the LLM, in batches of up to batch_size
+    formats per call with up to max_workers calls in flight. The file is written once.
+
+    Extracted progressions carry no related_formats, so the links are taken from
+    the DI mappings data when it is available (see link_progression); the
+    progressions written back are left unchanged.
     """
     print("\n" + "="*80)
     print("🎯 Starting Grade Assignment to Formats")
@@ -752,14 +1842,18 @@ def assign_grades_to_formats():
             data = json.load(f)
         
         skills_data = data.get("skills", {})
-        updated_count = 0
-        
-        # Process each skill
+        mapped_links: Dict[tuple, list] = {}
+        if os.path.exists(get_di_formats_path()):
+            mapped_links = load_mapped_related_formats()
+            print(f"🔗 Loaded related_formats links for {len(mapped_links)} sequence items from the mappings data")
+        else:
+            print("⚠️  DI mappings data not found; only formats linked from the extracted progression resolve locally")
+        updated_skills = set()
+        local_count = 0
+        llm_batches = []
+
+        # Resolve what we can locally and collect LLM batches for the rest
         for skill_name, skill_data in skills_data.items():
-            print(f"\n{'='*60}")
-            print(f"Processing: {skill_name}")
-            print(f"{'='*60}")
-            
             progression = skill_data.get("progression", [])
             formats = skill_data.get("formats", [])
             
@@ -770,49 +1864,62 @@ def assign_grades_to_formats():
             if not progression:
                 print(f"⚠️  No progression found for {skill_name}, skipping...")
                 continue
-            
-            # Process formats with LLM to assign grades
-            try:
-                updated_formats = assign_grades_with_llm(skill_name, progression, formats)
-                
-                if updated_formats:
-                    # Update the formats in the data structure
-                    data["skills"][skill_name]["formats"] = updated_formats
-                    updated_count += 1
-                    
-                    # Debug: Verify the grades are in the data before saving
-                    formats_with_grades = [f for f in data["skills"][skill_name]["formats"] if "assigned_grade" in f]
-                    print(f"✅ Updated {len(updated_formats)} formats for {skill_name}")
-                    print(f"   📊 Formats with assigned_grade in data: {len(formats_with_grades)}/{len(updated_formats)}")
-                    
-                    # SAVE IMMEDIATELY AFTER EACH SKILL
-                    data["metadata"]["last_updated"] = datetime.now().isoformat()
-                    data["metadata"]["grades_assigned_at"] = datetime.now().isoformat()
-                    
-                    with open(json_path, 'w', encoding='utf-8') as f:
-                        json.dump(data, f, indent=2, ensure_ascii=False)
-                    print(f"   💾 Saved {skill_name} to JSON")
-                    
-                else:
-                    print(f"⚠️  No updates made for {skill_name}")
-                    
-            except Exception as e:
-                print(f"❌ Error processing {skill_name}: {e}")
-                continue
-        
-        # Write back to file
-        print(f"\n🔍 DEBUG: About to save. updated_count = {updated_count}")
-        if updated_count > 0:
-            print(f"📝 DEBUG: Preparing to write to {json_path}")
+
+            updated_formats, unresolved = assign_grades_locally(
+                link_progression(skill_name, progression, mapped_links), formats
+            )
+            resolved_here = len(formats) - len(unresolved)
+            if resolved_here:
+                skill_data["formats"] = updated_formats
+                updated_skills.add(skill_name)
+                local_count += resolved_here
+            print(f"[{skill_name}] ⚡ Resolved {resolved_here}/{len(formats)} formats locally, {len(unresolved)} left for the LLM")
+
+            unresolved_numbers = set(unresolved)
+            unresolved_formats = [f for f in formats if f.get("format_number") in unresolved_numbers]
+            for i in range(0, len(unresolved_formats), batch_size):
+                llm_batches.append((skill_name, progression, unresolved_formats[i:i + batch_size]))
+
+        # Assign the remaining formats with concurrent LLM calls
+        llm_count = 0
+        if llm_batches:
+            print(f"\n🤖 Sending {sum(len(b[2]) for b in llm_batches)} formats to the LLM in {len(llm_batches)} batches ({max_workers} workers)")
+            with ThreadPoolExecutor(max_workers=max_workers) as executor:
+                future_to_batch = {
+                    executor.submit(assign_grades_with_llm, skill_name, progression, batch_formats): (skill_name, batch_formats)
+                    for skill_name, progression, batch_formats in llm_batches
+                }
+                for future in as_completed(future_to_batch):
+                    skill_name, batch_formats = future_to_batch[future]
+                    try:
+                        assigned = {f.get("format_number"): f for f in future.result() if "assigned_grade" in f}
+                    except Exception as e:
+                        print(f"❌ Error processing {skill_name} batch ({len(batch_formats)} formats): {e}")
+                        continue
+                    # Results are merged on the main thread, so no lock is needed
+                    skill_formats = skills_data[skill_name]["formats"]
+                    for i, format_item in enumerate(skill_formats):
+                        if format_item.get("format_number") in assigned:
+                            skill_formats[i] = assigned[format_item.get("format_number")]
+                            llm_count += 1
+                    if assigned:
+                        updated_skills.add(skill_name)
+
+        # Write back to file once
+        if updated_skills:
             data["metadata"]["last_updated"] = datetime.now().isoformat()
             data["metadata"]["grades_assigned_at"] = datetime.now().isoformat()
+            data["metadata"]["grade_assignment_summary"] = {
+                "resolved_locally": local_count,
+                "resolved_by_llm": llm_count,
+                "llm_batches": len(llm_batches),
+            }
             
-            print(f"💾 DEBUG: Opening file for writing...")
             with open(json_path, 'w', encoding='utf-8') as f:
                 json.dump(data, f, indent=2, ensure_ascii=False)
             
-            print(f"✅ DEBUG: File write completed")
-            print(f"\n✅ Successfully updated {updated_count} skills with grade assignments")
+            print(f"\n✅ Successfully updated {len(updated_skills)} skills with grade assignments")
+            print(f"   ⚡ Resolved locally: {local_count} | 🤖 Resolved by LLM: {llm_count} ({len(llm_batches)} calls)")
             print(f"💾 Saved to: {json_path}")
             return json_path
         else:
@@ -914,8 +2021,12 @@ def assign_grades_with_llm(skill_name: str, progression: List[Dict], formats: Li
         raise
 
 
-def run_pitfalls_extraction_only():
-    """Run only pitfalls extraction on existing data, writing after each skill."""
+def run_pitfalls_extraction_only(force: bool = False):
+    """Run only pitfalls extraction on existing data, writing after each skill.
+
+    Pitfalls are normally produced by the fused formats+pitfalls call, so this is a
+    fallback: skills that already have pitfalls are skipped unless force is True.
+    """
     json_output_path = initialize_json_file()
     if not json_output_path:
         print("Failed to initialize JSON file. Exiting.")
@@ -936,12 +2047,17 @@ def run_pitfalls_extraction_only():
     pdf_path = os.path.join(project_root, "data", "Direct_Instruction_Mathematics.pdf")
     
     try:
-        with pdfplumber.open(pdf_path) as pdf:
+        with PageTextEngine(pdf_path) as engine:
+            total_pages = engine.page_count()
             for skill_name, skill_data in data['skills'].items():
                 print(f"\n{'='*60}")
                 print(f"Extracting pitfalls for skill: {skill_name}")
                 print(f"{'='*60}")
                 
+                if skill_data.get('pitfalls') and not force:
+                    print(f"[{skill_name}] ⏭️  Pitfalls already extracted, skipping (use --force to re-extract)")
+                    continue
+
                 # Get pages for this skill
                 if skill_name not in skills_chapter_pages:
                     print(f"Warning: No page mapping for skill {skill_name}")
@@ -954,9 +2070,8 @@ def run_pitfalls_extraction_only():
                 # Extract text from all chapter pages for this skill
                 chapter_text = []
                 for page_num in range(start_page, end_page + 1):
-                    if page_num <= len(pdf.pages):
-                        page = pdf.pages[page_num - 1]  # pdfplumber uses 0-based indexing
-                        text = page.extract_text()
+                    if page_num <= total_pages:
+                        text, _ = engine.extract(page_num)
                         if text:
                             chapter_text.append(text)
                 
@@ -984,27 +2099,68 @@ def run_pitfalls_extraction_only():
     print(f"\n🎉 Pitfalls extraction complete! Updated: {json_output_path}")
 
 
+def cli_str_option(flag: str, default: Optional[str]) -> Optional[str]:
+    """Read a string option such as "--pdf path/to/book.pdf" from sys.argv."""
+    if flag in sys.argv:
+        idx = sys.argv.index(flag)
+        if idx + 1 < len(sys.argv):
+            return sys.argv[idx + 1]
+    return default
+
+
+def cli_int_option(flag: str, default: int) -> int:
+    """Read an integer option such as "--workers 8" from sys.argv."""
+    if flag in sys.argv:
+        idx = sys.argv.index(flag)
+        if idx + 1 < len(sys.argv):
+            return int(sys.argv[idx + 1])
+    return default
+
+
 if __name__ == "__main__":
     
     
     # Check if we should run pitfalls extraction only
     if len(sys.argv) > 1 and sys.argv[1] == "--pitfalls":
         print("🚨 Running Pitfalls Extraction Only...")
-        run_pitfalls_extraction_only()
+        run_pitfalls_extraction_only(force="--force" in sys.argv)
     # Check if we should run grade assignment
     elif len(sys.argv) > 1 and sys.argv[1] == "--assign-grades":
         print("🎓 Running Grade Assignment Process...")
-        result = assign_grades_to_formats()
+        result = assign_grades_to_formats(
+            max_workers=cli_int_option("--workers", 4),
+            batch_size=cli_int_option("--batch-size", 8),
+        )
         if result:
             print(f"\n✅ Grade assignment completed successfully!")
         else:
             print(f"\n❌ Grade assignment failed")
+    # Extract several books from a manifest into one namespaced catalog
+    elif "--manifest" in sys.argv:
+        print("📚 Running multi-book extraction...")
+        catalog_file = extract_books_from_manifest(
+            cli_str_option("--manifest", None),
+            max_workers=cli_int_option("--workers", 4),
+            cpu_workers=cli_int_option("--cpu-workers", 2),
+            reingest="--reingest" in sys.argv,
+        )
+        if catalog_file:
+            print(f"\n🎉 Catalog saved to: {catalog_file}")
+        else:
+            print(f"\n❌ Multi-book extraction failed")
     else:
         print("🚀 Starting Direct Instruction Mathematics processing...")
         print("📝 Each skill will be processed and saved incrementally to JSON file")
         
         # Process all skills and write incrementally to JSON
-        output_file = read_math_di_book()
+        # A different book defaults to pure ToC detection; the override dict is DI-specific
+        pdf_arg = cli_str_option("--pdf", None)
+        output_file = read_math_di_book(
+            max_workers=cli_int_option("--workers", 4),
+            pdf_path=pdf_arg,
+            page_source=cli_str_option("--page-source", "auto" if pdf_arg else "merged"),
+            reingest="--reingest" in sys.argv,
+        )
         
         if output_file:
             print(f"\n🎉 Processing completed successfully!")
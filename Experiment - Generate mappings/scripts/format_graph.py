@@ -0,0 +1,151 @@
+"""
+Sequence <-> format link graph for choosing format exemplars.
+
+The DI data links sequences to formats in two places: a sequence's
+related_formats and a format's sequence_numbers (within its skill and
+grade). FormatLinkGraph precomputes both directions once, so a sequence
+needing a format can be given the formats that teach its neighbours in the
+same skill progression, which are far closer to what it needs than the first
+Grade 3 formats in the file. Generated sequences have no place in a DI
+progression; they are first matched to their most similar DI sequences by
+TF-IDF, and those sequences' neighbour formats are ranked by how similar
+their own title and parts are to the generated sequence.
+"""
+
+import json
+from typing import Dict, List, Optional, Tuple
+
+from similarity import TfidfIndex, select_within_token_budget
+
+SequenceKey = Tuple[str, int, int]  # (skill, grade, sequence_number)
+FormatKey = Tuple[str, str]  # (skill, format_number)
+
+
+class FormatLinkGraph:
+    """
+    Precomputed sequence <-> format links for all DI skills.
+
+    Args:
+        di_data: Loaded DI formats data
+    """
+
+    def __init__(self, di_data: dict):
+        self.formats: Dict[FormatKey, dict] = {}
+        self.sequence_formats: Dict[SequenceKey, List[FormatKey]] = {}
+        self.progressions: Dict[str, List[SequenceKey]] = {}
+        sequences = []
+
+        for skill_name, skill_data in di_data.get('skills', {}).items():
+            for fmt in skill_data.get('formats', []):
+                self.formats[(skill_name, fmt.get('format_number'))] = {
+                    'skill': skill_name,
+                    'format_number': fmt.get('format_number'),
+                    'title': fmt.get('title'),
+                    'parts': fmt.get('parts', []),
+                    'grade': fmt.get('grade') or fmt.get('assigned_grade'),
+                    'sequence_numbers': fmt.get('sequence_numbers') or []
+                }
+
+            order = []
+            for progression in skill_data.get('progression', []):
+                for seq in progression.get('sequence', []):
+                    key = (skill_name, progression.get('grade'), seq.get('sequence_number'))
+                    order.append(key)
+                    sequences.append((key, seq))
+                    for related in seq.get('related_formats') or []:
+                        self._link(key, (skill_name, related.get('format_number')))
+            self.progressions[skill_name] = sorted(order, key=lambda k: (k[1] if k[1] is not None else -1, k[2] or 0))
+
+        # Formats that list their sequence numbers link back within their own grade
+        for format_key, fmt in self.formats.items():
+            if fmt['grade'] is None:
+                continue
+            for number in fmt['sequence_numbers']:
+                self._link((format_key[0], fmt['grade'], number), format_key)
+
+        self._sequence_index = TfidfIndex(
+            sequences,
+            lambda item: " ".join([item[1].get('problem_type') or ''] + (item[1].get('example_questions') or []))
+        )
+        self._format_index = TfidfIndex(
+            list(self.formats),
+            lambda key: " ".join([self.formats[key]['title'] or ''] + [
+                f"{part.get('part_name') or ''} {part.get('description') or ''}" for part in self.formats[key]['parts']
+            ])
+        )
+
+    def _link(self, sequence_key: SequenceKey, format_key: FormatKey) -> None:
+        if format_key not in self.formats:
+            return
+        linked = self.sequence_formats.setdefault(sequence_key, [])
+        if format_key not in linked:
+            linked.append(format_key)
+
+    def neighbour_formats(self, skill: str, grade: int, sequence_number: int) -> List[dict]:
+        """
+        Formats linked to a sequence and its progression neighbours, nearest first.
+
+        Neighbours are visited outward from the sequence's position in its
+        skill's progression (ties go to the earlier sequence).
+        """
+        order = self.progressions.get(skill, [])
+        position = next((i for i, key in enumerate(order) if key[1:] == (grade, sequence_number)), None)
+        if position is None:
+            return []
+        visit = sorted(range(len(order)), key=lambda i: (abs(i - position), i))
+        ranked = []
+        for i in visit:
+            for format_key in self.sequence_formats.get(order[i], []):
+                fmt = self.formats[format_key]
+                if fmt not in ranked:
+                    ranked.append(fmt)
+        return ranked
+
+    def formats_for_text(self, text: str, nearest: int = 3) -> List[dict]:
+        """
+        The nearest formats for text, best first.
+
+        Candidates are the neighbour formats of the nearest DI sequences most
+        similar to text. A neighbour list covers its whole skill, so the
+        candidates are ranked by the similarity of each format's title and
+        parts to text (ties keep the candidate order) and the top nearest are
+        returned.
+        """
+        candidates = []
+        for score, (key, _) in self._sequence_index.rank(text, limit=nearest):
+            if score <= 0:
+                break
+            for fmt in self.neighbour_formats(*key):
+                if fmt not in candidates:
+                    candidates.append(fmt)
+        if not candidates:
+            return []
+        format_scores = {format_key: score for score, format_key in self._format_index.rank(text)}
+        order = sorted(
+            range(len(candidates)),
+            key=lambda i: (-format_scores[(candidates[i]['skill'], candidates[i]['format_number'])], i)
+        )
+        return [candidates[i] for i in order[:nearest]]
+
+
+def select_format_exemplars(graph: FormatLinkGraph, sequence: dict, token_budget: int = 3000,
+                            max_exemplars: Optional[int] = 3) -> List[dict]:
+    """
+    Pick format exemplars for a sequence from the link graph, trimmed to a token budget.
+
+    DI sequences (with a skill) use their own progression neighbours; generated
+    sequences, or DI sequences whose skill has no linked formats, use the
+    neighbours of their most similar DI sequences.
+    """
+    ranked = []
+    if sequence.get('skill') in graph.progressions:
+        ranked = graph.neighbour_formats(sequence['skill'], sequence.get('grade'), sequence.get('sequence_number'))
+    if not ranked:
+        text = " ".join([sequence.get('problem_type') or ''] + (sequence.get('example_questions') or []))
+        ranked = graph.formats_for_text(text, nearest=max_exemplars or 3)
+    return select_within_token_budget(
+        ranked,
+        token_budget,
+        max_items=max_exemplars,
+        render=lambda fmt: json.dumps(fmt, indent=2)
+    )
@@ -0,0 +1,128 @@
+"""
+Two-level format generation: outline first, then each part's steps in parallel.
+
+A full format is one long structured response, so output length dominates
+latency and one malformed step means regenerating everything. Here a short
+outline call returns the title and part names/descriptions, then every
+part's steps are generated concurrently and stitched back into the format
+schema. A part that fails validation is retried on its own; the other parts
+are kept.
+"""
+
+import json
+from typing import Callable, List, Optional
+from pydantic import BaseModel, Field
+
+from llm_concurrency import RateLimiter, call_with_retries, run_ordered
+
+# Retries per outline or part call; a failed part is regenerated on its own
+PART_RETRIES = 2
+
+# ============================================================================
+# Pydantic Schemas
+# ============================================================================
+
+class PartOutline(BaseModel):
+    """A planned part of a format, before its steps are written."""
+    part_name: str
+    description: Optional[str] = None
+    teaching_goal: str
+
+class FormatOutline(BaseModel):
+    """Title and part plan for a format."""
+    title: str
+    parts: List[PartOutline] = Field(..., min_items=1, max_items=3)
+    grade_assignment_reasoning: str
+    generation_reasoning: str
+
+class PartStep(BaseModel):
+    """Individual step in a format part (same fields as FormatStep)."""
+    step_number: int
+    teacher_action: str
+    student_response: Optional[str] = None
+    notes: Optional[str] = None
+
+class PartSteps(BaseModel):
+    """Steps for one part of a format."""
+    steps: List[PartStep] = Field(..., min_items=1)
+
+# ============================================================================
+# Generation
+# ============================================================================
+
+def generate_format_by_parts(
+    prompt_fields: dict,
+    outline_template: str,
+    part_template: str,
+    produce_fn: Callable,
+    limiter: RateLimiter = None,
+    retries: int = PART_RETRIES,
+    label: str = ""
+) -> dict:
+    """
+    Generate a format as an outline plus concurrently generated parts.
+
+    Args:
+        prompt_fields: Fields of the format generation prompt (skill, grade,
+            sequence_number, problem_type, example_questions, visual_aids,
+            exemplar_formats)
+        outline_template: Template for the outline call
+        part_template: Template for one part's steps
+        produce_fn: produce_structured_response_gemini(prompt, model)
+        limiter: Rate limiter shared with other calls
+        retries: Retries per call; a failed part is retried on its own
+        label: Prefix for retry messages
+
+    Returns:
+        Dict with title, parts (each with steps numbered from 1),
+        grade_assignment_reasoning and generation_reasoning
+    """
+    outline = call_with_retries(
+        produce_fn,
+        outline_template.format(**prompt_fields),
+        FormatOutline,
+        retries=retries,
+        limiter=limiter,
+        label=label
+    )
+    outline_text = json.dumps([part.model_dump() for part in outline.parts], indent=2)
+
+    def generate_part(indexed_part):
+        index, part = indexed_part
+        prompt = part_template.format(
+            **prompt_fields,
+            title=outline.title,
+            outline=outline_text,
+            part_number=index + 1,
+            part_name=part.part_name,
+            part_description=part.description or "None",
+            teaching_goal=part.teaching_goal
+        )
+        return call_with_retries(
+            produce_fn,
+            prompt,
+            PartSteps,
+            retries=retries,
+            limiter=limiter,
+            label=f"{label}[{part.part_name}] "
+        )
+
+    indexed_parts = list(enumerate(outline.parts))
+    outcomes = run_ordered(indexed_parts, generate_part, max_workers=len(indexed_parts))
+    failed = [outline.parts[i].part_name for i, (_, error) in enumerate(outcomes) if error is not None]
+    if failed:
+        raise ValueError(f"Parts failed after {retries + 1} attempts: {', '.join(failed)}")
+
+    parts = []
+    for part, (part_steps, _) in zip(outline.parts, outcomes):
+        steps = []
+        for number, step in enumerate(part_steps.steps, 1):
+            steps.append({**step.model_dump(), "step_number": number})
+        parts.append({"part_name": part.part_name, "description": part.description, "steps": steps})
+
+    return {
+        "title": outline.title,
+        "parts": parts,
+        "grade_assignment_reasoning": outline.grade_assignment_reasoning,
+        "generation_reasoning": outline.generation_reasoning
+    }
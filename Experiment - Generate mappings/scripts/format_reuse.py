@@ -0,0 +1,225 @@
+"""
+Reuse layer for the format generation scripts.
+
+FormatReuseCache indexes existing DI formats and the formats generated
+earlier in the same run by problem type. Before a full format generation
+call, the sequence's problem_type is looked up:
+
+- similarity >= reuse_threshold: the nearest format is reused as-is (no call)
+- similarity >= adapt_threshold: the nearest format is sent with a short
+  "adapt this format" prompt to a cheaper model
+- otherwise: the format is generated from scratch as before
+
+Similarity is the character-shingle Jaccard similarity used for
+near-duplicate sequences (see similarity.MinHashIndex).
+
+When several workers generate formats concurrently, reuse decisions are
+made in output order so a run does not depend on thread timing: each
+generated entry is announced up front with expect() and an output position,
+and lookup(..., before=position) only sees DI entries and generated entries
+from earlier positions. If the best of those is still being generated, the
+lookup waits for it (or for it to fail), so every decision is the one a
+serial run would make.
+"""
+
+import copy
+import threading
+from collections import Counter
+from typing import Optional
+
+from similarity import MinHashIndex
+
+ADAPT_MODEL = "gemini-2.5-flash"
+
+
+_PENDING = object()
+
+
+class FormatReuseCache:
+    """
+    Thread-safe index of reusable formats keyed by problem type.
+
+    Args:
+        reuse_threshold: Similarity at which a format is reused unchanged
+        adapt_threshold: Similarity at which a format is adapted instead of generated
+    """
+
+    def __init__(self, reuse_threshold: float = 0.9, adapt_threshold: float = 0.6):
+        self.reuse_threshold = reuse_threshold
+        self.adapt_threshold = adapt_threshold
+        # 32 bands of 2 rows keeps LSH recall high down to the adapt threshold
+        self._index = MinHashIndex(num_perm=64, bands=32)
+        self._entries = {}
+        # Output position of each expected generated entry; DI entries have none
+        self._positions = {}
+        self._lock = threading.Lock()
+        self._settled = threading.Condition(self._lock)
+        self._counts = Counter()
+
+    def expect(self, key, text: str, position) -> None:
+        """
+        Announce a generated entry before its format exists.
+
+        Lookups with a later before position wait for it when it is their best
+        match. Every expected key must later be added or discarded.
+
+        Args:
+            key: Key the format will be added under
+            text: Problem type the format will teach
+            position: Sortable output position of the entry
+        """
+        if not text:
+            return
+        with self._lock:
+            if key in self._entries:
+                return
+            self._entries[key] = _PENDING
+            self._positions[key] = position
+            self._index.add(key, text)
+
+    def add(self, key, text: str, fmt: dict, ref: dict) -> None:
+        """
+        Index a format under a problem-type text (settling it if it was expected).
+
+        Args:
+            key: Unique hashable key for this entry
+            text: Problem type (or title) the format teaches
+            fmt: Format with at least title and parts
+            ref: Where the format came from, copied into reused_from
+        """
+        if not text or not fmt.get('parts'):
+            self.discard(key)
+            return
+        with self._lock:
+            pending = self._entries.get(key) is _PENDING
+            if key in self._entries and not pending:
+                return
+            self._entries[key] = ({'title': fmt.get('title'), 'parts': copy.deepcopy(fmt['parts'])}, ref)
+            if pending:
+                self._settled.notify_all()
+            else:
+                self._index.add(key, text)
+
+    def discard(self, key) -> None:
+        """Drop an expected entry whose format will not be added (no-op otherwise)."""
+        with self._lock:
+            if self._entries.get(key) is _PENDING:
+                # The key stays in the MinHash index; lookups skip keys without an entry
+                del self._entries[key]
+                self._settled.notify_all()
+
+    def add_di_formats(self, di_data: dict) -> int:
+        """
+        Index every DI format by its title and the problem types of the sequences linked to it.
+
+        Returns:
+            Number of index entries added
+        """
+        added = 0
+        for skill_name, skill_data in di_data.get('skills', {}).items():
+            formats = {fmt.get('format_number'): fmt for fmt in skill_data.get('formats', [])}
+            texts = {number: [fmt.get('title')] for number, fmt in formats.items()}
+            for progression in skill_data.get('progression', []):
+                for seq in progression.get('sequence', []):
+                    for related in seq.get('related_formats') or []:
+                        if related.get('format_number') in texts:
+                            texts[related['format_number']].append(seq.get('problem_type'))
+            for number, fmt in formats.items():
+                ref = {"source": "di", "skill": skill_name, "format_number": number}
+                for i, text in enumerate(texts[number]):
+                    self.add(("di", skill_name, number, i), text, fmt, ref)
+                    added += 1
+        return added
+
+    def lookup(self, problem_type: str, before=None) -> Optional[dict]:
+        """
+        Find the nearest indexed format for a problem type.
+
+        Args:
+            problem_type: Problem type of the sequence needing a format
+            before: Output position of that sequence. When given, only DI
+                entries and generated entries expected at earlier positions
+                are considered, and the lookup waits while the best of them
+                is still pending. When omitted, every added entry is considered.
+
+        Returns:
+            None below the adapt threshold, otherwise a dict with mode
+            ("reuse" or "adapt"), similarity, format and reused_from
+        """
+        with self._lock:
+            while True:
+                matches = [
+                    (score, key) for score, key in self._index.query(problem_type, threshold=self.adapt_threshold)
+                    if key in self._entries and self._visible(key, before)
+                ]
+                if not matches:
+                    return None
+                score, key = matches[0]
+                if self._entries[key] is not _PENDING:
+                    break
+                self._settled.wait()
+            fmt, ref = self._entries[key]
+        mode = "reuse" if score >= self.reuse_threshold else "adapt"
+        return {
+            "mode": mode,
+            "similarity": round(score, 3),
+            "format": copy.deepcopy(fmt),
+            "reused_from": {**ref, "mode": mode, "similarity": round(score, 3)},
+        }
+
+    def _visible(self, key, before) -> bool:
+        position = self._positions.get(key)
+        if before is None:
+            return self._entries[key] is not _PENDING
+        return position is None or position < before
+
+    def record(self, mode: str) -> None:
+        """Count how a format was produced: "reuse", "adapt" or "generate"."""
+        with self._lock:
+            self._counts[mode] += 1
+
+    def summary(self) -> dict:
+        """Reuse counts and rate for the output metadata."""
+        with self._lock:
+            total = sum(self._counts.values())
+            reused = self._counts["reuse"] + self._counts["adapt"]
+            return {
+                "reuse_threshold": self.reuse_threshold,
+                "adapt_threshold": self.adapt_threshold,
+                "reused": self._counts["reuse"],
+                "adapted": self._counts["adapt"],
+                "generated": self._counts["generate"],
+                "reuse_rate": round(reused / total, 3) if total else 0.0,
+            }
+
+
+def reuse_or_generate(cache: Optional[FormatReuseCache], problem_type: str, reuse_fn, adapt_fn, generate_fn,
+                      position=None):
+    """
+    Produce a format through the cheapest path the cache allows.
+
+    Args:
+        cache: Reuse cache, or None to always generate
+        problem_type: Problem type of the sequence needing a format
+        reuse_fn: Builds a response from a lookup match without a call
+        adapt_fn: Calls the adapt prompt for a lookup match
+        generate_fn: Full generation call
+        position: Output position for an ordered lookup (see FormatReuseCache.lookup)
+
+    Returns:
+        (response, reused_from) where reused_from is None for a full generation.
+        A failed reuse or adaptation falls back to full generation.
+    """
+    match = cache.lookup(problem_type, before=position) if cache is not None else None
+    response = None
+    if match is not None:
+        try:
+            response = reuse_fn(match) if match["mode"] == "reuse" else adapt_fn(match)
+        except Exception as e:
+            print(f"⚠️  Could not {match['mode']} {match['reused_from']} ({e}); generating from scratch")
+            match = None
+    if response is None:
+        response = generate_fn()
+    if cache is not None:
+        cache.record(match["mode"] if match else "generate")
+    return response, (match["reused_from"] if match else None)
@@ -6,12 +6,18 @@ Uses existing formats as exemplars and follows DI instructional design principle
 
 import os
 import json
+import argparse
 from datetime import datetime
-from typing import List, Optional
+from typing import Iterable, List, Optional, Tuple, Union
 from pydantic import BaseModel, Field
 from google import genai
 from dotenv import load_dotenv
 
+from format_reuse import ADAPT_MODEL, FormatReuseCache, reuse_or_generate
+from format_graph import FormatLinkGraph, select_format_exemplars
+from format_parts import PART_RETRIES, generate_format_by_parts
+from artifacts import get_di_formats_path, save_artifact
+
 load_dotenv()
 
 # ============================================================================
@@ -45,6 +51,10 @@ class GeneratedFormatResponse(BaseModel):
     format: GeneratedFormat
     generation_reasoning: str
 
+class ReusedFormatResponse(GeneratedFormatResponse):
+    """Format response built from a reused or adapted format."""
+    reused_from: dict
+
 # ============================================================================
 # Helper Functions
 # ============================================================================
@@ -89,14 +99,7 @@ def load_prompt_template(template_name: str) -> str:
 
 def load_di_formats():
     """Load DI formats with existing sequences."""
-    project_root = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
-    di_path = os.path.join(
-        project_root,
-        "..",
-        "Experiment - Find existing mappings",
-        "inputs",
-        "di_formats_with_mappings.json"
-    )
+    di_path = get_di_formats_path()
     
     print(f"Loading DI formats from: {di_path}")
     
@@ -105,20 +108,23 @@ def load_di_formats():
     
     return data
 
-def get_sequences_needing_formats(di_data, grade: int = 3):
+def get_sequences_needing_formats(di_data: Union[dict, Iterable[Tuple[str, dict]]], grade: int = 3):
     """
     Get sequences that don't have any formats linked.
     
     Args:
-        di_data: Loaded DI formats data
+        di_data: Loaded DI formats data, or an iterable of (skill_name,
+            skill_data) pairs (e.g. iter_di_skills()) so only one skill is
+            held at a time
         grade: Grade level to filter
     
     Returns:
         List of sequences that need formats
     """
     needs_formats = []
+    skills = di_data.get('skills', {}).items() if isinstance(di_data, dict) else di_data
     
-    for skill_name, skill_data in di_data.get('skills', {}).items():
+    for skill_name, skill_data in skills:
         for progression in skill_data.get('progression', []):
             if progression.get('grade') == grade:
                 for seq in progression.get('sequence', []):
@@ -136,41 +142,18 @@ def get_sequences_needing_formats(di_data, grade: int = 3):
     
     return needs_formats
 
-def get_exemplar_formats(di_data, grade: int = 3, limit: int = 10):
-    """
-    Extract exemplar formats from DI data.
-    
-    Args:
-        di_data: Loaded DI formats data
-        grade: Grade level to filter
-        limit: Maximum number of exemplars to return
-    
-    Returns:
-        List of exemplar formats
-    """
-    exemplars = []
-    
-    for skill_name, skill_data in di_data.get('skills', {}).items():
-        for fmt in skill_data.get('formats', []):
-            # Filter by grade if grade field exists
-            fmt_grade = fmt.get('grade') or fmt.get('assigned_grade')
-            if fmt_grade == grade:
-                exemplars.append({
-                    'skill': skill_name,
-                    'format_number': fmt.get('format_number'),
-                    'title': fmt.get('title'),
-                    'parts': fmt.get('parts', []),
-                    'grade': fmt_grade,
-                    'sequence_numbers': fmt.get('sequence_numbers', [])
-                })
-                
-                if len(exemplars) >= limit:
-                    break
-        
-        if len(exemplars) >= limit:
-            break
-    
-    return exemplars
+def format_prompt_fields(sequence: dict, exemplars: list) -> dict:
+    """Fields shared by the format generation, outline and part prompts."""
+    return {
+        "skill": sequence['skill'],
+        "grade": sequence['grade'],
+        "sequence_number": sequence['sequence_number'],
+        "problem_type": sequence['problem_type'],
+        "example_questions": json.dumps(sequence['example_questions'], indent=2),
+        "visual_aids": sequence['visual_aids'] if sequence['visual_aids'] else "None",
+        # Exemplars are already chosen per sequence and trimmed to a token budget
+        "exemplar_formats": json.dumps(exemplars, indent=2)
+    }
 
 def create_format_generation_prompt(
     sequence: dict,
@@ -178,11 +161,15 @@ def create_format_generation_prompt(
     template: str
 ) -> str:
     """Create prompt for format generation."""
+    return template.format(**format_prompt_fields(sequence, exemplars))
+
+def create_format_adaptation_prompt(
+    sequence: dict,
+    source_format: dict,
+    template: str
+) -> str:
+    """Create prompt for adapting a similar format to a sequence."""
     
-    # Format exemplars for prompt (show structure but keep concise)
-    exemplar_text = json.dumps(exemplars[:5], indent=2)  # Limit to 5 exemplars
-    
-    # Fill in template
     prompt = template.format(
         skill=sequence['skill'],
         grade=sequence['grade'],
@@ -190,38 +177,108 @@ def create_format_generation_prompt(
         problem_type=sequence['problem_type'],
         example_questions=json.dumps(sequence['example_questions'], indent=2),
         visual_aids=sequence['visual_aids'] if sequence['visual_aids'] else "None",
-        exemplar_formats=exemplar_text
+        source_format=json.dumps(source_format, indent=2)
     )
     
     return prompt
 
+def reused_format_response(sequence: dict, match: dict) -> GeneratedFormatResponse:
+    """Build a response that reuses a matched format unchanged."""
+    reused_from = match['reused_from']
+    return GeneratedFormatResponse(
+        format=GeneratedFormat(
+            format_number="TBD",
+            title=match['format']['title'],
+            parts=match['format']['parts'],
+            grade=sequence['grade'],
+            sequence_numbers=[sequence['sequence_number']],
+            grade_assignment_reasoning=f"Reused unchanged: the problem type matches {reused_from} at similarity {match['similarity']}"
+        ),
+        generation_reasoning=f"Reused format (similarity {match['similarity']}) instead of generating a new one"
+    )
+
 def generate_format_for_sequence(
     sequence: dict,
     exemplars: list,
     template: str,
-    next_format_number: str
+    next_format_number: str,
+    reuse_cache: FormatReuseCache = None,
+    adapt_template: str = None,
+    part_templates: tuple = None,
+    part_retries: int = PART_RETRIES
 ) -> GeneratedFormatResponse:
-    """Generate a format for a single sequence."""
+    """
+    Generate a format for a single sequence.
+    
+    With a reuse_cache, a near-identical earlier or DI format is reused
+    directly and a similar one is adapted with a cheaper prompt; the response
+    is then a ReusedFormatResponse recording the source. With part_templates
+    (outline, part steps), a new format is generated as an outline plus
+    parallel per-part calls instead of one long response, each retried up to
+    part_retries times.
+    """
     
     print(f"\n{'='*80}")
     print(f"Generating format for: {sequence['skill']} - Sequence #{sequence['sequence_number']}")
     print(f"Problem type: {sequence['problem_type'][:80]}...")
     print(f"{'='*80}")
     
-    prompt = create_format_generation_prompt(sequence, exemplars, template)
+    def generate():
+        if part_templates:
+            body = generate_format_by_parts(
+                format_prompt_fields(sequence, exemplars),
+                *part_templates,
+                produce_structured_response_gemini,
+                retries=part_retries,
+                label=f"[{sequence['skill']} #{sequence['sequence_number']}] "
+            )
+            return GeneratedFormatResponse(
+                format=GeneratedFormat(
+                    format_number="TBD",
+                    title=body['title'],
+                    parts=body['parts'],
+                    grade=sequence['grade'],
+                    sequence_numbers=[sequence['sequence_number']],
+                    grade_assignment_reasoning=body['grade_assignment_reasoning']
+                ),
+                generation_reasoning=body['generation_reasoning']
+            )
+        prompt = create_format_generation_prompt(sequence, exemplars, template)
+        return produce_structured_response_gemini(prompt, GeneratedFormatResponse)
+    
+    def adapt(match):
+        prompt = create_format_adaptation_prompt(sequence, match['format'], adapt_template)
+        return produce_structured_response_gemini(prompt, GeneratedFormatResponse, llm_model=ADAPT_MODEL)
     
     try:
-        response = produce_structured_response_gemini(prompt, GeneratedFormatResponse)
+        response, reused_from = reuse_or_generate(
+            reuse_cache,
+            sequence['problem_type'],
+            lambda match: reused_format_response(sequence, match),
+            adapt,
+            generate
+        )
         # Override format_number with our assigned one
         response.format.format_number = next_format_number
+        if reused_from:
+            response = ReusedFormatResponse(**response.model_dump(), reused_from=reused_from)
+            print(f"♻️  Format {'reused' if reused_from['mode'] == 'reuse' else 'adapted'} from {reused_from}")
+        if reuse_cache is not None:
+            reuse_cache.add(
+                ("generated", sequence['skill'], sequence['sequence_number']),
+                sequence['problem_type'],
+                response.format.model_dump(),
+                {"source": "generated", "skill": sequence['skill'], "sequence_number": sequence['sequence_number'], "format_number": next_format_number}
+            )
         print(f"✅ Generated format: {response.format.title}")
         return response
     except Exception as e:
         print(f"❌ Generation failed: {e}")
         raise
 
-def save_generated_formats(results: list, output_filename: str = None):
-    """Save generated formats to JSON file."""
+def save_generated_formats(results: list, output_filename: str = None, format_reuse: dict = None,
+                           output_format: str = "json", compression: str = None):
+    """Save generated formats to a JSON file or sharded JSONL artifact."""
     
     if output_filename is None:
         timestamp = datetime.now().strftime("%Y%m%d_%H%M%S")
@@ -238,13 +295,13 @@ def save_generated_formats(results: list, output_filename: str = None):
             "generation_timestamp": datetime.now().isoformat(),
             "total_sequences_processed": len(results),
             "llm_model": "gemini-2.5-pro",
-            "generation_version": "1.0"
+            "generation_version": "1.0",
+            "format_reuse": format_reuse
         },
         "generated_formats": results
     }
     
-    with open(output_path, 'w', encoding='utf-8') as f:
-        json.dump(output_data, f, indent=2, ensure_ascii=False)
+    output_path = save_artifact(output_data, output_path, output_format, compression)
     
     print(f"\n✅ Saved generated formats to: {output_path}")
     return output_path
@@ -256,6 +313,18 @@ def save_generated_formats(results: list, output_filename: str = None):
 def main():
     """Main execution function."""
     
+    parser = argparse.ArgumentParser(description="Generate DI-style formats for sequences without formats")
+    parser.add_argument("--reuse-threshold", type=float, default=0.9, help="Problem-type similarity at which an earlier or DI format is reused unchanged")
+    parser.add_argument("--adapt-threshold", type=float, default=0.6, help="Problem-type similarity at which a similar format is adapted with a cheaper prompt")
+    parser.add_argument("--no-format-reuse", action="store_true", help="Always generate formats from scratch")
+    parser.add_argument("--exemplar-token-budget", type=int, default=3000, help="Max tokens of exemplar formats per prompt")
+    parser.add_argument("--max-exemplars", type=int, default=3, help="Max exemplar formats per prompt")
+    parser.add_argument("--per-part", action="store_true", help="Generate an outline first, then each part's steps in parallel")
+    parser.add_argument("--part-retries", type=int, default=PART_RETRIES, help="Retries per outline/part call with --per-part (a failed part is regenerated on its own)")
+    parser.add_argument("--output-format", choices=["json", "jsonl"], default="json", help="Write one JSON file or a directory of JSONL shards with an index")
+    parser.add_argument("--compression", choices=["gzip", "zstd"], default=None, help="Compress JSONL shards")
+    args = parser.parse_args()
+    
     print("="*80)
     print("DI FORMAT GENERATOR")
     print("="*80)
@@ -275,14 +344,23 @@ def main():
     needs_formats = get_sequences_needing_formats(di_data, grade=3)
     print(f"Found {len(needs_formats)} sequences needing formats")
     
-    # Get exemplar formats
-    print("\n📚 Loading exemplar formats...")
-    exemplars = get_exemplar_formats(di_data, grade=3, limit=10)
-    print(f"Loaded {len(exemplars)} exemplar formats")
+    # Index sequence <-> format links for exemplar selection
+    print("\n📚 Indexing sequence-format links...")
+    format_graph = FormatLinkGraph(di_data)
+    print(f"Indexed {len(format_graph.formats)} formats linked to {len(format_graph.sequence_formats)} sequences")
     
     # Load prompt template
     print("\n📝 Loading prompt template...")
     template = load_prompt_template("format_generation")
+    adapt_template = load_prompt_template("format_adaptation")
+    part_templates = None
+    if args.per_part:
+        part_templates = (load_prompt_template("format_outline"), load_prompt_template("format_part_steps"))
+    
+    reuse_cache = None
+    if not args.no_format_reuse:
+        reuse_cache = FormatReuseCache(args.reuse_threshold, args.adapt_threshold)
+        print(f"♻️  Indexed {reuse_cache.add_di_formats(di_data)} DI format entries for reuse")
     
     # Generate formats
     print("\n🔨 Generating formats...")
@@ -296,11 +374,24 @@ def main():
             # Generate sequential format number
             next_format_number = f"GENERATED.{i}"
             
+            exemplars = select_format_exemplars(
+                format_graph,
+                sequence,
+                token_budget=args.exemplar_token_budget,
+                max_exemplars=args.max_exemplars
+            )
+            exemplar_names = ", ".join(f"{ex['skill']} {ex['format_number']}" for ex in exemplars)
+            print(f"  - Exemplars: {exemplar_names or 'none'}")
+            
             response = generate_format_for_sequence(
                 sequence,
                 exemplars,
                 template,
-                next_format_number
+                next_format_number,
+                reuse_cache=reuse_cache,
+                adapt_template=adapt_template,
+                part_templates=part_templates,
+                part_retries=args.part_retries
             )
             
             result = {
@@ -312,6 +403,8 @@ def main():
                 "generation_reasoning": response.generation_reasoning,
                 "generated_at": datetime.now().isoformat()
             }
+            if isinstance(response, ReusedFormatResponse):
+                result["reused_from"] = response.reused_from
             
             results.append(result)
             
@@ -327,13 +420,21 @@ def main():
     
     # Save results
     if results:
-        output_path = save_generated_formats(results)
+        format_reuse = reuse_cache.summary() if reuse_cache is not None else None
+        output_path = save_generated_formats(
+            results,
+            format_reuse=format_reuse,
+            output_format=args.output_format,
+            compression=args.compression
+        )
         
         print(f"\n{'='*80}")
         print("SUMMARY")
         print(f"{'='*80}")
         print(f"Total sequences processed: {len(results)}")
         print(f"Total formats generated: {len(results)}")
+        if format_reuse:
+            print(f"Format reuse: {format_reuse['reused']} reused, {format_reuse['adapted']} adapted, {format_reuse['generated']} generated (reuse rate {format_reuse['reuse_rate']:.0%})")
         print(f"Output: {output_path}")
     else:
         print("\n⚠️  No formats were generated")
@@ -6,12 +6,20 @@ Uses existing formats as exemplars and follows DI instructional design principle
 
 import os
 import json
+import argparse
 from datetime import datetime
 from typing import List, Optional
 from pydantic import BaseModel, Field
 from google import genai
 from dotenv import load_dotenv
 
+from generate_sequences import flag_near_duplicates
+from llm_concurrency import RateLimiter, call_with_retries, run_ordered
+from format_reuse import ADAPT_MODEL, FormatReuseCache, reuse_or_generate
+from format_graph import FormatLinkGraph, select_format_exemplars
+from format_parts import PART_RETRIES, generate_format_by_parts
+from artifacts import latest_artifact, open_artifact, save_artifact
+
 load_dotenv()
 
 # ============================================================================
@@ -45,6 +53,10 @@ class GeneratedFormatResponse(BaseModel):
     format: GeneratedFormat
     generation_reasoning: str
 
+class ReusedFormatResponse(GeneratedFormatResponse):
+    """Format response built from a reused or adapted format."""
+    reused_from: dict
+
 # ============================================================================
 # Helper Functions
 # ============================================================================
@@ -87,29 +99,26 @@ def load_prompt_template(template_name: str) -> str:
     with open(template_path, 'r', encoding='utf-8') as f:
         return f.read()
 
-def load_generated_sequences():
-    """Load newly generated sequences."""
-    script_dir = os.path.dirname(os.path.abspath(__file__))
-    outputs_dir = os.path.join(os.path.dirname(script_dir), "outputs")
-    
-    # Find the most recent generated_sequences file
-    generated_files = [f for f in os.listdir(outputs_dir) if f.startswith('generated_sequences_') and f.endswith('.json')]
-    
-    if not generated_files:
-        print("❌ No generated sequences files found")
-        return None
-    
-    # Sort by filename (timestamp) and get the latest
-    generated_files.sort(reverse=True)
-    latest_file = generated_files[0]
+def load_generated_sequences(file_path: str = None):
+    """
+    Load newly generated sequences from file_path, or the latest generated_sequences_* in outputs/.
+    
+    Both the single JSON file and the sharded JSONL layout are accepted.
+    """
+    if file_path is None:
+        script_dir = os.path.dirname(os.path.abspath(__file__))
+        outputs_dir = os.path.join(os.path.dirname(script_dir), "outputs")
+        
+        # Timestamped names sort chronologically
+        file_path = latest_artifact(outputs_dir, 'generated_sequences_')
+        
+        if file_path is None:
+            print("❌ No generated sequences files found")
+            return None
     
-    file_path = os.path.join(outputs_dir, latest_file)
     print(f"📥 Loading generated sequences from: {file_path}")
     
-    with open(file_path, 'r', encoding='utf-8') as f:
-        data = json.load(f)
-    
-    return data
+    return open_artifact(file_path, 'generated_sequences').load()
 
 def load_di_formats():
     """Load existing DI formats as exemplars."""
@@ -129,30 +138,18 @@ def load_di_formats():
     
     return data
 
-def get_exemplar_formats(di_data, grade: int = 3, limit: int = 10):
-    """Extract exemplar formats from DI data."""
-    exemplars = []
-    
-    for skill_name, skill_data in di_data.get('skills', {}).items():
-        for fmt in skill_data.get('formats', []):
-            fmt_grade = fmt.get('grade') or fmt.get('assigned_grade')
-            if fmt_grade == grade:
-                exemplars.append({
-                    'skill': skill_name,
-                    'format_number': fmt.get('format_number'),
-                    'title': fmt.get('title'),
-                    'parts': fmt.get('parts', []),
-                    'grade': fmt_grade,
-                    'sequence_numbers': fmt.get('sequence_numbers', [])
-                })
-                
-                if len(exemplars) >= limit:
-                    break
-        
-        if len(exemplars) >= limit:
-            break
-    
-    return exemplars
+def format_prompt_fields(substandard_data: dict, sequence: dict, exemplars: list) -> dict:
+    """Fields shared by the format generation, outline and part prompts."""
+    return {
+        "skill": f"Generated for {substandard_data['substandard_id']}",
+        "grade": substandard_data['grade'],
+        "sequence_number": sequence['sequence_number'],
+        "problem_type": sequence['problem_type'],
+        "example_questions": json.dumps(sequence.get('example_questions', []), indent=2),
+        "visual_aids": sequence.get('visual_aids') if sequence.get('visual_aids') else "None",
+        # Exemplars are already chosen per sequence and trimmed to a token budget
+        "exemplar_formats": json.dumps(exemplars, indent=2)
+    }
 
 def create_format_generation_prompt(
     substandard_data: dict,
@@ -161,8 +158,15 @@ def create_format_generation_prompt(
     template: str
 ) -> str:
     """Create prompt for format generation."""
-    
-    exemplar_text = json.dumps(exemplars[:5], indent=2)
+    return template.format(**format_prompt_fields(substandard_data, sequence, exemplars))
+
+def create_format_adaptation_prompt(
+    substandard_data: dict,
+    sequence: dict,
+    source_format: dict,
+    template: str
+) -> str:
+    """Create prompt for adapting a similar format to a sequence."""
     
     prompt = template.format(
         skill=f"Generated for {substandard_data['substandard_id']}",
@@ -171,38 +175,289 @@ def create_format_generation_prompt(
         problem_type=sequence['problem_type'],
         example_questions=json.dumps(sequence.get('example_questions', []), indent=2),
         visual_aids=sequence.get('visual_aids') if sequence.get('visual_aids') else "None",
-        exemplar_formats=exemplar_text
+        source_format=json.dumps(source_format, indent=2)
     )
     
     return prompt
 
+def reused_format_response(substandard_data: dict, sequence: dict, match: dict) -> GeneratedFormatResponse:
+    """Build a response that reuses a matched format unchanged."""
+    reused_from = match['reused_from']
+    return GeneratedFormatResponse(
+        format=GeneratedFormat(
+            format_number="TBD",
+            title=match['format']['title'],
+            parts=match['format']['parts'],
+            grade=substandard_data['grade'],
+            sequence_numbers=[sequence['sequence_number']],
+            grade_assignment_reasoning=f"Reused unchanged: the problem type matches {reused_from} at similarity {match['similarity']}"
+        ),
+        generation_reasoning=f"Reused format (similarity {match['similarity']}) instead of generating a new one"
+    )
+
+def reuse_key(substandard_data: dict, sequence: dict) -> tuple:
+    """Key of a generated sequence's format in a FormatReuseCache."""
+    return ("generated", substandard_data['substandard_id'], sequence['sequence_number'])
+
+def expect_substandard_formats(reuse_cache: FormatReuseCache, substandard_data: dict, position: int) -> None:
+    """
+    Announce a substandard's formats to the reuse cache before generating any of them.
+    
+    Call this in output order for every substandard that will be generated
+    with a position, before any of them starts, so ordered lookups know which
+    earlier formats to wait for.
+    
+    Args:
+        reuse_cache: Shared reuse cache (may be None)
+        substandard_data: Substandard with generated_sequences
+        position: Index of the substandard in output order
+    """
+    if reuse_cache is None:
+        return
+    for seq_idx, sequence in enumerate(substandard_data['generated_sequences']):
+        if not sequence.get('duplicate_of'):
+            reuse_cache.expect(reuse_key(substandard_data, sequence), sequence['problem_type'], (position, seq_idx))
+
 def generate_format_for_sequence(
     substandard_data: dict,
     sequence: dict,
     exemplars: list,
     template: str,
-    format_number: str
+    format_number: str = None,
+    limiter: RateLimiter = None,
+    retries: int = 0,
+    reuse_cache: FormatReuseCache = None,
+    adapt_template: str = None,
+    part_templates: tuple = None,
+    part_retries: int = PART_RETRIES,
+    reuse_position: tuple = None
 ) -> GeneratedFormatResponse:
-    """Generate a format for a single sequence."""
+    """
+    Generate a format for a single sequence.
+    
+    format_number may be left unset and assigned later by assemble_format_outputs,
+    which numbers formats in output order when sequences finish out of order.
+    With a reuse_cache, a near-identical earlier or DI format is reused
+    directly and a similar one is adapted with a cheaper prompt; the response
+    is then a ReusedFormatResponse recording the source. With part_templates
+    (outline, part steps), a new format is generated as an outline plus
+    parallel per-part calls, and only parts that fail are retried (up to
+    part_retries times each, independently of retries). reuse_position is
+    the sequence's (substandard position, sequence index) in output order; it
+    limits reuse to DI formats and formats from earlier positions, waiting for
+    those still in progress, so concurrent runs reuse exactly what a serial
+    run would.
+    """
     
     print(f"\n{'='*80}")
     print(f"Generating format for: {substandard_data['substandard_id']}")
     print(f"Sequence #{sequence['sequence_number']}: {sequence['problem_type'][:60]}...")
     print(f"{'='*80}")
     
-    prompt = create_format_generation_prompt(substandard_data, sequence, exemplars, template)
+    label = f"[{substandard_data['substandard_id']} #{sequence['sequence_number']}] "
+    
+    def generate():
+        if part_templates:
+            body = generate_format_by_parts(
+                format_prompt_fields(substandard_data, sequence, exemplars),
+                *part_templates,
+                produce_structured_response_gemini,
+                limiter=limiter,
+                retries=part_retries,
+                label=label
+            )
+            return GeneratedFormatResponse(
+                format=GeneratedFormat(
+                    format_number="TBD",
+                    title=body['title'],
+                    parts=body['parts'],
+                    grade=substandard_data['grade'],
+                    sequence_numbers=[sequence['sequence_number']],
+                    grade_assignment_reasoning=body['grade_assignment_reasoning']
+                ),
+                generation_reasoning=body['generation_reasoning']
+            )
+        prompt = create_format_generation_prompt(substandard_data, sequence, exemplars, template)
+        return call_with_retries(
+            produce_structured_response_gemini,
+            prompt,
+            GeneratedFormatResponse,
+            retries=retries,
+            limiter=limiter,
+            label=label
+        )
+    
+    def adapt(match):
+        prompt = create_format_adaptation_prompt(substandard_data, sequence, match['format'], adapt_template)
+        return call_with_retries(
+            produce_structured_response_gemini,
+            prompt,
+            GeneratedFormatResponse,
+            llm_model=ADAPT_MODEL,
+            retries=retries,
+            limiter=limiter,
+            label=label
+        )
     
     try:
-        response = produce_structured_response_gemini(prompt, GeneratedFormatResponse)
-        response.format.format_number = format_number
+        response, reused_from = reuse_or_generate(
+            reuse_cache,
+            sequence['problem_type'],
+            lambda match: reused_format_response(substandard_data, sequence, match),
+            adapt,
+            generate,
+            position=reuse_position
+        )
+        if format_number is not None:
+            response.format.format_number = format_number
+        if reused_from:
+            response = ReusedFormatResponse(**response.model_dump(), reused_from=reused_from)
+            print(f"♻️  Format {'reused' if reused_from['mode'] == 'reuse' else 'adapted'} from {reused_from}")
+        if reuse_cache is not None:
+            reuse_cache.add(
+                reuse_key(substandard_data, sequence),
+                sequence['problem_type'],
+                response.format.model_dump(),
+                {"source": "generated", "substandard_id": substandard_data['substandard_id'], "sequence_number": sequence['sequence_number']}
+            )
         print(f"✅ Generated format: {response.format.title}")
         return response
     except Exception as e:
+        if reuse_cache is not None:
+            reuse_cache.discard(reuse_key(substandard_data, sequence))
         print(f"❌ Generation failed: {e}")
         raise
 
-def save_generated_formats(results: list, output_filename: str = None):
-    """Save generated formats to JSON file."""
+def generate_substandard_formats(
+    substandard_data: dict,
+    format_graph: FormatLinkGraph,
+    template: str,
+    limiter: RateLimiter = None,
+    retries: int = 0,
+    reuse_cache: FormatReuseCache = None,
+    adapt_template: str = None,
+    exemplar_token_budget: int = 3000,
+    max_exemplars: int = 3,
+    part_templates: tuple = None,
+    part_retries: int = PART_RETRIES,
+    position: int = None
+) -> list:
+    """
+    Generate formats for every unique sequence of one substandard.
+    
+    Each sequence gets the formats linked to its most similar DI sequences and
+    their progression neighbours as exemplars. Near-duplicates (sequences with
+    duplicate_of) are not sent to the model. With a position (the
+    substandard's index in output order, announced beforehand with
+    expect_substandard_formats), reuse decisions follow output order.
+    
+    Returns:
+        One (sequence, response, error) tuple per sequence, in sequence order;
+        response and error are both None for a skipped near-duplicate
+    """
+    outputs = []
+    for seq_idx, sequence in enumerate(substandard_data['generated_sequences']):
+        if sequence.get('duplicate_of'):
+            outputs.append((sequence, None, None))
+            continue
+        try:
+            exemplars = select_format_exemplars(
+                format_graph,
+                sequence,
+                token_budget=exemplar_token_budget,
+                max_exemplars=max_exemplars
+            )
+            response = generate_format_for_sequence(
+                substandard_data,
+                sequence,
+                exemplars,
+                template,
+                limiter=limiter,
+                retries=retries,
+                reuse_cache=reuse_cache,
+                adapt_template=adapt_template,
+                part_templates=part_templates,
+                part_retries=part_retries,
+                reuse_position=(position, seq_idx) if position is not None else None
+            )
+            outputs.append((sequence, response, None))
+        except Exception as e:
+            if reuse_cache is not None:
+                # Release later positions waiting on a format that will never be added
+                reuse_cache.discard(reuse_key(substandard_data, sequence))
+            outputs.append((sequence, None, e))
+    return outputs
+
+def assemble_format_outputs(substandard_outputs: list) -> tuple:
+    """
+    Number generated formats NEW.1, NEW.2, ... in output order and link skipped near-duplicates.
+    
+    Numbering depends only on the order of substandard_outputs, so formats
+    generated concurrently or while sequences were still being generated end
+    up identical to a serial run.
+    
+    Args:
+        substandard_outputs: (substandard_data, outputs) pairs in generated_sequences
+            order, outputs as returned by generate_substandard_formats
+    
+    Returns:
+        (results, skipped_duplicates)
+    """
+    results = []
+    skipped_duplicates = []
+    format_numbers = {}  # (substandard_id, sequence_number) -> generated format number
+    format_counter = 1
+    
+    for i, (substandard_data, outputs) in enumerate(substandard_outputs, 1):
+        print(f"\n[Substandard {i}/{len(substandard_outputs)}] {substandard_data['substandard_id']}")
+        
+        for seq_idx, (sequence, response, error) in enumerate(outputs, 1):
+            duplicate_of = sequence.get('duplicate_of')
+            if duplicate_of:
+                # Near-duplicates reuse the linked sequence's format instead of a new call
+                linked_format = None
+                if duplicate_of['source'] == 'generated':
+                    linked_format = format_numbers.get((duplicate_of['substandard_id'], duplicate_of['sequence_number']))
+                skipped_duplicates.append({
+                    "substandard_id": substandard_data['substandard_id'],
+                    "sequence_number": sequence['sequence_number'],
+                    "problem_type": sequence['problem_type'],
+                    "duplicate_of": duplicate_of,
+                    "linked_format_number": linked_format
+                })
+                print(f"  ⏭️  Seq #{seq_idx} is a near-duplicate of {duplicate_of}, skipping")
+                continue
+            
+            if error is not None:
+                print(f"  ❌ Failed for sequence #{seq_idx}: {error}")
+                continue
+            
+            format_number = f"NEW.{format_counter}"
+            response.format.format_number = format_number
+            
+            result = {
+                "substandard_id": substandard_data['substandard_id'],
+                "substandard_description": substandard_data['substandard_description'],
+                "grade": substandard_data['grade'],
+                "sequence_number": sequence['sequence_number'],
+                "problem_type": sequence['problem_type'],
+                "generated_format": response.format.model_dump(),
+                "generation_reasoning": response.generation_reasoning,
+                "generated_at": datetime.now().isoformat()
+            }
+            if isinstance(response, ReusedFormatResponse):
+                result["reused_from"] = response.reused_from
+            results.append(result)
+            format_numbers[(substandard_data['substandard_id'], sequence['sequence_number'])] = format_number
+            format_counter += 1
+            
+            print(f"  ✓ Seq #{seq_idx}/{len(outputs)} → Format {format_number}")
+    
+    return results, skipped_duplicates
+
+def save_generated_formats(results: list, output_filename: str = None, skipped_duplicates: list = None, format_reuse: dict = None,
+                           output_format: str = "json", compression: str = None):
+    """Save generated formats to a JSON file or sharded JSONL artifact."""
     
     if output_filename is None:
         timestamp = datetime.now().strftime("%Y%m%d_%H%M%S")
@@ -220,13 +475,15 @@ def save_generated_formats(results: list, output_filename: str = None):
             "total_sequences_processed": len(results),
             "llm_model": "gemini-2.5-pro",
             "generation_version": "1.0",
-            "source": "newly_generated_sequences"
+            "source": "newly_generated_sequences",
+            "skipped_duplicates": len(skipped_duplicates or []),
+            "format_reuse": format_reuse
         },
-        "generated_formats": results
+        "generated_formats": results,
+        "skipped_duplicates": skipped_duplicates or []
     }
     
-    with open(output_path, 'w', encoding='utf-8') as f:
-        json.dump(output_data, f, indent=2, ensure_ascii=False)
+    output_path = save_artifact(output_data, output_path, output_format, compression)
     
     print(f"\n✅ Saved generated formats to: {output_path}")
     return output_path
@@ -238,6 +495,22 @@ def save_generated_formats(results: list, output_filename: str = None):
 def main():
     """Main execution function."""
     
+    parser = argparse.ArgumentParser(description="Generate DI-style formats for newly generated sequences")
+    parser.add_argument("--sequences", default=None, help="generated_sequences JSON to read (default: latest in outputs/)")
+    parser.add_argument("--workers", type=int, default=1, help="Substandards processed concurrently (default 1 = serial)")
+    parser.add_argument("--rpm", type=float, default=30, help="Max Gemini requests per minute across workers (0 = unlimited)")
+    parser.add_argument("--retries", type=int, default=0, help="Retries per sequence after a failed call")
+    parser.add_argument("--reuse-threshold", type=float, default=0.9, help="Problem-type similarity at which an earlier or DI format is reused unchanged")
+    parser.add_argument("--adapt-threshold", type=float, default=0.6, help="Problem-type similarity at which a similar format is adapted with a cheaper prompt")
+    parser.add_argument("--no-format-reuse", action="store_true", help="Always generate formats from scratch")
+    parser.add_argument("--exemplar-token-budget", type=int, default=3000, help="Max tokens of exemplar formats per prompt")
+    parser.add_argument("--max-exemplars", type=int, default=3, help="Max exemplar formats per prompt")
+    parser.add_argument("--per-part", action="store_true", help="Generate an outline first, then each part's steps in parallel")
+    parser.add_argument("--part-retries", type=int, default=PART_RETRIES, help="Retries per outline/part call with --per-part (a failed part is regenerated on its own)")
+    parser.add_argument("--output-format", choices=["json", "jsonl"], default="json", help="Write one JSON file or a directory of JSONL shards with an index")
+    parser.add_argument("--compression", choices=["gzip", "zstd"], default=None, help="Compress JSONL shards")
+    args = parser.parse_args()
+    
     print("="*80)
     print("DI FORMAT GENERATOR - NEW SEQUENCES")
     print("="*80)
@@ -250,73 +523,87 @@ def main():
     
     # Load data
     print("\n📥 Loading data...")
-    generated_data = load_generated_sequences()
+    generated_data = load_generated_sequences(args.sequences)
     if not generated_data:
         return
     
     di_data = load_di_formats()
     
-    # Get exemplar formats
-    print("\n📚 Loading exemplar formats...")
-    exemplars = get_exemplar_formats(di_data, grade=3, limit=10)
-    print(f"Loaded {len(exemplars)} exemplar formats")
+    # Files written before near-duplicate linking existed get checked here
+    if 'near_duplicates' not in generated_data.get('metadata', {}):
+        print("\n🔍 Checking generated sequences for near-duplicates...")
+        summary = flag_near_duplicates(generated_data.get('generated_sequences', []), di_data)
+        print(f"Linked {summary['duplicates_of_di'] + summary['duplicates_of_generated']} near-duplicate sequences")
+    
+    # Index sequence <-> format links for exemplar selection
+    print("\n📚 Indexing sequence-format links...")
+    format_graph = FormatLinkGraph(di_data)
+    print(f"Indexed {len(format_graph.formats)} formats linked to {len(format_graph.sequence_formats)} sequences")
     
     # Load prompt template
     print("\n📝 Loading prompt template...")
     template = load_prompt_template("format_generation")
+    adapt_template = load_prompt_template("format_adaptation")
+    part_templates = None
+    if args.per_part:
+        part_templates = (load_prompt_template("format_outline"), load_prompt_template("format_part_steps"))
     
-    # Generate formats
-    print("\n🔨 Generating formats for new sequences...")
-    results = []
-    format_counter = 1
+    reuse_cache = None
+    if not args.no_format_reuse:
+        reuse_cache = FormatReuseCache(args.reuse_threshold, args.adapt_threshold)
+        print(f"♻️  Indexed {reuse_cache.add_di_formats(di_data)} DI format entries for reuse")
     
+    # Generate formats
+    print(f"\n🔨 Generating formats for new sequences ({args.workers} workers, {args.rpm or 'unlimited'} requests/min)...")
+    limiter = RateLimiter(args.rpm)
     generated_sequences = generated_data.get('generated_sequences', [])
     
-    # Process first 3 for testing (change to all for full run)
-    for i, substandard_data in enumerate(generated_sequences, 1):
-        print(f"\n[Substandard {i}/{len(generated_sequences)}] {substandard_data['substandard_id']}")
-        
-        for seq_idx, sequence in enumerate(substandard_data['generated_sequences'], 1):
-            try:
-                format_number = f"NEW.{format_counter}"
-                
-                response = generate_format_for_sequence(
-                    substandard_data,
-                    sequence,
-                    exemplars,
-                    template,
-                    format_number
-                )
-                
-                result = {
-                    "substandard_id": substandard_data['substandard_id'],
-                    "substandard_description": substandard_data['substandard_description'],
-                    "grade": substandard_data['grade'],
-                    "sequence_number": sequence['sequence_number'],
-                    "problem_type": sequence['problem_type'],
-                    "generated_format": response.format.model_dump(),
-                    "generation_reasoning": response.generation_reasoning,
-                    "generated_at": datetime.now().isoformat()
-                }
-                
-                results.append(result)
-                format_counter += 1
-                
-                print(f"  ✓ Seq #{seq_idx}/{len(substandard_data['generated_sequences'])} → Format {format_number}")
-                
-            except Exception as e:
-                print(f"  ❌ Failed for sequence #{seq_idx}: {e}")
-                continue
+    # Reuse decisions follow output order, so --workers does not change which formats are reused
+    for position, substandard_data in enumerate(generated_sequences):
+        expect_substandard_formats(reuse_cache, substandard_data, position)
+    
+    def generate(item):
+        position, substandard_data = item
+        return generate_substandard_formats(
+            substandard_data,
+            format_graph,
+            template,
+            limiter=limiter,
+            retries=args.retries,
+            reuse_cache=reuse_cache,
+            adapt_template=adapt_template,
+            exemplar_token_budget=args.exemplar_token_budget,
+            max_exemplars=args.max_exemplars,
+            part_templates=part_templates,
+            part_retries=args.part_retries,
+            position=position
+        )
+    
+    substandard_outputs = []
+    outcomes = run_ordered(list(enumerate(generated_sequences)), generate, max_workers=args.workers)
+    for substandard_data, (outputs, error) in zip(generated_sequences, outcomes):
+        substandard_outputs.append((substandard_data, outputs if error is None else []))
+    results, skipped_duplicates = assemble_format_outputs(substandard_outputs)
     
     # Save results
     if results:
-        output_path = save_generated_formats(results)
+        format_reuse = reuse_cache.summary() if reuse_cache is not None else None
+        output_path = save_generated_formats(
+            results,
+            skipped_duplicates=skipped_duplicates,
+            format_reuse=format_reuse,
+            output_format=args.output_format,
+            compression=args.compression
+        )
         
         print(f"\n{'='*80}")
         print("SUMMARY")
         print(f"{'='*80}")
         print(f"Substandards processed: {min(3, len(generated_sequences))}")
         print(f"Formats generated: {len(results)}")
+        print(f"Near-duplicate sequences skipped: {len(skipped_duplicates)}")
+        if format_reuse:
+            print(f"Format reuse: {format_reuse['reused']} reused, {format_reuse['adapted']} adapted, {format_reuse['generated']} generated (reuse rate {format_reuse['reuse_rate']:.0%})")
         print(f"Output: {output_path}")
     else:
         print("\n⚠️  No formats were generated")
@@ -5,14 +5,21 @@ Uses existing sequences as exemplars and follows DI principles.
 """
 
 import os
+import re
 import json
 import sys
+import argparse
 from datetime import datetime
-from typing import List, Optional
+from typing import Iterable, List, Optional, Union
 from pydantic import BaseModel, Field
 from google import genai
 from dotenv import load_dotenv
 
+from llm_concurrency import RateLimiter, call_with_retries, run_ordered
+from similarity import TfidfIndex, MinHashIndex, select_within_token_budget
+from artifacts import open_artifact, save_artifact
+from boundary_rules import check_sequences, format_violation_feedback, parse_assessment_boundary
+
 load_dotenv()
 
 # ============================================================================
@@ -32,6 +39,10 @@ class GeneratedSequenceResponse(BaseModel):
     sequences: List[SequenceItem] = Field(..., min_items=1, max_items=5)
     generation_reasoning: str
 
+class BatchGeneratedSequenceResponse(BaseModel):
+    """Response containing generated sequences for several substandards, one entry per substandard_id."""
+    results: List[GeneratedSequenceResponse] = Field(..., min_items=1)
+
 # ============================================================================
 # Helper Functions
 # ============================================================================
@@ -74,16 +85,20 @@ def load_prompt_template(template_name: str) -> str:
     with open(template_path, 'r', encoding='utf-8') as f:
         return f.read()
 
-def load_mappings_data(grade: int = 3):
-    """Load existing mappings data."""
+def get_mappings_path() -> str:
+    """Path of the existing substandard -> sequence mappings."""
     project_root = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
-    mappings_path = os.path.join(
+    return os.path.join(
         project_root, 
         "..", 
         "Experiment - Find existing mappings",
         "outputs",
         "substandard_to_sequence_mappings.v3.json"
     )
+
+def load_mappings_data(grade: int = 3):
+    """Load existing mappings data."""
+    mappings_path = get_mappings_path()
     
     print(f"Loading mappings from: {mappings_path}")
     
@@ -92,6 +107,18 @@ def load_mappings_data(grade: int = 3):
     
     return data
 
+def iter_mappings(mappings_path: str = None):
+    """
+    Stream existing mappings one at a time without loading the whole file.
+    
+    Works on the legacy JSON file and on sharded artifacts.
+    """
+    mappings_path = mappings_path or get_mappings_path()
+    
+    print(f"Streaming mappings from: {mappings_path}")
+    
+    return iter(open_artifact(mappings_path, "mappings"))
+
 def load_di_formats():
     """Load DI formats with existing sequences."""
     project_root = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
@@ -110,20 +137,22 @@ def load_di_formats():
     
     return data
 
-def get_substandards_needing_sequences(mappings_data, threshold: int = 2):
+def get_substandards_needing_sequences(mappings_data: Union[dict, Iterable[dict]], threshold: int = 2):
     """
     Get substandards that need new sequences (have few or poor matches).
     
     Args:
-        mappings_data: Loaded mappings data
+        mappings_data: Loaded mappings data, or an iterable of mappings
+            (e.g. iter_mappings()) so only one mapping is held at a time
         threshold: Minimum number of good matches required
     
     Returns:
         List of substandards that need sequences
     """
     needs_sequences = []
+    mappings = mappings_data.get('mappings', []) if isinstance(mappings_data, dict) else mappings_data
     
-    for mapping in mappings_data.get('mappings', []):
+    for mapping in mappings:
         num_matches = len(mapping.get('final_excellent_matches', []))
         
         if num_matches < threshold:
@@ -169,15 +198,135 @@ def get_exemplar_sequences(di_data, grade: int = 3, skill: str = None):
     
     return exemplars
 
+def build_exemplar_index(exemplars: list) -> TfidfIndex:
+    """Precompute a similarity index over all exemplar sequences."""
+    def exemplar_text(ex):
+        return " ".join([
+            ex.get('skill') or '',
+            ex.get('problem_type') or '',
+            " ".join(ex.get('example_questions') or []),
+            " ".join(ex.get('visual_aids') or []),
+        ])
+    return TfidfIndex(exemplars, exemplar_text)
+
+def domain_prefix(substandard_id: str) -> str:
+    """Return the grade.domain prefix of a substandard ID, e.g. "3.NF" for CCSS.MATH.CONTENT.3.NF.A.1+2."""
+    match = re.search(r"(\d+\.[A-Z]+)\.", substandard_id)
+    return match.group(1) if match else substandard_id
+
+def group_substandards_by_domain(substandards: list, batch_size: int) -> list:
+    """
+    Group substandards by domain prefix into batches of at most batch_size.
+    
+    Domains appear in the order of their first substandard, and substandards
+    keep their relative order within a domain.
+    """
+    by_domain = {}
+    for substandard in substandards:
+        by_domain.setdefault(domain_prefix(substandard['substandard_id']), []).append(substandard)
+    
+    batches = []
+    for domain_substandards in by_domain.values():
+        for start in range(0, len(domain_substandards), max(1, batch_size)):
+            batches.append(domain_substandards[start:start + max(1, batch_size)])
+    return batches
+
+def select_exemplars(
+    substandard: dict,
+    exemplar_index: TfidfIndex,
+    token_budget: int = 800,
+    max_exemplars: int = 8
+) -> list:
+    """
+    Pick the exemplars most similar to a substandard, within a prompt token budget.
+    
+    Args:
+        substandard: Substandard with description and assessment boundary
+        exemplar_index: Index built by build_exemplar_index
+        token_budget: Max tokens of exemplar JSON to put in the prompt
+        max_exemplars: Upper bound on the number of exemplars
+    
+    Returns:
+        Exemplars ordered from most to least relevant (exemplars sharing no terms
+        with the substandard are only used if nothing matches)
+    """
+    query = f"{substandard['substandard_description']} {substandard.get('assessment_boundary') or ''}"
+    ranked = exemplar_index.rank(query)
+    ranked = [ex for score, ex in ranked if score > 0] or [ex for _, ex in ranked]
+    return select_within_token_budget(ranked, token_budget, max_items=max_exemplars)
+
+def sequence_text(seq: dict) -> str:
+    """Text used to compare sequences: problem type, example questions and visual aids."""
+    return " ".join([seq.get('problem_type') or ''] + list(seq.get('example_questions') or []) + list(seq.get('visual_aids') or []))
+
+def build_duplicate_index(di_data: dict) -> MinHashIndex:
+    """Index every existing DI sequence (all grades) for near-duplicate checks."""
+    index = MinHashIndex()
+    for skill_name, skill_data in di_data.get('skills', {}).items():
+        for progression in skill_data.get('progression', []):
+            for seq in progression.get('sequence', []):
+                index.add(("di", skill_name, progression.get('grade'), seq.get('sequence_number')), sequence_text(seq))
+    return index
+
+def new_duplicate_summary(threshold: float) -> dict:
+    return {"threshold": threshold, "duplicates_of_di": 0, "duplicates_of_generated": 0, "unique": 0}
+
+def flag_result_duplicates(result: dict, index: MinHashIndex, threshold: float, summary: dict) -> None:
+    """
+    Link one substandard's generated sequences to near-duplicates already in the index.
+    
+    Unique sequences are added to the index, so results must be passed in
+    output order for later restatements to link to the first occurrence.
+    """
+    for seq in result['generated_sequences']:
+        seq.pop('duplicate_of', None)
+        matches = index.query(sequence_text(seq), threshold=threshold)
+        if not matches:
+            index.add(("generated", result['substandard_id'], seq['sequence_number']), sequence_text(seq))
+            summary["unique"] += 1
+            continue
+        score, key = matches[0]
+        if key[0] == "di":
+            seq['duplicate_of'] = {"source": "di", "skill": key[1], "grade": key[2], "sequence_number": key[3], "similarity": round(score, 3)}
+            summary["duplicates_of_di"] += 1
+        else:
+            seq['duplicate_of'] = {"source": "generated", "substandard_id": key[1], "sequence_number": key[2], "similarity": round(score, 3)}
+            summary["duplicates_of_generated"] += 1
+        print(f"🔁 {result['substandard_id']} seq #{seq['sequence_number']} duplicates {seq['duplicate_of']} ")
+
+def flag_near_duplicates(results: list, di_data: dict, threshold: float = 0.8) -> dict:
+    """
+    Link generated sequences that nearly restate an existing DI sequence or an earlier generated one.
+    
+    Every DI sequence (all grades) is indexed first, then generated sequences
+    are checked in output order; unique ones are added to the index so later
+    restatements link to the first occurrence. A duplicate gets a duplicate_of
+    entry and is skipped by format generation.
+    
+    Args:
+        results: generated_sequences entries (modified in place)
+        di_data: Loaded DI formats data
+        threshold: Minimum character-shingle Jaccard similarity for a duplicate
+    
+    Returns:
+        Summary counts for the output metadata
+    """
+    index = build_duplicate_index(di_data)
+    summary = new_duplicate_summary(threshold)
+    for result in results:
+        flag_result_duplicates(result, index, threshold, summary)
+    return summary
+
 def create_sequence_generation_prompt(
     substandard: dict,
     exemplars: list,
-    template: str
+    template: str,
+    feedback: str = None
 ) -> str:
-    """Create prompt for sequence generation."""
+    """Create prompt for sequence generation from already selected exemplars (plus feedback on a previous attempt)."""
     
-    # Format exemplars for prompt
-    exemplar_text = json.dumps(exemplars[:10], indent=2)  # Limit to 10 exemplars
+    # Format exemplars for prompt (see select_exemplars for relevance ranking and the token budget)
+    exemplar_text = json.dumps(exemplars, indent=2)
     
     # Fill in template
     prompt = template.format(
@@ -188,12 +337,67 @@ def create_sequence_generation_prompt(
         exemplar_sequences=exemplar_text
     )
     
-    return prompt
+    return prompt + (feedback or "")
+
+def create_batch_sequence_generation_prompt(
+    substandards: list,
+    exemplars: list,
+    template: str
+) -> str:
+    """Create one prompt covering several substandards that share an exemplar block."""
+    
+    blocks = []
+    for n, substandard in enumerate(substandards, 1):
+        blocks.append(
+            f"{n}. ID: {substandard['substandard_id']}\n"
+            f"   Description: {substandard['substandard_description']}\n"
+            f"   Assessment boundary:\n{substandard['assessment_boundary']}"
+        )
+    
+    return template.format(
+        grade=substandards[0]['grade'],
+        substandards_block="\n\n".join(blocks),
+        exemplar_sequences=json.dumps(exemplars, indent=2)
+    )
+
+def generate_sequences_for_batch(
+    substandards: list,
+    exemplars: list,
+    template: str,
+    limiter: RateLimiter = None
+) -> dict:
+    """
+    Generate sequences for a batch of substandards in one call.
+    
+    Returns:
+        substandard_id -> GeneratedSequenceResponse for every requested substandard
+        the response covered. Requested IDs missing from the response are left out
+        so the caller can retry them one at a time; extra IDs are ignored.
+    """
+    ids = [s['substandard_id'] for s in substandards]
+    print(f"\n{'='*80}")
+    print(f"Generating sequences for batch: {', '.join(ids)}")
+    print(f"{'='*80}")
+    
+    prompt = create_batch_sequence_generation_prompt(substandards, exemplars, template)
+    if limiter is not None:
+        limiter.wait()
+    response = produce_structured_response_gemini(prompt, BatchGeneratedSequenceResponse)
+    
+    by_id = {}
+    for result in response.results:
+        if result.substandard_id in ids and result.substandard_id not in by_id:
+            by_id[result.substandard_id] = result
+    print(f"✅ Batch returned {len(by_id)}/{len(ids)} substandards")
+    return by_id
 
 def generate_sequences_for_substandard(
     substandard: dict,
     exemplars: list,
-    template: str
+    template: str,
+    limiter: RateLimiter = None,
+    retries: int = 0,
+    feedback: str = None
 ) -> GeneratedSequenceResponse:
     """Generate sequences for a single substandard."""
     
@@ -202,18 +406,22 @@ def generate_sequences_for_substandard(
     print(f"Description: {substandard['substandard_description'][:80]}...")
     print(f"{'='*80}")
     
-    prompt = create_sequence_generation_prompt(substandard, exemplars, template)
+    prompt = create_sequence_generation_prompt(substandard, exemplars, template, feedback)
     
     try:
-        response = produce_structured_response_gemini(prompt, GeneratedSequenceResponse)
-        print(f"✅ Generated {len(response.sequences)} sequences")
+        response = call_with_retries(
+            produce_structured_response_gemini, prompt, GeneratedSequenceResponse,
+            retries=retries, limiter=limiter, label=f"[{substandard['substandard_id']}] "
+        )
+        print(f"✅ [{substandard['substandard_id']}] Generated {len(response.sequences)} sequences")
         return response
     except Exception as e:
-        print(f"❌ Generation failed: {e}")
+        print(f"❌ [{substandard['substandard_id']}] Generation failed: {e}")
         raise
 
-def save_generated_sequences(results: list, output_filename: str = None):
-    """Save generated sequences to JSON file."""
+def save_generated_sequences(results: list, output_filename: str = None, failures: list = None, near_duplicates: dict = None,
+                             output_format: str = "json", compression: str = None):
+    """Save generated sequences (and any per-substandard failures) to a JSON file or sharded JSONL artifact."""
     
     if output_filename is None:
         timestamp = datetime.now().strftime("%Y%m%d_%H%M%S")
@@ -229,18 +437,213 @@ def save_generated_sequences(results: list, output_filename: str = None):
         "metadata": {
             "generation_timestamp": datetime.now().isoformat(),
             "total_substandards_processed": len(results),
+            "total_substandards_failed": len(failures or []),
+            "near_duplicates": near_duplicates,
+            "boundary_rejected_sequences": sum(len(r.get('boundary_rejections', [])) for r in results),
             "llm_model": "gemini-2.5-pro",
             "generation_version": "1.0"
         },
-        "generated_sequences": results
+        "generated_sequences": results,
+        "failed_substandards": failures or []
     }
     
-    with open(output_path, 'w', encoding='utf-8') as f:
-        json.dump(output_data, f, indent=2, ensure_ascii=False)
+    output_path = save_artifact(output_data, output_path, output_format, compression)
     
     print(f"\n✅ Saved generated sequences to: {output_path}")
     return output_path
 
+def build_sequence_result(substandard: dict, response: GeneratedSequenceResponse, selected: list) -> dict:
+    """Build the generated_sequences entry for one substandard."""
+    return {
+        "substandard_id": substandard['substandard_id'],
+        "grade": substandard['grade'],
+        "substandard_description": substandard['substandard_description'],
+        "assessment_boundary": substandard['assessment_boundary'],
+        "generated_sequences": [seq.model_dump() for seq in response.sequences],
+        "generation_reasoning": response.generation_reasoning,
+        "exemplars_used": [f"{ex['skill']} #{ex['sequence_number']}" for ex in selected],
+        "generated_at": datetime.now().isoformat()
+    }
+
+def generate_substandard_result(
+    substandard: dict,
+    exemplar_index: TfidfIndex,
+    template: str,
+    limiter: RateLimiter = None,
+    retries: int = 0,
+    token_budget: int = 800,
+    max_exemplars: int = 8,
+    feedback: str = None
+) -> dict:
+    """Select exemplars for one substandard, generate its sequences and build its output entry."""
+    selected = select_exemplars(
+        substandard,
+        exemplar_index,
+        token_budget=token_budget,
+        max_exemplars=max_exemplars
+    )
+    response = generate_sequences_for_substandard(
+        substandard,
+        selected,
+        template,
+        limiter=limiter,
+        retries=retries,
+        feedback=feedback
+    )
+    return build_sequence_result(substandard, response, selected)
+
+def enforce_assessment_boundary(substandard: dict, result: dict, regenerate, boundary_retries: int = 1) -> dict:
+    """
+    Check a result's example questions against the mechanical rules of its assessment boundary.
+    
+    Violating sequences are sent back with targeted feedback up to
+    boundary_retries times (an attempt is kept if it has more compliant
+    sequences); any still violating are dropped and listed under
+    boundary_rejections, so no downstream call is spent on them.
+    
+    Args:
+        substandard: Substandard with its assessment boundary
+        result: generated_sequences entry to check
+        regenerate: feedback text -> new generated_sequences entry
+        boundary_retries: Regeneration attempts before rejecting
+    
+    Returns:
+        The entry to keep
+    
+    Raises:
+        ValueError: If every sequence breaks the boundary
+    """
+    rules = parse_assessment_boundary(substandard['assessment_boundary'])
+    if rules.is_empty():
+        return result
+    
+    label = f"[{substandard['substandard_id']}]"
+    violations = check_sequences(result['generated_sequences'], rules)
+    for _ in range(boundary_retries):
+        if not violations:
+            break
+        print(f"⚠️  {label} {len(violations)} sequence(s) break the assessment boundary; regenerating with feedback")
+        try:
+            candidate = regenerate(format_violation_feedback(violations))
+        except Exception as e:
+            print(f"⚠️  {label} Boundary regeneration failed: {e}")
+            break
+        candidate_violations = check_sequences(candidate['generated_sequences'], rules)
+        compliant = len(result['generated_sequences']) - len(violations)
+        if len(candidate['generated_sequences']) - len(candidate_violations) > compliant:
+            result, violations = candidate, candidate_violations
+    
+    if not violations:
+        return result
+    kept = [seq for seq in result['generated_sequences'] if seq['sequence_number'] not in violations]
+    if not kept:
+        first = next(iter(violations.values()))[0]
+        raise ValueError(f"Every generated sequence breaks the assessment boundary (e.g. {first})")
+    result['boundary_rejections'] = [
+        {"sequence": seq, "violations": violations[seq['sequence_number']]}
+        for seq in result['generated_sequences'] if seq['sequence_number'] in violations
+    ]
+    result['generated_sequences'] = kept
+    print(f"🚫 {label} Rejected {len(result['boundary_rejections'])} sequence(s) outside the assessment boundary")
+    return result
+
+def generate_batch_results(
+    batch: list,
+    exemplar_index: TfidfIndex,
+    template: str,
+    batch_template: str = None,
+    limiter: RateLimiter = None,
+    retries: int = 0,
+    token_budget: int = 800,
+    max_exemplars: int = 8,
+    boundary_template: str = None,
+    boundary_retries: int = 1
+) -> dict:
+    """
+    Generate a domain batch in one call; substandards the batch did not cover are retried singly.
+    
+    With a boundary_template, every result is checked against its assessment
+    boundary (see enforce_assessment_boundary) before it is returned.
+    
+    Returns:
+        substandard_id -> (result entry, None) or (None, error) for every substandard in the batch
+    """
+    outcomes = {}
+    if len(batch) > 1:
+        # The batch shares one exemplar block, ranked against all of its substandards
+        batch_query = {
+            'substandard_description': " ".join(s['substandard_description'] for s in batch),
+            'assessment_boundary': " ".join(s['assessment_boundary'] or '' for s in batch),
+        }
+        selected = select_exemplars(
+            batch_query,
+            exemplar_index,
+            token_budget=token_budget,
+            max_exemplars=max_exemplars
+        )
+        try:
+            by_id = generate_sequences_for_batch(batch, selected, batch_template, limiter=limiter)
+        except Exception as e:
+            print(f"⚠️  Batch {domain_prefix(batch[0]['substandard_id'])} failed validation ({e}); splitting into single calls")
+            by_id = {}
+        for substandard in batch:
+            response = by_id.get(substandard['substandard_id'])
+            if response is not None:
+                outcomes[substandard['substandard_id']] = (build_sequence_result(substandard, response, selected), None)
+    
+    for substandard in batch:
+        if substandard['substandard_id'] in outcomes:
+            continue
+        try:
+            outcomes[substandard['substandard_id']] = (
+                generate_substandard_result(substandard, exemplar_index, template, limiter, retries, token_budget, max_exemplars),
+                None
+            )
+        except Exception as e:
+            outcomes[substandard['substandard_id']] = (None, e)
+    
+    if boundary_template is None:
+        return outcomes
+    for substandard in batch:
+        result, error = outcomes[substandard['substandard_id']]
+        if error is not None:
+            continue
+        
+        def regenerate(violations, substandard=substandard):
+            return generate_substandard_result(
+                substandard, exemplar_index, template, limiter, retries, token_budget, max_exemplars,
+                feedback=boundary_template.format(violations=violations)
+            )
+        
+        try:
+            outcomes[substandard['substandard_id']] = (
+                enforce_assessment_boundary(substandard, result, regenerate, boundary_retries),
+                None
+            )
+        except Exception as e:
+            outcomes[substandard['substandard_id']] = (None, e)
+    return outcomes
+
+def record_sequence_outcome(substandard: dict, result: dict, error: Exception, results: list, failures: list, label: str = "") -> None:
+    """Append a substandard's outcome to results or failures and print it."""
+    if error is not None:
+        print(f"\n{label} ❌ Failed to generate for {substandard['substandard_id']}: {error}")
+        failures.append({
+            "substandard_id": substandard['substandard_id'],
+            "grade": substandard['grade'],
+            "substandard_description": substandard['substandard_description'],
+            "error": str(error),
+            "failed_at": datetime.now().isoformat()
+        })
+        return
+    
+    results.append(result)
+    
+    # Show generated sequences
+    print(f"\n{label} {substandard['substandard_id']}")
+    for seq in result["generated_sequences"]:
+        print(f"  - Seq #{seq['sequence_number']}: {seq['problem_type']}")
+
 # ============================================================================
 # Main Function
 # ============================================================================
@@ -248,6 +651,20 @@ def save_generated_sequences(results: list, output_filename: str = None):
 def main():
     """Main execution function."""
     
+    parser = argparse.ArgumentParser(description="Generate DI-style sequences for substandards with poor/no matches")
+    parser.add_argument("--workers", type=int, default=1, help="Concurrent Gemini calls (default 1 = serial)")
+    parser.add_argument("--rpm", type=float, default=30, help="Max Gemini requests per minute across workers (0 = unlimited)")
+    parser.add_argument("--retries", type=int, default=2, help="Retries per substandard after a failed call")
+    parser.add_argument("--exemplar-token-budget", type=int, default=800, help="Max tokens of exemplar sequences per prompt")
+    parser.add_argument("--max-exemplars", type=int, default=8, help="Max exemplar sequences per prompt")
+    parser.add_argument("--duplicate-threshold", type=float, default=0.8, help="Shingle Jaccard similarity at which a generated sequence is linked as a near-duplicate")
+    parser.add_argument("--batch-size", type=int, default=1, help="Substandards per call, grouped by domain prefix such as 3.NF (default 1 = one call each)")
+    parser.add_argument("--boundary-retries", type=int, default=1, help="Regenerations with feedback for sequences whose example questions break the assessment boundary, before they are rejected")
+    parser.add_argument("--no-boundary-check", action="store_true", help="Skip the local assessment-boundary checks")
+    parser.add_argument("--output-format", choices=["json", "jsonl"], default="json", help="Write one JSON file or a directory of JSONL shards with an index")
+    parser.add_argument("--compression", choices=["gzip", "zstd"], default=None, help="Compress JSONL shards")
+    args = parser.parse_args()
+    
     print("="*80)
     print("DI SEQUENCE GENERATOR")
     print("="*80)
@@ -260,71 +677,80 @@ def main():
     
     # Load data
     print("\n📥 Loading data...")
-    mappings_data = load_mappings_data()
     di_data = load_di_formats()
     
     # Get substandards needing sequences
     print("\n🔍 Identifying substandards needing sequences...")
-    needs_sequences = get_substandards_needing_sequences(mappings_data, threshold=1)
+    needs_sequences = get_substandards_needing_sequences(iter_mappings(), threshold=1)
     print(f"Found {len(needs_sequences)} substandards needing sequences (0 matches)")
     
     # Get exemplar sequences
     print("\n📚 Loading exemplar sequences...")
     exemplars = get_exemplar_sequences(di_data, grade=3)
-    print(f"Loaded {len(exemplars)} exemplar sequences")
+    exemplar_index = build_exemplar_index(exemplars)
+    print(f"Loaded and indexed {len(exemplars)} exemplar sequences")
     
     # Load prompt template
     print("\n📝 Loading prompt template...")
     template = load_prompt_template("sequence_generation")
+    batch_template = load_prompt_template("sequence_generation_batch") if args.batch_size > 1 else None
+    boundary_template = None if args.no_boundary_check else load_prompt_template("sequence_boundary_feedback")
     
     # Generate sequences
-    print("\n🔨 Generating sequences...")
-    results = []
+    print(f"\n🔨 Generating sequences ({args.workers} workers, {args.rpm or 'unlimited'} requests/min)...")
+    limiter = RateLimiter(args.rpm)
+    
+    settings = {
+        "limiter": limiter,
+        "retries": args.retries,
+        "token_budget": args.exemplar_token_budget,
+        "max_exemplars": args.max_exemplars,
+        "boundary_template": boundary_template,
+        "boundary_retries": args.boundary_retries,
+    }
     
-    # Process all substandards
+    def generate_batch(batch):
+        return generate_batch_results(batch, exemplar_index, template, batch_template, **settings)
+    
+    # Batches run concurrently; outcomes are reassembled in the order of needs_sequences
+    batches = group_substandards_by_domain(needs_sequences, args.batch_size)
+    print(f"📦 {len(needs_sequences)} substandards in {len(batches)} calls (batch size {args.batch_size})")
+    outcomes_by_id = {}
+    for batch, (batch_outcomes, error) in zip(batches, run_ordered(batches, generate_batch, max_workers=args.workers)):
+        for substandard in batch:
+            outcomes_by_id[substandard['substandard_id']] = batch_outcomes[substandard['substandard_id']] if error is None else (None, error)
+    
+    results = []
+    failures = []
     for i, substandard in enumerate(needs_sequences, 1):
-        print(f"\n[{i}/{len(needs_sequences)}]")
-        
-        try:
-            response = generate_sequences_for_substandard(
-                substandard,
-                exemplars,
-                template
-            )
-            
-            result = {
-                "substandard_id": substandard['substandard_id'],
-                "grade": substandard['grade'],
-                "substandard_description": substandard['substandard_description'],
-                "assessment_boundary": substandard['assessment_boundary'],
-                "generated_sequences": [seq.model_dump() for seq in response.sequences],
-                "generation_reasoning": response.generation_reasoning,
-                "generated_at": datetime.now().isoformat()
-            }
-            
-            results.append(result)
-            
-            # Show generated sequences
-            for seq in response.sequences:
-                print(f"  - Seq #{seq.sequence_number}: {seq.problem_type}")
-            
-        except Exception as e:
-            print(f"❌ Failed to generate for {substandard['substandard_id']}: {e}")
-            continue
+        result, error = outcomes_by_id[substandard['substandard_id']]
+        record_sequence_outcome(substandard, result, error, results, failures, f"[{i}/{len(needs_sequences)}]")
+    
+    # Link near-duplicates so format generation only spends calls on unique sequences
+    print("\n🔍 Checking for near-duplicate sequences...")
+    near_duplicates = flag_near_duplicates(results, di_data, threshold=args.duplicate_threshold)
     
     # Save results
-    if results:
-        output_path = save_generated_sequences(results)
+    if results or failures:
+        output_path = save_generated_sequences(
+            results,
+            failures=failures,
+            near_duplicates=near_duplicates,
+            output_format=args.output_format,
+            compression=args.compression
+        )
         
         print(f"\n{'='*80}")
         print("SUMMARY")
         print(f"{'='*80}")
         print(f"Total substandards processed: {len(results)}")
+        print(f"Total substandards failed: {len(failures)}")
         print(f"Total sequences generated: {sum(len(r['generated_sequences']) for r in results)}")
+        print(f"Sequences rejected for breaking the assessment boundary: {sum(len(r.get('boundary_rejections', [])) for r in results)}")
+        print(f"Near-duplicates linked: {near_duplicates['duplicates_of_di']} of DI, {near_duplicates['duplicates_of_generated']} of generated")
         print(f"Output: {output_path}")
     else:
         print("\n⚠️  No sequences were generated")
 
 if __name__ == "__main__":
     main()
-
@@ -0,0 +1,94 @@
+"""
+Bounded-concurrency helpers for the Gemini generation scripts.
+
+- RateLimiter: thread-safe limit on LLM requests per minute, shared by all workers
+- call_with_retries: retry a call with exponential backoff and jitter
+- run_ordered: run a function over items on a thread pool and return the
+  outcomes in input order, so output files stay deterministic
+"""
+
+import time
+import random
+import threading
+from concurrent.futures import ThreadPoolExecutor, as_completed
+from typing import Any, Callable, List, Optional, Sequence, Tuple
+
+
+class RateLimiter:
+    """
+    Space out calls so that at most requests_per_minute start in any minute.
+
+    Args:
+        requests_per_minute: Call budget; 0 or None disables limiting
+    """
+
+    def __init__(self, requests_per_minute: Optional[float] = None):
+        self.interval = 60.0 / requests_per_minute if requests_per_minute else 0.0
+        self._lock = threading.Lock()
+        self._next_slot = 0.0
+
+    def wait(self) -> None:
+        """Block until the caller may start its next request."""
+        if not self.interval:
+            return
+        with self._lock:
+            now = time.monotonic()
+            slot = max(now, self._next_slot)
+            self._next_slot = slot + self.interval
+        if slot > now:
+            time.sleep(slot - now)
+
+
+def call_with_retries(fn: Callable, *args, retries: int = 3, base_delay: float = 2.0,
+                      limiter: Optional[RateLimiter] = None, label: str = "", **kwargs) -> Any:
+    """
+    Call fn(*args, **kwargs), retrying failures with exponential backoff.
+
+    Args:
+        fn: Function to call
+        retries: Retries after the first attempt
+        base_delay: Delay before the first retry in seconds (doubled each retry)
+        limiter: Rate limiter to wait on before every attempt
+        label: Prefix for retry messages
+
+    Returns:
+        fn's return value; the last exception is raised if every attempt fails
+    """
+    for attempt in range(retries + 1):
+        if limiter is not None:
+            limiter.wait()
+        try:
+            return fn(*args, **kwargs)
+        except Exception as e:
+            if attempt == retries:
+                raise
+            delay = base_delay * (2 ** attempt) * (1 + random.random() * 0.25)
+            print(f"{label}⚠️  Attempt {attempt + 1}/{retries + 1} failed ({e}); retrying in {delay:.1f}s")
+            time.sleep(delay)
+
+
+def run_ordered(items: Sequence, fn: Callable, max_workers: int = 4) -> List[Tuple[Any, Optional[Exception]]]:
+    """
+    Apply fn to every item concurrently and return (result, error) pairs in input order.
+
+    Exactly one of result/error is set for each item. With max_workers <= 1 the
+    items are processed serially in the calling thread.
+    """
+    outcomes: List[Tuple[Any, Optional[Exception]]] = [(None, None)] * len(items)
+    if max_workers <= 1:
+        for idx, item in enumerate(items):
+            try:
+                outcomes[idx] = (fn(item), None)
+            except Exception as e:
+                outcomes[idx] = (None, e)
+        return outcomes
+
+    with ThreadPoolExecutor(max_workers=max_workers) as executor:
+        futures = {executor.submit(fn, item): idx for idx, item in enumerate(items)}
+        for future in as_completed(futures):
+            idx = futures[future]
+            try:
+                outcomes[idx] = (future.result(), None)
+            except Exception as e:
+                outcomes[idx] = (None, e)
+    return outcomes
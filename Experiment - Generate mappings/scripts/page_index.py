@@ -0,0 +1,80 @@
+"""
+Inverted character n-gram index over a book's page texts.
+
+Finding the page a chapter title is printed on used to mean normalizing and
+searching every page of a window around the ToC page number, once per
+chapter. PageTextIndex normalizes every page once and maps each character
+trigram to the pages containing it. A phrase query intersects the postings of
+the phrase's rarest trigrams and only checks the surviving pages for the
+whole phrase, so it returns exactly the pages a linear substring scan would,
+for a fraction of the work.
+"""
+
+import re
+from typing import Dict, Iterable, List, Optional, Tuple
+
+# Characters per n-gram; short enough for short titles, long enough to be selective
+NGRAM_SIZE = 3
+
+
+def normalize(s: str) -> str:
+    """Collapse whitespace and lowercase; book_index re-exports this for ToC and title matching."""
+    return re.sub(r"\s+", " ", (s or "").strip()).lower()
+
+
+class PageTextIndex:
+    """
+    Normalized page texts plus an n-gram -> pages inverted index.
+
+    Args:
+        page_texts: 1-based page number -> raw page text
+        n: n-gram size in characters
+    """
+
+    def __init__(self, page_texts: Dict[int, str], n: int = NGRAM_SIZE):
+        self.n = n
+        self.texts: Dict[int, str] = {page: normalize(text) for page, text in page_texts.items()}
+        postings: Dict[str, List[int]] = {}
+        for page in sorted(self.texts):
+            for gram in self._grams(self.texts[page]):
+                postings.setdefault(gram, []).append(page)
+        # Tuples keep the postings compact once built
+        self._postings: Dict[str, Tuple[int, ...]] = {gram: tuple(pages) for gram, pages in postings.items()}
+
+    def _grams(self, text: str) -> Iterable[str]:
+        return {text[i:i + self.n] for i in range(len(text) - self.n + 1)}
+
+    def page_numbers(self) -> List[int]:
+        return sorted(self.texts)
+
+    def pages_with(self, phrase: str, first: Optional[int] = None, last: Optional[int] = None) -> List[int]:
+        """
+        Pages whose normalized text contains the normalized phrase, ascending.
+
+        Args:
+            phrase: Text to look for (normalized like the pages)
+            first: Lowest page returned
+            last: Highest page returned
+        """
+        query = normalize(phrase)
+        if not query:
+            return []
+        if len(query) < self.n:
+            candidates = set(self.texts)
+        else:
+            grams = sorted(self._grams(query), key=lambda gram: len(self._postings.get(gram, ())))
+            candidates = set(self._postings.get(grams[0], ()))
+            for gram in grams[1:]:
+                if not candidates:
+                    break
+                candidates.intersection_update(self._postings.get(gram, ()))
+        return sorted(
+            page for page in candidates
+            if (first is None or page >= first) and (last is None or page <= last) and query in self.texts[page]
+        )
+
+    def first_page_with(self, phrases: Iterable[str], first: Optional[int] = None,
+                        last: Optional[int] = None) -> Optional[int]:
+        """Lowest page in [first, last] containing any of the phrases."""
+        hits = [pages[0] for pages in (self.pages_with(phrase, first, last) for phrase in phrases) if pages]
+        return min(hits) if hits else None
@@ -0,0 +1,181 @@
+"""
+Pluggable page-text extraction for the DI book.
+
+Plain prose pages are read with a fast text backend (pypdfium2, which ships with
+pdfplumber, or PyPDF2). Pages that need layout analysis -- the Teacher/Students
+format tables and the instructional-sequence tables -- are escalated to
+pdfplumber, retrying with different x_tolerance/y_tolerance settings if the
+default extraction fails or comes back empty.
+"""
+
+import re
+import threading
+from typing import Dict, List, Optional, Tuple
+
+import pdfplumber
+
+try:
+    import pypdfium2 as pdfium
+except ImportError:  # pdfplumber normally installs it
+    pdfium = None
+
+try:
+    import PyPDF2
+except ImportError:
+    PyPDF2 = None
+
+# pdfium is not thread-safe, so every call into it goes through this lock
+_pdfium_lock = threading.Lock()
+
+# pdfplumber settings tried in order for layout pages
+PDFPLUMBER_TOLERANCE_RETRIES: List[Dict] = [
+    {},
+    {"x_tolerance": 1.5, "y_tolerance": 2},
+    {"x_tolerance": 5, "y_tolerance": 5},
+]
+
+# Text patterns that mark a page as needing layout analysis
+LAYOUT_PAGE_RE = re.compile(
+    r"\bFORMAT\s+\d+\.\d+\b|\bTEACHER\b.*\bSTUDENTS\b|\bPerformance\s+Indicator\b",
+    re.IGNORECASE | re.DOTALL,
+)
+
+FAST_BACKENDS = ("pypdfium2", "pypdf2")
+
+
+def needs_layout_analysis(text: str) -> bool:
+    """Return True if fast-backend text looks like a table or format page."""
+    if not text or not text.strip():
+        return True
+    printable = sum(1 for ch in text if ch.isprintable() or ch.isspace())
+    if printable / len(text) < 0.95:
+        return True
+    return bool(LAYOUT_PAGE_RE.search(text))
+
+
+class PageTextEngine:
+    """
+    Page-text extractor that tries a fast backend first and escalates to pdfplumber.
+
+    Args:
+        pdf_path: Path to the PDF file
+        fast_backend: "pypdfium2", "pypdf2" or None to always use pdfplumber
+        plumber_pdf: Already-open pdfplumber PDF to reuse (opened lazily otherwise)
+    """
+
+    def __init__(self, pdf_path: str, fast_backend: Optional[str] = "pypdfium2", plumber_pdf=None):
+        self.pdf_path = pdf_path
+        self.fast_backend = fast_backend if fast_backend in FAST_BACKENDS else None
+        self._plumber_pdf = plumber_pdf
+        self._owns_plumber_pdf = plumber_pdf is None
+        self._pdfium_doc = None
+        self._pypdf2_reader = None
+        self.stats = {"fast": 0, "escalated": 0, "layout_failed": 0}
+
+        if self.fast_backend == "pypdfium2" and pdfium is None:
+            self.fast_backend = "pypdf2" if PyPDF2 is not None else None
+        if self.fast_backend == "pypdf2" and PyPDF2 is None:
+            self.fast_backend = None
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+    def close(self):
+        if self._pdfium_doc is not None:
+            with _pdfium_lock:
+                self._pdfium_doc.close()
+            self._pdfium_doc = None
+        if self._plumber_pdf is not None and self._owns_plumber_pdf:
+            self._plumber_pdf.close()
+            self._plumber_pdf = None
+
+    @property
+    def plumber_pdf(self):
+        if self._plumber_pdf is None:
+            self._plumber_pdf = pdfplumber.open(self.pdf_path)
+        return self._plumber_pdf
+
+    def release_page(self, page_number: int) -> None:
+        """Drop pdfplumber's cached objects for a page once it has been processed."""
+        if self._plumber_pdf is None:
+            return
+        page = self._plumber_pdf.pages[page_number - 1]
+        close = getattr(page, "close", None) or getattr(page, "flush_cache", None)
+        if close is not None:
+            close()
+
+    def page_count(self) -> int:
+        return len(self.plumber_pdf.pages)
+
+    def extract_fast(self, page_number: int) -> str:
+        """Extract a page (1-based) with the fast backend."""
+        if self.fast_backend == "pypdfium2":
+            with _pdfium_lock:
+                if self._pdfium_doc is None:
+                    self._pdfium_doc = pdfium.PdfDocument(self.pdf_path)
+                page = self._pdfium_doc[page_number - 1]
+                textpage = page.get_textpage()
+                try:
+                    text = textpage.get_text_range()
+                finally:
+                    textpage.close()
+                    page.close()
+            return text.replace("\r\n", "\n").replace("\r", "\n")
+        if self.fast_backend == "pypdf2":
+            if self._pypdf2_reader is None:
+                self._pypdf2_reader = PyPDF2.PdfReader(self.pdf_path)
+            return self._pypdf2_reader.pages[page_number - 1].extract_text() or ""
+        raise ValueError("No fast backend available")
+
+    def extract_layout(self, page_number: int) -> str:
+        """Extract a page (1-based) with pdfplumber, retrying different tolerances."""
+        page = self.plumber_pdf.pages[page_number - 1]
+        last_error = None
+        for settings in PDFPLUMBER_TOLERANCE_RETRIES:
+            try:
+                text = page.extract_text(**settings)
+            except Exception as e:
+                last_error = e
+                continue
+            if text:
+                return text
+        if last_error is not None:
+            raise last_error
+        return ""
+
+    def extract(self, page_number: int, needs_layout: bool = False) -> Tuple[str, str]:
+        """
+        Extract a page's text, escalating to pdfplumber only when needed.
+
+        Args:
+            page_number: 1-based PDF page number
+            needs_layout: Skip the fast backend (e.g. known table pages)
+
+        Returns:
+            Tuple of (text, backend used)
+        """
+        if self.fast_backend and not needs_layout:
+            try:
+                text = self.extract_fast(page_number)
+                if not needs_layout_analysis(text):
+                    self.stats["fast"] += 1
+                    return text, self.fast_backend
+            except Exception:
+                pass
+
+        try:
+            text = self.extract_layout(page_number)
+            self.stats["escalated"] += 1
+            return text, "pdfplumber"
+        except Exception:
+            self.stats["layout_failed"] += 1
+            # Last resort: whatever the fast backend produced, even if it looked like a table
+            if self.fast_backend:
+                try:
+                    return self.extract_fast(page_number), self.fast_backend
+                except Exception:
+                    pass
+            raise
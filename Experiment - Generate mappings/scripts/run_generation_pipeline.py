@@ -0,0 +1,247 @@
+#!/usr/bin/env python3
+"""
+Run sequence generation and format generation as one overlapping pipeline.
+
+Sequence batches are generated on a thread pool. As soon as a substandard's
+sequences validate (and every substandard before it has been settled), it is
+checked for near-duplicates and put on a queue that format workers consume,
+so formats for early substandards are generated while later sequences are
+still in flight. Both output files are assembled in the same order as
+generate_sequences.py followed by generate_formats_for_new_sequences.py, so
+the artifacts match running the two stages one after the other. Format
+reuse decisions follow that same order: each substandard's formats are
+announced to the reuse cache when it is queued, and a format only reuses DI
+formats or formats from earlier substandards (waiting for those still being
+generated), so --format-workers does not change what is reused.
+"""
+
+import os
+import queue
+import argparse
+import threading
+from concurrent.futures import ThreadPoolExecutor, as_completed
+from dotenv import load_dotenv
+
+from llm_concurrency import RateLimiter
+from format_reuse import FormatReuseCache
+from format_graph import FormatLinkGraph
+from format_parts import PART_RETRIES
+from generate_sequences import (
+    iter_mappings,
+    load_di_formats,
+    load_prompt_template,
+    get_substandards_needing_sequences,
+    get_exemplar_sequences,
+    build_exemplar_index,
+    group_substandards_by_domain,
+    generate_batch_results,
+    record_sequence_outcome,
+    build_duplicate_index,
+    new_duplicate_summary,
+    flag_result_duplicates,
+    save_generated_sequences,
+)
+from generate_formats_for_new_sequences import (
+    generate_substandard_formats,
+    expect_substandard_formats,
+    reuse_key,
+    assemble_format_outputs,
+    save_generated_formats,
+)
+
+load_dotenv()
+
+_STOP = object()
+
+
+def format_worker(work_queue: queue.Queue, format_outputs: dict, format_graph: FormatLinkGraph, template: str,
+                  limiter: RateLimiter, retries: int, reuse_cache: FormatReuseCache = None,
+                  adapt_template: str = None, format_settings: dict = None) -> None:
+    """Consume (position, result) items until the stop marker and store their format outputs by position."""
+    while True:
+        item = work_queue.get()
+        if item is _STOP:
+            return
+        position, result = item
+        try:
+            format_outputs[position] = generate_substandard_formats(
+                result,
+                format_graph,
+                template,
+                limiter=limiter,
+                retries=retries,
+                reuse_cache=reuse_cache,
+                adapt_template=adapt_template,
+                position=position,
+                **(format_settings or {})
+            )
+        except Exception as e:
+            print(f"❌ Format generation failed for {result['substandard_id']}: {e}")
+            format_outputs[position] = []
+            if reuse_cache is not None:
+                for sequence in result['generated_sequences']:
+                    reuse_cache.discard(reuse_key(result, sequence))
+
+
+def main():
+    """Main execution function."""
+
+    parser = argparse.ArgumentParser(description="Generate sequences and their formats in one streaming pipeline")
+    parser.add_argument("--sequence-workers", type=int, default=2, help="Concurrent sequence generation calls")
+    parser.add_argument("--format-workers", type=int, default=2, help="Concurrent format generation workers")
+    parser.add_argument("--rpm", type=float, default=30, help="Max Gemini requests per minute across both stages (0 = unlimited)")
+    parser.add_argument("--retries", type=int, default=2, help="Retries per sequence generation call")
+    parser.add_argument("--format-retries", type=int, default=0, help="Retries per format generation call")
+    parser.add_argument("--exemplar-token-budget", type=int, default=800, help="Max tokens of exemplar sequences per prompt")
+    parser.add_argument("--max-exemplars", type=int, default=8, help="Max exemplar sequences per prompt")
+    parser.add_argument("--duplicate-threshold", type=float, default=0.8, help="Shingle Jaccard similarity at which a generated sequence is linked as a near-duplicate")
+    parser.add_argument("--reuse-threshold", type=float, default=0.9, help="Problem-type similarity at which an earlier or DI format is reused unchanged")
+    parser.add_argument("--adapt-threshold", type=float, default=0.6, help="Problem-type similarity at which a similar format is adapted with a cheaper prompt")
+    parser.add_argument("--no-format-reuse", action="store_true", help="Always generate formats from scratch")
+    parser.add_argument("--format-exemplar-token-budget", type=int, default=3000, help="Max tokens of exemplar formats per prompt")
+    parser.add_argument("--max-format-exemplars", type=int, default=3, help="Max exemplar formats per prompt")
+    parser.add_argument("--per-part", action="store_true", help="Generate each format as an outline plus parallel per-part calls")
+    parser.add_argument("--part-retries", type=int, default=PART_RETRIES, help="Retries per outline/part call with --per-part")
+    parser.add_argument("--batch-size", type=int, default=1, help="Substandards per sequence call, grouped by domain prefix")
+    parser.add_argument("--boundary-retries", type=int, default=1, help="Regenerations with feedback for sequences that break the assessment boundary, before they are rejected")
+    parser.add_argument("--no-boundary-check", action="store_true", help="Skip the local assessment-boundary checks")
+    parser.add_argument("--output-format", choices=["json", "jsonl"], default="json", help="Write one JSON file or a directory of JSONL shards with an index")
+    parser.add_argument("--compression", choices=["gzip", "zstd"], default=None, help="Compress JSONL shards")
+    args = parser.parse_args()
+
+    print("="*80)
+    print("DI GENERATION PIPELINE - SEQUENCES → FORMATS")
+    print("="*80)
+
+    # Check API key
+    api_key = os.getenv('GEMINI_API_KEY')
+    if not api_key:
+        print("❌ GEMINI_API_KEY not found in environment")
+        return
+
+    # Load data
+    print("\n📥 Loading data...")
+    di_data = load_di_formats()
+
+    needs_sequences = get_substandards_needing_sequences(iter_mappings(), threshold=1)
+    print(f"Found {len(needs_sequences)} substandards needing sequences (0 matches)")
+
+    exemplar_index = build_exemplar_index(get_exemplar_sequences(di_data, grade=3))
+    format_graph = FormatLinkGraph(di_data)
+    format_settings = {
+        "exemplar_token_budget": args.format_exemplar_token_budget,
+        "max_exemplars": args.max_format_exemplars,
+        "part_templates": (load_prompt_template("format_outline"), load_prompt_template("format_part_steps")) if args.per_part else None,
+        "part_retries": args.part_retries,
+    }
+
+    sequence_template = load_prompt_template("sequence_generation")
+    batch_template = load_prompt_template("sequence_generation_batch") if args.batch_size > 1 else None
+    boundary_template = None if args.no_boundary_check else load_prompt_template("sequence_boundary_feedback")
+    format_template = load_prompt_template("format_generation")
+    adapt_template = load_prompt_template("format_adaptation")
+
+    reuse_cache = None
+    if not args.no_format_reuse:
+        reuse_cache = FormatReuseCache(args.reuse_threshold, args.adapt_threshold)
+        reuse_cache.add_di_formats(di_data)
+
+    # One limiter for both stages so overlapping them never exceeds the request budget
+    limiter = RateLimiter(args.rpm)
+    duplicate_index = build_duplicate_index(di_data)
+    near_duplicates = new_duplicate_summary(args.duplicate_threshold)
+
+    work_queue = queue.Queue()
+    format_outputs = {}
+    workers = [
+        threading.Thread(
+            target=format_worker,
+            args=(work_queue, format_outputs, format_graph, format_template, limiter, args.format_retries,
+                  reuse_cache, adapt_template, format_settings),
+            daemon=True
+        )
+        for _ in range(max(1, args.format_workers))
+    ]
+    for worker in workers:
+        worker.start()
+
+    batches = group_substandards_by_domain(needs_sequences, args.batch_size)
+    print(f"\n🔨 Generating {len(needs_sequences)} substandards in {len(batches)} calls; formats start as sequences validate...")
+
+    settings = {
+        "limiter": limiter,
+        "retries": args.retries,
+        "token_budget": args.exemplar_token_budget,
+        "max_exemplars": args.max_exemplars,
+        # Boundary checks run inside the sequence workers, before anything is queued for formats
+        "boundary_template": boundary_template,
+        "boundary_retries": args.boundary_retries,
+    }
+
+    # Substandards are released to the queue in needs_sequences order, so
+    # near-duplicate links and format numbering match a sequential run
+    outcomes_by_id = {}
+    results = []
+    failures = []
+    next_position = 0
+
+    with ThreadPoolExecutor(max_workers=max(1, args.sequence_workers)) as executor:
+        futures = {
+            executor.submit(generate_batch_results, batch, exemplar_index, sequence_template, batch_template, **settings): batch
+            for batch in batches
+        }
+        for future in as_completed(futures):
+            batch = futures[future]
+            try:
+                outcomes_by_id.update(future.result())
+            except Exception as e:
+                for substandard in batch:
+                    outcomes_by_id[substandard['substandard_id']] = (None, e)
+
+            while next_position < len(needs_sequences) and needs_sequences[next_position]['substandard_id'] in outcomes_by_id:
+                substandard = needs_sequences[next_position]
+                result, error = outcomes_by_id.pop(substandard['substandard_id'])
+                next_position += 1
+                record_sequence_outcome(substandard, result, error, results, failures, f"[{next_position}/{len(needs_sequences)}]")
+                if result is not None:
+                    flag_result_duplicates(result, duplicate_index, args.duplicate_threshold, near_duplicates)
+                    expect_substandard_formats(reuse_cache, result, len(results) - 1)
+                    work_queue.put((len(results) - 1, result))
+
+    for _ in workers:
+        work_queue.put(_STOP)
+    for worker in workers:
+        worker.join()
+
+    if not results and not failures:
+        print("\n⚠️  No sequences were generated")
+        return
+
+    artifact_options = {"output_format": args.output_format, "compression": args.compression}
+    sequences_path = save_generated_sequences(results, failures=failures, near_duplicates=near_duplicates, **artifact_options)
+
+    print("\n📝 Assembling formats in output order...")
+    format_results, skipped_duplicates = assemble_format_outputs(
+        [(result, format_outputs.get(position, [])) for position, result in enumerate(results)]
+    )
+    format_reuse = reuse_cache.summary() if reuse_cache is not None else None
+    formats_path = None
+    if format_results:
+        formats_path = save_generated_formats(format_results, skipped_duplicates=skipped_duplicates, format_reuse=format_reuse, **artifact_options)
+
+    print(f"\n{'='*80}")
+    print("SUMMARY")
+    print(f"{'='*80}")
+    print(f"Substandards with sequences: {len(results)}")
+    print(f"Substandards failed: {len(failures)}")
+    print(f"Sequences generated: {sum(len(r['generated_sequences']) for r in results)}")
+    print(f"Sequences rejected for breaking the assessment boundary: {sum(len(r.get('boundary_rejections', [])) for r in results)}")
+    print(f"Near-duplicates linked: {near_duplicates['duplicates_of_di']} of DI, {near_duplicates['duplicates_of_generated']} of generated")
+    print(f"Formats generated: {len(format_results)}")
+    if format_reuse:
+        print(f"Format reuse: {format_reuse['reused']} reused, {format_reuse['adapted']} adapted, {format_reuse['generated']} generated (reuse rate {format_reuse['reuse_rate']:.0%})")
+    print(f"Sequences output: {sequences_path}")
+    print(f"Formats output: {formats_path or 'none (no formats generated)'}")
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,187 @@
+"""
+Local text-similarity helpers for the generation scripts.
+
+TfidfIndex precomputes TF-IDF vectors for a fixed set of documents (e.g. all DI
+exemplar sequences) once, then ranks them against a query by cosine
+similarity. MinHashIndex finds near-duplicate texts (e.g. a generated sequence
+that restates an existing one) with MinHash signatures over character
+shingles and LSH banding. Everything is pure Python so no extra dependencies
+are needed.
+"""
+
+import re
+import json
+import math
+import random
+import zlib
+from collections import Counter
+from typing import Callable, Dict, List, Optional, Sequence, Tuple
+
+try:
+    import tiktoken
+    _encoding = tiktoken.get_encoding("cl100k_base")
+except Exception:  # tiktoken is optional; fall back to a characters-per-token estimate
+    _encoding = None
+
+STOPWORDS = {
+    "a", "an", "and", "are", "as", "at", "be", "by", "for", "from", "in", "into", "is", "it",
+    "of", "on", "or", "that", "the", "their", "this", "to", "using", "with", "within", "e", "g",
+    "students", "student", "grade", "problems", "problem",
+}
+
+
+def count_tokens(text: str) -> int:
+    """Count tokens with tiktoken when available, otherwise estimate ~4 characters per token."""
+    if _encoding is not None:
+        return len(_encoding.encode(text))
+    return max(1, len(text) // 4)
+
+
+def tokenize(text: str) -> List[str]:
+    """Lowercase word/number tokens with stopwords removed and a light plural strip."""
+    tokens = []
+    for token in re.findall(r"[a-z]+|\d+", (text or "").lower()):
+        if token in STOPWORDS:
+            continue
+        if len(token) > 4 and token.endswith("s") and not token.endswith("ss"):
+            token = token[:-1]
+        tokens.append(token)
+    return tokens
+
+
+class TfidfIndex:
+    """
+    Cosine-similarity index over a fixed document collection.
+
+    Args:
+        documents: Items to index
+        text_fn: Returns the text to index for an item
+    """
+
+    def __init__(self, documents: Sequence, text_fn: Callable[[object], str]):
+        self.documents = list(documents)
+        token_lists = [tokenize(text_fn(doc)) for doc in self.documents]
+        doc_freq = Counter(token for tokens in token_lists for token in set(tokens))
+        n_docs = len(self.documents)
+        self.idf = {token: math.log((1 + n_docs) / (1 + df)) + 1.0 for token, df in doc_freq.items()}
+        self.vectors = [self._vectorize(tokens) for tokens in token_lists]
+
+    def _vectorize(self, tokens: List[str]) -> Dict[str, float]:
+        counts = Counter(tokens)
+        vector = {token: (1 + math.log(tf)) * self.idf.get(token, 0.0) for token, tf in counts.items()}
+        norm = math.sqrt(sum(w * w for w in vector.values()))
+        return {token: w / norm for token, w in vector.items() if w} if norm else {}
+
+    def rank(self, query: str, limit: Optional[int] = None) -> List[Tuple[float, object]]:
+        """Return (score, document) pairs for the query, best first, ties in index order."""
+        query_vector = self._vectorize(tokenize(query))
+        scored = []
+        for idx, vector in enumerate(self.vectors):
+            score = sum(w * vector.get(token, 0.0) for token, w in query_vector.items())
+            scored.append((score, idx))
+        scored.sort(key=lambda x: (-x[0], x[1]))
+        if limit is not None:
+            scored = scored[:limit]
+        return [(score, self.documents[idx]) for score, idx in scored]
+
+
+def select_within_token_budget(ranked: Sequence, token_budget: int, max_items: Optional[int] = None,
+                               render: Callable[[object], str] = lambda item: json.dumps(item, indent=2)) -> List:
+    """
+    Take ranked items in order until the rendered items would exceed the token budget.
+
+    The first item is always kept so a prompt never ends up with no exemplar.
+    """
+    selected = []
+    used = 0
+    for item in ranked:
+        if max_items is not None and len(selected) >= max_items:
+            break
+        cost = count_tokens(render(item))
+        if selected and used + cost > token_budget:
+            break
+        selected.append(item)
+        used += cost
+    return selected
+
+
+# ============================================================================
+# Near-duplicate detection
+# ============================================================================
+
+_MERSENNE_PRIME = (1 << 61) - 1
+
+
+def shingles(text: str, size: int = 5) -> set:
+    """Character shingles of the lowercased, whitespace-collapsed text."""
+    normalized = re.sub(r"\s+", " ", (text or "").lower()).strip()
+    if len(normalized) <= size:
+        return {normalized} if normalized else set()
+    return {normalized[i:i + size] for i in range(len(normalized) - size + 1)}
+
+
+def jaccard(a: set, b: set) -> float:
+    if not a and not b:
+        return 1.0
+    return len(a & b) / len(a | b)
+
+
+class MinHashIndex:
+    """
+    LSH index of MinHash signatures for finding near-duplicate texts.
+
+    Args:
+        num_perm: Number of hash permutations per signature
+        bands: LSH bands (num_perm must be divisible by bands); more bands
+            find lower-similarity candidates
+        shingle_size: Character shingle length
+        seed: Seed for the permutations, so signatures are stable across runs
+    """
+
+    def __init__(self, num_perm: int = 64, bands: int = 16, shingle_size: int = 5, seed: int = 1):
+        if num_perm % bands:
+            raise ValueError("num_perm must be divisible by bands")
+        self.num_perm = num_perm
+        self.bands = bands
+        self.rows = num_perm // bands
+        self.shingle_size = shingle_size
+        rng = random.Random(seed)
+        self._perms = [(rng.randrange(1, _MERSENNE_PRIME), rng.randrange(0, _MERSENNE_PRIME)) for _ in range(num_perm)]
+        self._buckets: List[Dict[Tuple, List]] = [{} for _ in range(bands)]
+        self._shingles: Dict[object, set] = {}
+
+    def signature(self, shingle_set: set) -> List[int]:
+        hashes = [zlib.crc32(sh.encode("utf-8")) for sh in shingle_set]
+        if not hashes:
+            return [0] * self.num_perm
+        return [min((a * h + b) % _MERSENNE_PRIME for h in hashes) for a, b in self._perms]
+
+    def _band_keys(self, signature: List[int]):
+        for band in range(self.bands):
+            yield band, tuple(signature[band * self.rows:(band + 1) * self.rows])
+
+    def add(self, key, text: str) -> None:
+        """Index a text under a key (keys must be unique and hashable)."""
+        shingle_set = shingles(text, self.shingle_size)
+        self._shingles[key] = shingle_set
+        for band, band_key in self._band_keys(self.signature(shingle_set)):
+            self._buckets[band].setdefault(band_key, []).append(key)
+
+    def query(self, text: str, threshold: float = 0.7) -> List[Tuple[float, object]]:
+        """
+        Return (jaccard, key) for indexed texts at least threshold-similar, best first.
+
+        LSH only proposes candidates; each one is confirmed with the exact
+        Jaccard similarity of the shingle sets.
+        """
+        shingle_set = shingles(text, self.shingle_size)
+        candidates = set()
+        for band, band_key in self._band_keys(self.signature(shingle_set)):
+            candidates.update(self._buckets[band].get(band_key, []))
+        matches = []
+        for key in candidates:
+            score = jaccard(shingle_set, self._shingles[key])
+            if score >= threshold:
+                matches.append((score, key))
+        matches.sort(key=lambda x: (-x[0], str(x[1])))
+        return matches
@@ -1,16 +1,21 @@
 import os
-import re
 import json
 import argparse
 import random
 from datetime import datetime
-from typing import List, Dict, Optional, Tuple
+from typing import Callable, List, Dict, Optional, Tuple
 
 import pdfplumber
 from pydantic import BaseModel
 from google import genai
 from dotenv import load_dotenv
 
+from book_index import parse_toc_entries
+from build_book_index import load_book_index
+from artifacts import JsonlCheckpoint, get_di_formats_path, iter_di_skills, open_artifact
+from llm_concurrency import RateLimiter, call_with_retries, run_ordered
+from chapter_matcher import ChapterMatcher, agreement_report
+
 
 class ChapterPick(BaseModel):
     chapter_title: str
@@ -37,81 +42,32 @@ def extract_pages_text(pdf_path: str, start_page: int, end_page: int) -> str:
     return "\n".join(parts)
 
 
-def parse_toc_entries(toc_text: str) -> List[Dict]:
-    entries: List[Dict] = []
-    # Heuristic: lines that end with a page number (1-4 digits)
-    line_re = re.compile(r"^(?P<title>.*?\S)\s+\.?\s*(?P<page>\d{1,4})\s*$")
-    raw_entries: List[Dict] = []
-    for raw_line in toc_text.splitlines():
-        line = raw_line.strip()
-        if not line:
-            continue
-        m = line_re.match(line)
-        if not m:
-            continue
-        title = m.group("title")
-        try:
-            page = int(m.group("page"))
-        except ValueError:
-            continue
-        if len(title) < 3:
-            continue
-        raw_entries.append({"title": title, "start_page": page})
-
-    # Sort and dedupe
-    seen = set()
-    raw_entries.sort(key=lambda x: x["start_page"])
-    filtered: List[Dict] = []
-    for e in raw_entries:
-        key = (e["title"], e["start_page"]) 
-        if key in seen:
-            continue
-        seen.add(key)
-        filtered.append(e)
-
-    # Group subtopics under nearest preceding Chapter/Appendix
-    def is_chapter_title(t: str) -> bool:
-        t_norm = t.lower()
-        return (
-            t_norm.startswith("chapter ") or
-            t_norm.startswith("appendix ") or
-            t_norm in {"glossary", "references", "index"}
-        )
+# Rough response tokens per batched pick: title, page, confidence, one-sentence reasoning and JSON keys
+PICK_RESPONSE_TOKENS = 120
 
-    grouped: List[Dict] = []
-    current: Optional[Dict] = None
-    for e in filtered:
-        title = e["title"]
-        if is_chapter_title(title):
-            # Start a new chapter bucket
-            if current is not None:
-                grouped.append(current)
-            current = {
-                "chapter_title": title,
-                "start_page": e["start_page"],
-                "subtopics": []
-            }
-        else:
-            # Subtopic: attach to current if exists
-            if current is None:
-                # If ToC starts mid-section, create a generic bucket
-                current = {
-                    "chapter_title": "(Unlabeled Section)",
-                    "start_page": e["start_page"],
-                    "subtopics": []
-                }
-            current["subtopics"].append({
-                "title": title,
-                "start_page": e["start_page"]
-            })
 
-    if current is not None:
-        grouped.append(current)
+class ItemChapterPick(ChapterPick):
+    item: int
+
 
-    return grouped
+class BatchChapterPicks(BaseModel):
+    picks: List[ItemChapterPick]
 
 
-def llm_pick_chapter(format_item: Dict, toc_entries: List[Dict], toc_text: str) -> ChapterPick:
+def make_client() -> genai.Client:
+    # Ensure API key is configured (support both env var names)
+    load_dotenv()
+    api_key = os.getenv("GEMINI_API_KEY") or os.getenv("GOOGLE_API_KEY")
+    if api_key:
+        return genai.Client(api_key=api_key)
+    # Let the client try environment-based auth, but provide a clearer error if missing
+    try:
+        return genai.Client()
+    except Exception as e:
+        raise RuntimeError("Google GenAI API key not found. Set GEMINI_API_KEY or GOOGLE_API_KEY in .env") from e
+
+
+def toc_prompt_block(toc_entries: List[Dict], toc_text: str) -> str:
     # Prepare grouped list of chapters with subtopics
     def chapter_line(e: Dict) -> str:
         subs = e.get("subtopics", [])
@@ -122,10 +78,45 @@ def llm_pick_chapter(format_item: Dict, toc_entries: List[Dict], toc_text: str)
         )
 
     chapters_list = "\n".join([chapter_line(e) for e in toc_entries[:50]])
+    block = f"""
+Table of contents (subset):
+{chapters_list}
+
+Full ToC text (for nuance; prefer choosing from the list above):
+"""
+    return block + toc_text[:12000]  # safety cap
+
 
+def format_summary(format_item: Dict) -> Tuple[str, str, str]:
+    """(skill, problem_type, title) of a generated format."""
     format_title = format_item.get("generated_format", {}).get("title") or format_item.get("problem_type")
-    skill = format_item.get("skill")
-    problem_type = format_item.get("problem_type")
+    return format_item.get("skill"), format_item.get("problem_type"), format_title
+
+
+def generate_structured(client: genai.Client, prompt: str, schema):
+    response = client.models.generate_content(
+        model="gemini-2.5-pro",
+        contents=prompt,
+        config={
+            "response_mime_type": "application/json",
+            "response_schema": schema,
+        },
+    )
+    try:
+        json_text = response.candidates[0].content.parts[0].text
+        return schema.model_validate_json(json_text)
+    except Exception as e:
+        # Fallback: try reading full text
+        try:
+            raw = getattr(response, "text", None) or str(response)
+            return schema.model_validate_json(raw)
+        except Exception:
+            raise
+
+
+def llm_pick_chapter(format_item: Dict, toc_entries: List[Dict], toc_text: str,
+                     client: Optional[genai.Client] = None) -> ChapterPick:
+    skill, problem_type, format_title = format_summary(format_item)
 
     prompt = f"""
 You are given:
@@ -136,13 +127,8 @@ Task:
 - Pick the single most relevant chapter/section title from the list that best matches the format.
 - If possible, include the starting page number from the list.
 - Return JSON matching the schema exactly.
-
-Table of contents (subset):
-{chapters_list}
-
-Full ToC text (for nuance; prefer choosing from the list above):
 """
-    prompt += toc_text[:12000]  # safety cap
+    prompt += toc_prompt_block(toc_entries, toc_text)
     prompt += f"""
 
 Format summary:
@@ -154,83 +140,313 @@ Respond with:
 {{"chapter_title": string, "start_page": number|null, "confidence": number, "reasoning": string}}
 Confidence should be between 0 and 1.
 """
+    return generate_structured(client or make_client(), prompt, ChapterPick)
 
-    # Ensure API key is configured (support both env var names)
-    load_dotenv()
-    api_key = os.getenv("GEMINI_API_KEY") or os.getenv("GOOGLE_API_KEY")
-    if api_key:
-        client = genai.Client(api_key=api_key)
-    else:
-        # Let the client try environment-based auth, but provide a clearer error if missing
-        try:
-            client = genai.Client()
-        except Exception as e:
-            raise RuntimeError("Google GenAI API key not found. Set GEMINI_API_KEY or GOOGLE_API_KEY in .env") from e
-    response = client.models.generate_content(
-        model="gemini-2.5-pro",
-        contents=prompt,
-        config={
-            "response_mime_type": "application/json",
-            "response_schema": ChapterPick,
-        },
+
+def llm_pick_chapters(format_items: List[Dict], toc_entries: List[Dict], toc_text: str,
+                      client: Optional[genai.Client] = None) -> Dict[int, ChapterPick]:
+    """
+    Pick chapters for several formats in one call; the ToC is sent once.
+
+    Returns:
+        Position in format_items -> pick, for every item the response covered
+        (unknown or repeated item numbers are ignored)
+    """
+    lines = []
+    for n, format_item in enumerate(format_items, 1):
+        skill, problem_type, format_title = format_summary(format_item)
+        lines.append(f"{n}. Skill: {skill} | Problem Type: {problem_type} | Title: {format_title}")
+
+    prompt = f"""
+You are given:
+1) A list of chapter or section entries (with starting pages) extracted from the book's table of contents.
+2) A numbered list of generated instructional formats (skill + problem_type + title).
+
+Task:
+- For EACH numbered format, pick the single most relevant chapter/section title from the list that best matches it.
+- If possible, include the starting page number from the list.
+- Return JSON matching the schema exactly, with one pick per format.
+"""
+    prompt += toc_prompt_block(toc_entries, toc_text)
+    prompt += """
+
+Formats:
+""" + "\n".join(lines) + """
+
+Respond with:
+{"picks": [{"item": number, "chapter_title": string, "start_page": number|null, "confidence": number, "reasoning": string}, ...]}
+"item" is the format's number in the list above. Confidence should be between 0 and 1. Keep each reasoning to one short sentence.
+"""
+    response = generate_structured(client or make_client(), prompt, BatchChapterPicks)
+    picks: Dict[int, ChapterPick] = {}
+    for pick in response.picks:
+        position = pick.item - 1
+        if 0 <= position < len(format_items) and position not in picks:
+            picks[position] = ChapterPick(**pick.model_dump(exclude={"item"}))
+    return picks
+
+
+def batch_size_for_response_limit(requested: int, max_response_tokens: int) -> int:
+    """Largest batch, up to requested, whose picks fit within the response token limit."""
+    return max(1, min(requested, max_response_tokens // PICK_RESPONSE_TOKENS))
+
+
+def pick_chapters_batched(items: List[Dict], toc_entries: List[Dict], toc_text: str, client: genai.Client,
+                          batch_size: int, workers: int = 1, limiter: Optional[RateLimiter] = None,
+                          on_pick: Optional[Callable[[int, ChapterPick], None]] = None
+                          ) -> List[Tuple[Optional[ChapterPick], Optional[Exception]]]:
+    """
+    Pick chapters for all items, batch_size formats per call.
+
+    Batches run workers at a time. A batch whose response fails (e.g.
+    truncated at the response limit) is split in half and retried in the next
+    round, and every batch of that round shrinks to the same size. Items a
+    response leaves out are retried in the next round in batches half the
+    size of the one that dropped them, so a response that keeps leaving them
+    out ends in single calls. Single items use llm_pick_chapter, retried with
+    backoff, and fail once those retries run out.
+
+    Args:
+        on_pick: Called with (position, pick) from the worker thread as soon as
+            an item is picked, e.g. to checkpoint it
+
+    Returns:
+        (pick, error) for every item, in input order
+    """
+    outcomes: List[Tuple[Optional[ChapterPick], Optional[Exception]]] = [(None, None)] * len(items)
+    def chunks(positions: List[int], size: int) -> List[List[int]]:
+        return [positions[start:start + size] for start in range(0, len(positions), size)]
+
+    def pick_batch(positions: List[int]) -> Dict[int, ChapterPick]:
+        if len(positions) == 1:
+            picks = {0: call_with_retries(llm_pick_chapter, items[positions[0]], toc_entries, toc_text, client,
+                                          limiter=limiter, label=f"[format {positions[0]}] ")}
+        else:
+            if limiter is not None:
+                limiter.wait()
+            picks = llm_pick_chapters([items[p] for p in positions], toc_entries, toc_text, client)
+        if on_pick is not None:
+            for n, pick in picks.items():
+                if n < len(positions):
+                    on_pick(positions[n], pick)
+        return picks
+
+    pending = chunks(list(range(len(items))), batch_size)
+    calls = 0
+    while pending:
+        calls += len(pending)
+        retry: List[List[int]] = []
+        for positions, (picks, error) in zip(pending, run_ordered(pending, pick_batch, max_workers=workers)):
+            if error is not None:
+                if len(positions) == 1:
+                    outcomes[positions[0]] = (None, error)
+                    continue
+                batch_size = min(batch_size, len(positions) // 2)
+                print(f"⚠️  Batch of {len(positions)} failed ({error}); retrying in batches of {batch_size}")
+                retry.extend(chunks(positions, batch_size))
+                continue
+            missing = []
+            for n, position in enumerate(positions):
+                if n in picks:
+                    outcomes[position] = (picks[n], None)
+                else:
+                    missing.append(position)
+            if missing:
+                size = max(1, len(positions) // 2)
+                print(f"⚠️  Batch response left out {len(missing)}/{len(positions)} formats; retrying them in batches of {size}")
+                retry.extend(chunks(missing, size))
+            print(f"✅ Picked chapters for {len(positions) - len(missing)}/{len(positions)} formats")
+        pending = [chunk for batch in retry for chunk in chunks(batch, batch_size)]
+    print(f"{len(items)} formats mapped in {calls} calls")
+    return outcomes
+
+
+def load_skill_names() -> List[str]:
+    """DI skill names, or an empty list when the DI data is not available."""
+    if not os.path.exists(get_di_formats_path()):
+        print("⚠️  DI formats data not found; matching on titles only")
+        return []
+    return [name for name, _ in iter_di_skills()]
+
+
+def lexical_pick(match: Dict) -> ChapterPick:
+    chapter = match["chapter"]
+    return ChapterPick(
+        chapter_title=chapter["chapter_title"],
+        start_page=chapter.get("start_page"),
+        confidence=min(1.0, match["score"]),
+        reasoning=f"Lexical match (score {match['score']}, margin {match['margin']})",
     )
-    try:
-        json_text = response.candidates[0].content.parts[0].text
-        return ChapterPick.model_validate_json(json_text)
-    except Exception as e:
-        # Fallback: try reading full text
-        try:
-            raw = getattr(response, "text", None) or str(response)
-            return ChapterPick.model_validate_json(raw)
-        except Exception:
-            raise
+
+
+def format_result(item: Dict) -> Dict:
+    """The fields a stage 1 result keeps from its format."""
+    return {
+        "skill": item.get("skill"),
+        "problem_type": item.get("problem_type"),
+        "format_title": item.get("generated_format", {}).get("title"),
+    }
+
+
+def format_key(item: Dict) -> Tuple:
+    """Identify a format across stage 1 runs (results keep skill, problem type and title)."""
+    return (item.get("skill"), item.get("problem_type"), item.get("format_title"))
+
+
+def load_llm_picks(stage1_path: str) -> Dict[Tuple, str]:
+    """LLM-picked chapter titles from an earlier stage 1 output, by format_key."""
+    picks = {}
+    for result in open_artifact(stage1_path, "results"):
+        if result.get("pick") and result.get("source", "llm") == "llm":
+            picks[format_key(result)] = result["pick"]["chapter_title"]
+    return picks
 
 
 def main():
-    parser = argparse.ArgumentParser(description="Stage 1: Map up to N formats to likely chapters using ToC + LLM")
-    parser.add_argument("--generated", required=True, help="Path to generated_formats_*.json")
+    parser = argparse.ArgumentParser(description="Stage 1: Map generated formats to likely chapters using ToC + LLM")
+    parser.add_argument("--generated", required=True, help="Path to generated_formats_*.json or a sharded generated_formats_* directory")
     parser.add_argument("--pdf", required=True, help="Path to Direct_Instruction_Mathematics.pdf")
-    parser.add_argument("--toc_start", type=int, default=10, help="ToC start page (1-based)")
-    parser.add_argument("--toc_end", type=int, default=14, help="ToC end page (1-based, inclusive)")
-    parser.add_argument("--num", type=int, default=6, help="Max number of random formats to map")
-    parser.add_argument("--seed", type=int, default=42, help="Random seed")
+    parser.add_argument("--toc_start", type=int, default=None, help="ToC start page (1-based); default: the book index's")
+    parser.add_argument("--toc_end", type=int, default=None, help="ToC end page (1-based, inclusive); default: the book index's")
+    parser.add_argument("--index-dir", required=False, help="Directory of stored book indexes (default outputs/book_index)")
+    scope = parser.add_mutually_exclusive_group()
+    scope.add_argument("--all", action="store_true", help="Map every format (the default)")
+    scope.add_argument("--num", type=int, default=None, help="Map a random sample of N formats instead of all of them")
+    parser.add_argument("--seed", type=int, default=42, help="Random seed for --num")
+    parser.add_argument("--batch-size", type=int, default=20, help="Formats per LLM call (the ToC is sent once per call)")
+    parser.add_argument("--max-response-tokens", type=int, default=8000, help="Response token limit; caps the batch size")
+    parser.add_argument("--no-cascade", action="store_true", help="Send every format to the LLM instead of matching confident ones locally")
+    parser.add_argument("--min-score", type=float, default=0.2, help="Lowest lexical match score accepted without the LLM")
+    parser.add_argument("--min-margin", type=float, default=0.1, help="Lowest lexical lead over the runner-up chapter accepted without the LLM")
+    parser.add_argument("--validate", type=int, default=0, help="Also send N locally matched formats to the LLM and report agreement")
+    parser.add_argument("--compare-with", required=False, help="Earlier stage 1 output whose LLM picks are compared against local matches")
+    parser.add_argument("--workers", type=int, default=4, help="Concurrent LLM calls (1 = serial)")
+    parser.add_argument("--rpm", type=float, default=30, help="Max Gemini requests per minute across workers (0 = unlimited)")
     parser.add_argument("--out", required=False, help="Output prefix (without extension)")
+    parser.add_argument("--resume", action="store_true", help="Reuse picks checkpointed by an interrupted run with the same --out")
     args = parser.parse_args()
+    if args.resume and not args.out:
+        parser.error("--resume needs the --out prefix of the run to resume")
 
-    with open(args.generated, "r", encoding="utf-8") as f:
-        gen_data = json.load(f)
-    formats: List[Dict] = gen_data.get("generated_formats", [])
-    if not formats:
+    reader = open_artifact(args.generated, "generated_formats")
+    if not len(reader):
         raise RuntimeError("No generated_formats found in input JSON")
 
-    random.seed(args.seed)
-    sample = random.sample(formats, k=min(args.num, len(formats)))
-
-    toc_text = extract_pages_text(args.pdf, args.toc_start, args.toc_end)
-    toc_entries = parse_toc_entries(toc_text)
+    if args.num is None:
+        indices = list(range(len(reader)))
+        sample = list(reader)
+    else:
+        # Sampling positions picks the same formats as sampling the list, and only those records are read
+        random.seed(args.seed)
+        indices = random.sample(range(len(reader)), k=min(args.num, len(reader)))
+        sample = reader.records(indices)
+
+    if args.toc_start is None and args.toc_end is None:
+        # The ToC is parsed once per PDF by build_book_index.py
+        book = load_book_index(args.pdf, args.index_dir)
+        if book.get("error"):
+            raise RuntimeError(f"Book index for {args.pdf}: {book['error']}; pass --toc_start/--toc_end")
+        toc_text, toc_entries = book["toc_text"], book["toc_entries"]
+        toc_pages = book["toc_pages"]
+    else:
+        toc_pages = [args.toc_start or 10, args.toc_end or 14]
+        toc_text = extract_pages_text(args.pdf, *toc_pages)
+        toc_entries = parse_toc_entries(toc_text)
 
     ts = datetime.now().strftime("%Y%m%d_%H%M%S")
     default_prefix = os.path.join(os.path.dirname(args.generated), f"stage1_chapter_mapping_{ts}")
     out_prefix = args.out or default_prefix
     os.makedirs(os.path.dirname(out_prefix), exist_ok=True)
 
-    results: List[Dict] = []
-    for item in sample:
-        try:
-            pick = llm_pick_chapter(item, toc_entries, toc_text)
-            results.append({
-                "skill": item.get("skill"),
-                "problem_type": item.get("problem_type"),
-                "format_title": item.get("generated_format", {}).get("title"),
+    # LLM picks are checkpointed per format (by its position in --generated) as they arrive
+    checkpoint = JsonlCheckpoint(f"{out_prefix}.checkpoint.jsonl")
+    if not args.resume:
+        checkpoint.remove()
+    checkpointed = checkpoint.load()
+
+    # Cascade: formats that clearly match one chapter locally skip the LLM
+    outcomes: List[Tuple[Optional[ChapterPick], Optional[Exception]]] = [(None, None)] * len(sample)
+    sources = ["llm"] * len(sample)
+    escalated = list(range(len(sample)))
+    cascade = None
+    if not args.no_cascade:
+        matcher = ChapterMatcher(toc_entries, load_skill_names(), args.min_score, args.min_margin)
+        escalated = []
+        for position, item in enumerate(sample):
+            match = matcher.match(item)
+            if match["accepted"]:
+                outcomes[position] = (lexical_pick(match), None)
+                sources[position] = "lexical"
+            else:
+                escalated.append(position)
+        lexical = len(sample) - len(escalated)
+        cascade = {
+            "min_score": args.min_score,
+            "min_margin": args.min_margin,
+            "lexical": lexical,
+            "escalated": len(escalated),
+            "escalation_rate": round(len(escalated) / len(sample), 4),
+        }
+        print(f"Matched {lexical}/{len(sample)} formats locally; {len(escalated)} escalated to the LLM")
+
+    lexical_positions = [p for p in range(len(sample)) if sources[p] == "lexical"]
+    random.seed(args.seed)
+    validation = random.sample(lexical_positions, k=min(args.validate, len(lexical_positions)))
+
+    batch_size = batch_size_for_response_limit(args.batch_size, args.max_response_tokens)
+    llm_positions = escalated + sorted(validation)
+    llm_picks: Dict[int, Tuple[Optional[ChapterPick], Optional[Exception]]] = {}
+    for position in llm_positions:
+        saved = checkpointed.get(str(indices[position]))
+        if saved and tuple(saved["format"]) == format_key(format_result(sample[position])):
+            llm_picks[position] = (ChapterPick.model_validate(saved["pick"]), None)
+    to_pick = [p for p in llm_positions if p not in llm_picks]
+    if llm_picks:
+        print(f"Resuming: {len(llm_picks)} LLM picks loaded from {checkpoint.path}")
+    if to_pick:
+        print(f"Mapping {len(to_pick)} formats with the LLM, {batch_size} per call, {args.workers} calls at a time")
+
+        def save_pick(n: int, pick: ChapterPick) -> None:
+            position = to_pick[n]
+            checkpoint.append(indices[position], {
+                "format": list(format_key(format_result(sample[position]))),
                 "pick": pick.model_dump(),
             })
-        except Exception as e:
-            results.append({
-                "skill": item.get("skill"),
-                "problem_type": item.get("problem_type"),
-                "format_title": item.get("generated_format", {}).get("title"),
-                "error": str(e),
-            })
+
+        picked = pick_chapters_batched([sample[p] for p in to_pick], toc_entries, toc_text, make_client(), batch_size,
+                                       workers=args.workers, limiter=RateLimiter(args.rpm), on_pick=save_pick)
+        llm_picks.update(zip(to_pick, picked))
+    for position in escalated:
+        outcomes[position] = llm_picks[position]
+
+    results: List[Dict] = []
+    for item, (pick, error), source in zip(sample, outcomes, sources):
+        if error is None:
+            results.append({**format_result(item), "source": source, "pick": pick.model_dump()})
+        else:
+            results.append({**format_result(item), "source": source, "error": str(error)})
+
+    if cascade is not None:
+        # Agreement of local matches with LLM picks: validation calls made now, and an earlier run's picks
+        if validation:
+            checked = sorted(validation)
+            cascade["validation"] = agreement_report(
+                [results[p]["pick"]["chapter_title"] for p in checked],
+                [llm_picks[p][0].chapter_title if llm_picks[p][0] else None for p in checked],
+                [results[p]["format_title"] or results[p]["problem_type"] for p in checked],
+            )
+        if args.compare_with:
+            earlier = load_llm_picks(args.compare_with)
+            checked = [p for p in lexical_positions if format_key(results[p]) in earlier]
+            cascade["compared_with"] = {"path": args.compare_with, **agreement_report(
+                [results[p]["pick"]["chapter_title"] for p in checked],
+                [earlier[format_key(results[p])] for p in checked],
+                [results[p]["format_title"] or results[p]["problem_type"] for p in checked],
+            )}
+        for label in ("validation", "compared_with"):
+            report = cascade.get(label)
+            if report and report["compared"]:
+                print(f"Local vs LLM agreement ({label}): {report['agreed']}/{report['compared']} ({report['agreement_rate']:.0%})")
 
     out_json = f"{out_prefix}.json"
     with open(out_json, "w", encoding="utf-8") as f:
@@ -239,13 +455,21 @@ def main():
                 "generated_formats_path": args.generated,
                 "pdf_path": args.pdf,
                 "validated_at": datetime.now().isoformat(),
-                "toc_pages": f"{args.toc_start}-{args.toc_end}",
+                "toc_pages": f"{toc_pages[0]}-{toc_pages[1]}",
                 "num_items": len(results),
+                "sampled": args.num is not None,
+                "batch_size": batch_size,
+                "cascade": cascade,
+                "workers": args.workers,
             },
             "toc_entries": toc_entries,
             "results": results,
         }, f, indent=2, ensure_ascii=False)
 
+    if any("error" in result for result in results):
+        print(f"Some formats failed; rerun with --out {out_prefix} --resume to retry only those")
+    else:
+        checkpoint.remove()
     print(f"Stage 1 complete. Output: {out_json}")
 
 
@@ -1,5 +1,4 @@
 import os
-import re
 import json
 import argparse
 from datetime import datetime
@@ -8,7 +7,12 @@ from typing import List, Dict, Optional, Tuple
 import pdfplumber
 from pydantic import BaseModel
 from google import genai
-from dotenv import load_dotenv
+
+from artifacts import JsonlCheckpoint, open_artifact, skill_problem_type_key
+from llm_concurrency import RateLimiter, call_with_retries, run_ordered
+from stage1_map_formats_to_chapters import make_client
+from book_index import normalize
+from build_book_index import load_book_index
 
 
 class SupportJudgment(BaseModel):
@@ -18,10 +22,6 @@ class SupportJudgment(BaseModel):
     reasoning: str
 
 
-def normalize(s: str) -> str:
-    return re.sub(r"\s+", " ", (s or "").strip()).lower()
-
-
 def find_chapter_range(toc_entries: List[Dict], pick_title: str, pick_start: int) -> Tuple[int, int, Dict, int]:
     # Resolve the pick to a ToC entry by best match on title (substring both ways) and/or start_page
     pick_title_norm = normalize(pick_title)
@@ -60,6 +60,49 @@ def find_chapter_range(toc_entries: List[Dict], pick_title: str, pick_start: int
     return start_page, end_page, e, idx
 
 
+def resolve_formats(reader, picks: List[Dict]) -> List[Optional[Dict]]:
+    """
+    Find the generated format for every stage 1 pick.
+
+    Candidate ordinals come from the artifact's (skill, problem_type) index,
+    falling back to normalized skill + problem_type. All candidates are then
+    fetched with a single records() call, so a legacy .json artifact is
+    streamed a fixed number of times instead of once per pick.
+
+    Args:
+        reader: ArtifactReader over the generated formats
+        picks: Stage 1 results, in order
+
+    Returns:
+        The matching format (or None) per pick
+    """
+    by_key = reader.index["keys"].get("skill_problem_type", {})
+    normalized_index: Optional[Dict[Tuple[str, str], int]] = None
+    pick_ordinals: List[List[int]] = []
+    for pick in picks:
+        ordinals = by_key.get(skill_problem_type_key(pick.get("skill"), pick.get("problem_type")), [])
+        if not ordinals:
+            # fallback: match by normalized skill + problem_type (index built in one pass on first use)
+            if normalized_index is None:
+                normalized_index = {}
+                for ordinal, it in enumerate(reader):
+                    normalized_index.setdefault((normalize(it.get("skill")), normalize(it.get("problem_type"))), ordinal)
+            ordinal = normalized_index.get((normalize(pick.get("skill")), normalize(pick.get("problem_type"))))
+            ordinals = [ordinal] if ordinal is not None else []
+        pick_ordinals.append(ordinals)
+
+    wanted = sorted({ordinal for ordinals in pick_ordinals for ordinal in ordinals})
+    fetched = dict(zip(wanted, reader.records(wanted)))
+
+    formats: List[Optional[Dict]] = []
+    for pick, ordinals in zip(picks, pick_ordinals):
+        candidates = [fetched[ordinal] for ordinal in ordinals]
+        t = normalize(pick.get("format_title"))
+        fmt = next((it for it in candidates if normalize(it.get("generated_format", {}).get("title")) == t), None)
+        formats.append(fmt if fmt is not None or not candidates else candidates[0])
+    return formats
+
+
 def extract_text_range(pdf_path: str, start_page: int, end_page: int) -> Tuple[str, Dict[int, str]]:
     pages: Dict[int, str] = {}
     parts: List[str] = []
@@ -80,69 +123,7 @@ def extract_text_range(pdf_path: str, start_page: int, end_page: int) -> Tuple[s
     return "\n".join(parts), pages
 
 
-def _norm(s: str) -> str:
-    return re.sub(r"\s+", " ", (s or "").strip()).lower()
-
-
-def _find_actual_start(pdf: pdfplumber.PDF, guess_start: int, title: str, window: int = 60) -> Optional[int]:
-    # Try to find the page within [guess_start - window, guess_start + window] that contains the chapter title
-    query = _norm(title)
-    total_pages = len(pdf.pages)
-    start = max(1, guess_start - window)
-    end = min(total_pages, guess_start + window)
-    for page_num in range(start, end + 1):
-        page = pdf.pages[page_num - 1]
-        text = page.extract_text() or ""
-        if not text:
-            try:
-                text = page.extract_text(x_tolerance=3, y_tolerance=3) or ""
-            except Exception:
-                text = ""
-        if not text:
-            continue
-        norm_text = _norm(text)
-        if query and query in norm_text:
-            return page_num
-        # Fallback: try matching without the "Chapter X" prefix if present
-        m = re.match(r"chapter\s+\d+\s+(.*)$", query)
-        if m:
-            tail = m.group(1)
-            if tail and tail in norm_text:
-                return page_num
-    return None
-
-
-def calibrate_page_offset(pdf_path: str, toc_entries: List[Dict]) -> int:
-    # Use several chapter entries to compute the most likely global offset between ToC numbers and PDF indices
-    candidates: List[int] = []
-    try:
-        with pdfplumber.open(pdf_path) as pdf:
-            for e in toc_entries:
-                title = e.get("chapter_title") or ""
-                if not title.lower().startswith("chapter "):
-                    continue
-                toc_start = e.get("start_page")
-                if not isinstance(toc_start, int):
-                    continue
-                found = _find_actual_start(pdf, toc_start, title, window=80)
-                if found is not None:
-                    candidates.append(found - toc_start)
-                if len(candidates) >= 6:
-                    break
-    except Exception:
-        return 0
-
-    if not candidates:
-        return 0
-    # Choose the median offset for robustness
-    candidates.sort()
-    mid = len(candidates) // 2
-    if len(candidates) % 2 == 1:
-        return candidates[mid]
-    return (candidates[mid - 1] + candidates[mid]) // 2
-
-
-def llm_judge_support(format_item: Dict, chapter_text: str) -> SupportJudgment:
+def llm_judge_support(format_item: Dict, chapter_text: str, client: Optional[genai.Client] = None) -> SupportJudgment:
     # Prepare a concise description of the format
     skill = format_item.get("skill")
     problem_type = format_item.get("problem_type")
@@ -164,18 +145,7 @@ Chapter text:
 Respond ONLY in JSON per the schema.
 """
 
-    # Initialize client
-    load_dotenv()
-    api_key = os.getenv("GEMINI_API_KEY") or os.getenv("GOOGLE_API_KEY")
-    if api_key:
-        client = genai.Client(api_key=api_key)
-    else:
-        try:
-            client = genai.Client()
-        except Exception as e:
-            raise RuntimeError("Google GenAI API key not found. Set GEMINI_API_KEY or GOOGLE_API_KEY in .env") from e
-
-    response = client.models.generate_content(
+    response = (client or make_client()).models.generate_content(
         model="gemini-2.5-pro",
         contents=prompt,
         config={
@@ -195,46 +165,57 @@ Respond ONLY in JSON per the schema.
 def main():
     parser = argparse.ArgumentParser(description="Stage 2: Validate formats against chapter content picked in Stage 1")
     parser.add_argument("--stage1", required=True, help="Path to stage1_chapter_mapping_*.json")
-    parser.add_argument("--generated", required=True, help="Path to generated_formats_*.json")
+    parser.add_argument("--generated", required=True, help="Path to generated_formats_*.json or a sharded generated_formats_* directory")
     parser.add_argument("--pdf", required=True, help="Path to Direct_Instruction_Mathematics.pdf")
-    parser.add_argument("--book_to_pdf_offset", type=int, default=17, help="PDF page = book page + offset (default 17)")
+    parser.add_argument("--book_to_pdf_offset", type=int, default=None, help="PDF page = book page + offset (default: the book index's calibrated offset)")
+    parser.add_argument("--index-dir", required=False, help="Directory of stored book indexes (default outputs/book_index)")
+    parser.add_argument("--calibrate", action="store_true", help="Rebuild this PDF's book index (ToC, page offset, chapter ranges) before using its offset")
+    parser.add_argument("--workers", type=int, default=4, help="Concurrent LLM calls (1 = serial)")
+    parser.add_argument("--rpm", type=float, default=30, help="Max Gemini requests per minute across workers (0 = unlimited)")
     parser.add_argument("--out", required=False, help="Output prefix (without extension)")
+    parser.add_argument("--resume", action="store_true", help="Reuse judgments checkpointed by an interrupted run with the same --out")
     args = parser.parse_args()
+    if args.resume and not args.out:
+        parser.error("--resume needs the --out prefix of the run to resume")
 
-    with open(args.stage1, "r", encoding="utf-8") as f:
-        s1 = json.load(f)
-    toc_entries = s1.get("toc_entries", [])
-    s1_results = s1.get("results", [])
-
-    with open(args.generated, "r", encoding="utf-8") as f:
-        gen_data = json.load(f)
-    gen_formats: List[Dict] = gen_data.get("generated_formats", [])
-
-    # Build quick index by (skill, problem_type, format_title)
-    def key_of(it: Dict) -> Tuple[str, str, str]:
-        return (
-            normalize(it.get("skill")),
-            normalize(it.get("problem_type")),
-            normalize(it.get("generated_format", {}).get("title"))
-        )
+    # Stage 1 picks are small records; the formats they name are resolved together in one pass
+    s1_reader = open_artifact(args.stage1, "results")
+    toc_entries = s1_reader.extra.get("toc_entries", [])
+    s1_results = list(iter(s1_reader))
 
-    idx_map: Dict[Tuple[str, str, str], Dict] = {}
-    for it in gen_formats:
-        idx_map[key_of(it)] = it
+    # Formats are fetched through the artifact's (skill, problem_type) index instead of loading them all
+    reader = open_artifact(args.generated, "generated_formats")
+    s1_formats = resolve_formats(reader, s1_results)
 
-    # Use fixed offset
+    # The offset is calibrated once per PDF by build_book_index.py unless given explicitly
     page_offset = args.book_to_pdf_offset
+    if page_offset is None:
+        book = load_book_index(args.pdf, args.index_dir, rebuild=args.calibrate)
+        if book.get("error"):
+            raise RuntimeError(f"Book index for {args.pdf}: {book['error']}; pass --book_to_pdf_offset")
+        if not book.get("offset_votes"):
+            raise RuntimeError(f"Book index for {args.pdf} found no chapter title pages to calibrate the page offset; "
+                               f"pass --book_to_pdf_offset")
+        page_offset = book["page_offset"]
+        print(f"Using calibrated page offset {page_offset:+d}")
 
-    results_out: List[Dict] = []
+    ts = datetime.now().strftime("%Y%m%d_%H%M%S")
+    default_prefix = os.path.join(os.path.dirname(args.stage1), f"stage2_validation_{ts}")
+    out_prefix = args.out or default_prefix
+    os.makedirs(os.path.dirname(out_prefix), exist_ok=True)
 
-    for pick in s1_results:
-        s = normalize(pick.get("skill"))
-        p = normalize(pick.get("problem_type"))
-        t = normalize(pick.get("format_title"))
-        fmt = idx_map.get((s, p, t))
-        if fmt is None:
-            # fallback: match by skill + problem_type
-            fmt = next((it for it in gen_formats if normalize(it.get("skill")) == s and normalize(it.get("problem_type")) == p), None)
+    # Judgments are checkpointed per stage 1 result (by its position) as they arrive
+    checkpoint = JsonlCheckpoint(f"{out_prefix}.checkpoint.jsonl")
+    if not args.resume:
+        checkpoint.remove()
+    checkpointed = checkpoint.load()
+
+    # Resolve every pick first; chapter text is extracted once per chapter, not once per format
+    results_out: List[Optional[Dict]] = []
+    jobs: List[Tuple[int, Dict, str]] = []
+    chapter_texts: Dict[Tuple[int, int], Tuple[str, Dict[int, str]]] = {}
+    resumed = 0
+    for position, (pick, fmt) in enumerate(zip(s1_results, s1_formats)):
         if fmt is None:
             results_out.append({
                 "skill": pick.get("skill"),
@@ -263,7 +244,15 @@ def main():
         else:
             end_page_real = start_page_real + 40
 
-        chapter_text, page_texts = extract_text_range(args.pdf, start_page_real, end_page_real)
+        saved = checkpointed.get(str(position))
+        if saved and saved.get("format_title") == pick.get("format_title") and "judgment" in saved:
+            results_out.append(saved)
+            resumed += 1
+            continue
+
+        if (start_page_real, end_page_real) not in chapter_texts:
+            chapter_texts[(start_page_real, end_page_real)] = extract_text_range(args.pdf, start_page_real, end_page_real)
+        chapter_text, page_texts = chapter_texts[(start_page_real, end_page_real)]
 
         # Extract first 50-100 words from start page for verification
         book_content_preview = ""
@@ -271,40 +260,38 @@ def main():
             words = page_texts[start_page_real].split()[:100]
             book_content_preview = " ".join(words)
 
-        try:
-            judgment = llm_judge_support(fmt, chapter_text)
-            results_out.append({
-                "skill": pick.get("skill"),
-                "problem_type": pick.get("problem_type"),
-                "format_title": pick.get("format_title"),
-                "chapter": {
-                    "title": resolved_toc.get("chapter_title"),
-                    "start_page": start_page_real,
-                    "end_page": end_page_real,
-                    "page_offset": page_offset,
-                    "book_content_preview": book_content_preview,
-                },
-                "judgment": judgment.model_dump(),
-            })
-        except Exception as e:
-            results_out.append({
-                "skill": pick.get("skill"),
-                "problem_type": pick.get("problem_type"),
-                "format_title": pick.get("format_title"),
-                "chapter": {
-                    "title": resolved_toc.get("chapter_title"),
-                    "start_page": start_page_real,
-                    "end_page": end_page_real,
-                    "page_offset": page_offset,
-                    "book_content_preview": book_content_preview,
-                },
-                "error": str(e),
-            })
-
-    ts = datetime.now().strftime("%Y%m%d_%H%M%S")
-    default_prefix = os.path.join(os.path.dirname(args.stage1), f"stage2_validation_{ts}")
-    out_prefix = args.out or default_prefix
-    os.makedirs(os.path.dirname(out_prefix), exist_ok=True)
+        results_out.append({
+            "skill": pick.get("skill"),
+            "problem_type": pick.get("problem_type"),
+            "format_title": pick.get("format_title"),
+            "chapter": {
+                "title": resolved_toc.get("chapter_title"),
+                "start_page": start_page_real,
+                "end_page": end_page_real,
+                "page_offset": page_offset,
+                "book_content_preview": book_content_preview,
+            },
+        })
+        jobs.append((position, fmt, chapter_text))
+
+    if resumed:
+        print(f"Resuming: {resumed} judgments loaded from {checkpoint.path}")
+    print(f"Judging {len(jobs)} formats against {len(chapter_texts)} chapters, {args.workers} calls at a time")
+    client = make_client() if jobs else None
+    limiter = RateLimiter(args.rpm)
+
+    def judge(job: Tuple[int, Dict, str]) -> SupportJudgment:
+        position, fmt, chapter_text = job
+        judgment = call_with_retries(llm_judge_support, fmt, chapter_text, client,
+                                     limiter=limiter, label=f"[result {position}] ")
+        checkpoint.append(position, {**results_out[position], "judgment": judgment.model_dump()})
+        return judgment
+
+    for (position, _, _), (judgment, error) in zip(jobs, run_ordered(jobs, judge, max_workers=args.workers)):
+        if error is None:
+            results_out[position]["judgment"] = judgment.model_dump()
+        else:
+            results_out[position]["error"] = str(error)
 
     out_json = f"{out_prefix}.json"
     with open(out_json, "w", encoding="utf-8") as f:
@@ -315,10 +302,15 @@ def main():
                 "pdf_path": args.pdf,
                 "validated_at": datetime.now().isoformat(),
                 "total_items": len(results_out),
+                "workers": args.workers,
             },
             "results": results_out,
         }, f, indent=2, ensure_ascii=False)
 
+    if any("error" in result for result in results_out):
+        print(f"Some formats failed; rerun with --out {out_prefix} --resume to retry only those")
+    else:
+        checkpoint.remove()
     print(f"Stage 2 complete. Output: {out_json}")
 
 